@@ -1,14 +1,38 @@
 """
 Agent基类 - 定义Agent的通用接口
 """
+import hashlib
+import json
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Iterator, Optional, Tuple
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
 from langchain_core.tools import BaseTool
+from core.react_parser import ReActStreamParser, extract_final_answer
+
+
+def _content_to_text(content: Any) -> str:
+    """将消息content统一转换为文本（Gemini等模型可能返回分段列表）"""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, str):
+                parts.append(part)
+            elif isinstance(part, dict) and part.get("type") == "text":
+                parts.append(part.get("text", ""))
+        return "".join(parts)
+    return str(content)
 
 
 class BaseAgent(ABC):
     """Agent基类"""
     
+    # 系统提示词（子类覆盖），同时参与Agent版本指纹的计算
+    system_prompt: str = ""
+    
     def __init__(self, name: str, tools: List[BaseTool], llm, config: Dict[str, Any] = None):
         """
         初始化Agent
@@ -23,13 +47,34 @@ class BaseAgent(ABC):
         self.tools = tools
         self.llm = llm
         self.config = config or {}
+        self.model_type = None  # 由AgentFactory设置，用于健康状态记录和结果中的模型类型
         self._agent_executor = None
+        self._version = None
     
     @abstractmethod
     def create_agent_executor(self):
         """创建Agent执行器（返回create_agent创建的agent）"""
         pass
     
+    def get_version(self) -> str:
+        """
+        获取Agent版本指纹
+        
+        由Agent类、系统提示词和工具集（名称、描述、参数结构）计算得到，
+        任意一项变化都会得到新的版本，供响应缓存等按版本失效。
+        """
+        if self._version is None:
+            tool_specs = []
+            for tool in sorted(self.tools, key=lambda t: t.name):
+                args_schema = getattr(tool, "args", None) or {}
+                tool_specs.append([tool.name, tool.description, args_schema])
+            payload = json.dumps(
+                [type(self).__name__, self.system_prompt, tool_specs],
+                ensure_ascii=False, sort_keys=True, default=str
+            )
+            self._version = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        return self._version
+    
     def get_agent_executor(self):
         """获取Agent执行器（懒加载）"""
         if self._agent_executor is None:
@@ -40,106 +85,283 @@ class BaseAgent(ABC):
         """调用Agent（核心执行逻辑）"""
         executor = self.get_agent_executor()
         if "input" in input_data:
-            from langchain_core.messages import HumanMessage
-            messages = [HumanMessage(content=input_data["input"])]
-            
-            # 确保callbacks正确传递
-            # LangChain的invoke方法需要config参数包含callbacks
-            invoke_config = {}
-            if "config" in kwargs:
-                invoke_config = kwargs["config"].copy() if isinstance(kwargs["config"], dict) else {}
-            
-            # 确保callbacks在config中
-            if "callbacks" not in invoke_config and "callbacks" in kwargs:
-                invoke_config["callbacks"] = kwargs["callbacks"]
-            
-            # 设置recursion_limit以确保工具调用能够完成
-            if invoke_config:
-                if "recursion_limit" not in invoke_config:
-                    invoke_config["recursion_limit"] = 20
-            else:
-                invoke_config = {"recursion_limit": 20}
+            result = executor.invoke(
+                self._build_graph_input(input_data),
+                config=self._build_invoke_config(kwargs)
+            )
+            return self._extract_output(result)
+        else:
+            return executor.invoke(input_data, **kwargs)
+    
+    def batch(self, inputs: List[Dict[str, Any]], max_concurrency: int = None, **kwargs) -> List[Any]:
+        """
+        批量调用Agent（复用同一个执行器，由执行器的batch控制并发）
+        
+        Args:
+            inputs: 输入数据列表（每项需包含input字段）
+            max_concurrency: 最大并发数（None表示不限制）
+            **kwargs: 其他参数（如config/callbacks）
+        
+        Returns:
+            与inputs一一对应的结果列表；单项出错时对应位置为异常对象
+        """
+        if not inputs:
+            return []
+        executor = self.get_agent_executor()
+        results = executor.batch(
+            [self._build_graph_input(item) for item in inputs],
+            config=self._build_batch_config(kwargs, max_concurrency),
+            return_exceptions=True
+        )
+        return [r if isinstance(r, Exception) else self._extract_output(r) for r in results]
+    
+    async def abatch(self, inputs: List[Dict[str, Any]], max_concurrency: int = None, **kwargs) -> List[Any]:
+        """异步批量调用Agent，返回值与batch()相同"""
+        if not inputs:
+            return []
+        executor = self.get_agent_executor()
+        results = await executor.abatch(
+            [self._build_graph_input(item) for item in inputs],
+            config=self._build_batch_config(kwargs, max_concurrency),
+            return_exceptions=True
+        )
+        return [r if isinstance(r, Exception) else self._extract_output(r) for r in results]
+    
+    def stream(self, input_data: Dict[str, Any], **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        流式调用Agent，边执行边产出事件
+        
+        事件格式: {"type": "token" | "answer_start" | "answer" | "tool_start" | "tool_end" | "final", ...}
+        
+        token会同时交给增量ReAct解析器，识别到"最终答案:"时立即产出answer_start，
+        之后逐段产出answer（只含最终答案的文本）。Agent配置了stop_on_final_answer时，
+        最终答案段落一结束就产出final并停止生成，不再等待模型输出剩余内容。
+        
+        Args:
+            input_data: 输入数据（需包含input字段）
+            **kwargs: 其他参数（如config/callbacks）
+        """
+        executor = self.get_agent_executor()
+        last_ai_message = None
+        parser = ReActStreamParser()
+        chunks = executor.stream(
+            self._build_graph_input(input_data),
+            config=self._build_invoke_config(kwargs),
+            stream_mode=["messages", "updates"]
+        )
+        try:
+            for mode, chunk in chunks:
+                events, ai_message = self._convert_stream_chunk(mode, chunk)
+                if ai_message is not None:
+                    last_ai_message = ai_message
+                events, parser = self._parse_answer_events(events, parser)
+                yield from events
+                if self._should_stop_streaming(parser):
+                    yield {"type": "final", "output": parser.final_answer}
+                    return
+        finally:
+            chunks.close()
+        
+        yield self._build_final_event(last_ai_message)
+    
+    async def ainvoke(self, input_data: Dict[str, Any], **kwargs) -> Any:
+        """异步调用Agent（等待模型I/O时不占用线程）"""
+        executor = self.get_agent_executor()
+        if "input" in input_data:
+            result = await executor.ainvoke(
+                self._build_graph_input(input_data),
+                config=self._build_invoke_config(kwargs)
+            )
+            return self._extract_output(result)
+        else:
+            return await executor.ainvoke(input_data, **kwargs)
+    
+    async def astream(self, input_data: Dict[str, Any], **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """异步流式调用Agent，事件格式与stream()相同"""
+        executor = self.get_agent_executor()
+        last_ai_message = None
+        parser = ReActStreamParser()
+        chunks = executor.astream(
+            self._build_graph_input(input_data),
+            config=self._build_invoke_config(kwargs),
+            stream_mode=["messages", "updates"]
+        )
+        try:
+            async for mode, chunk in chunks:
+                events, ai_message = self._convert_stream_chunk(mode, chunk)
+                if ai_message is not None:
+                    last_ai_message = ai_message
+                events, parser = self._parse_answer_events(events, parser)
+                for event in events:
+                    yield event
+                if self._should_stop_streaming(parser):
+                    yield {"type": "final", "output": parser.final_answer}
+                    return
+        finally:
+            # 提前结束时关闭执行器的流，取消仍在进行的模型调用
+            await chunks.aclose()
+        
+        yield self._build_final_event(last_ai_message)
+    
+    def _build_graph_input(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """将 {"input": ...} 转换为create_agent图需要的messages输入"""
+        return {"messages": [HumanMessage(content=input_data["input"])]}
+    
+    def _build_invoke_config(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """构造执行器的config（确保callbacks和recursion_limit正确传递）"""
+        # LangChain的invoke方法需要config参数包含callbacks
+        invoke_config = {}
+        if "config" in kwargs:
+            invoke_config = kwargs["config"].copy() if isinstance(kwargs["config"], dict) else {}
+        
+        # 确保callbacks在config中
+        if "callbacks" not in invoke_config and "callbacks" in kwargs:
+            invoke_config["callbacks"] = kwargs["callbacks"]
+        
+        # 设置recursion_limit以确保工具调用能够完成
+        if "recursion_limit" not in invoke_config:
+            invoke_config["recursion_limit"] = 20
+        
+        # Agent名称和Provider随metadata传给回调（运行记录按Agent汇总）
+        invoke_config["metadata"] = {
+            "agent_name": self.name,
+            "model_type": self.model_type,
+            **(invoke_config.get("metadata") or {}),
+        }
+        return invoke_config
+    
+    def _build_batch_config(self, kwargs: Dict[str, Any], max_concurrency: int = None) -> Dict[str, Any]:
+        """构造批量执行的config（所有输入共享callbacks，并限制并发数）"""
+        batch_config = self._build_invoke_config(kwargs)
+        if max_concurrency:
+            batch_config["max_concurrency"] = max_concurrency
+        return batch_config
+    
+    def _extract_output(self, result: Any) -> Any:
+        """从执行器结果中提取最终输出"""
+        # 提取最后一条消息的内容
+        output_text = None
+        if isinstance(result, dict) and "messages" in result and result["messages"]:
+            # 查找最后一条AIMessage（没有tool_calls的，表示最终答案）
+            messages_list = result["messages"]
+            last_ai_message = None
             
-            result = executor.invoke({"messages": messages}, config=invoke_config)
+            # 从后往前查找最后一条AIMessage
+            for msg in reversed(messages_list):
+                if isinstance(msg, AIMessage):
+                    # 如果这条AIMessage没有tool_calls，说明是最终答案
+                    if not (hasattr(msg, 'tool_calls') and msg.tool_calls):
+                        last_ai_message = msg
+                        break
+                    # 如果有tool_calls，继续查找下一条
             
-            # 提取最后一条消息的内容
-            output_text = None
-            if "messages" in result and result["messages"]:
-                # 查找最后一条AIMessage（没有tool_calls的，表示最终答案）
-                messages_list = result["messages"]
-                last_ai_message = None
-                
-                # 从后往前查找最后一条AIMessage
+            # 如果没找到没有tool_calls的AIMessage，使用最后一条AIMessage
+            if last_ai_message is None:
                 for msg in reversed(messages_list):
-                    from langchain_core.messages import AIMessage
                     if isinstance(msg, AIMessage):
-                        # 如果这条AIMessage没有tool_calls，说明是最终答案
-                        if not (hasattr(msg, 'tool_calls') and msg.tool_calls):
-                            last_ai_message = msg
-                            break
-                        # 如果有tool_calls，继续查找下一条
-                
-                # 如果没找到没有tool_calls的AIMessage，使用最后一条AIMessage
-                if last_ai_message is None:
-                    for msg in reversed(messages_list):
-                        from langchain_core.messages import AIMessage
-                        if isinstance(msg, AIMessage):
-                            last_ai_message = msg
-                            break
-                
-                # 如果还是没找到，使用最后一条消息
-                if last_ai_message is None:
-                    last_ai_message = messages_list[-1]
-                
-                if hasattr(last_ai_message, "content"):
-                    output_text = last_ai_message.content
-                elif hasattr(last_ai_message, "text"):
-                    output_text = last_ai_message.text
+                        last_ai_message = msg
+                        break
             
-            # 如果输出是ReAct格式，提取最终答案
-            if output_text:
-                output_text = self._extract_final_answer(output_text)
+            # 如果还是没找到，使用最后一条消息
+            if last_ai_message is None:
+                last_ai_message = messages_list[-1]
             
-            if output_text:
-                return {"output": output_text}
-            return result
-        else:
-            return executor.invoke(input_data, **kwargs)
+            if hasattr(last_ai_message, "content"):
+                output_text = last_ai_message.content
+            elif hasattr(last_ai_message, "text"):
+                output_text = last_ai_message.text
+        
+        # 如果输出是ReAct格式，提取最终答案
+        if output_text:
+            output_text = self._extract_final_answer(output_text)
+        
+        if output_text:
+            return {"output": output_text}
+        return result
+    
+    def _convert_stream_chunk(self, mode: str, chunk: Any) -> Tuple[List[Dict[str, Any]], Optional[AIMessage]]:
+        """
+        将LangGraph的stream输出转换为流式事件
+        
+        Returns:
+            (事件列表, 本次输出中不带tool_calls的AIMessage（可能是最终答案）)
+        """
+        events = []
+        final_message = None
+        if mode == "messages":
+            # messages模式: (消息块, 元数据)，只转发模型节点产生的token
+            message_chunk, metadata = chunk
+            if isinstance(message_chunk, AIMessageChunk):
+                text = _content_to_text(message_chunk.content)
+                if text:
+                    events.append({
+                        "type": "token",
+                        "content": text,
+                        "node": (metadata or {}).get("langgraph_node")
+                    })
+        elif mode == "updates" and isinstance(chunk, dict):
+            # updates模式: {节点名: 节点输出}
+            for update in chunk.values():
+                if not isinstance(update, dict):
+                    continue
+                for msg in update.get("messages", []) or []:
+                    if isinstance(msg, AIMessage):
+                        if getattr(msg, "tool_calls", None):
+                            for tool_call in msg.tool_calls:
+                                events.append({
+                                    "type": "tool_start",
+                                    "tool_name": tool_call.get("name", "unknown"),
+                                    "tool_args": tool_call.get("args", {}),
+                                    "tool_call_id": tool_call.get("id")
+                                })
+                        else:
+                            final_message = msg
+                    elif isinstance(msg, ToolMessage):
+                        events.append({
+                            "type": "tool_end",
+                            "tool_name": getattr(msg, "name", None) or "unknown",
+                            "tool_call_id": getattr(msg, "tool_call_id", None),
+                            "output": _content_to_text(msg.content)
+                        })
+        return events, final_message
+    
+    def _parse_answer_events(
+        self,
+        events: List[Dict[str, Any]],
+        parser: ReActStreamParser
+    ) -> Tuple[List[Dict[str, Any]], ReActStreamParser]:
+        """
+        把token交给ReAct解析器，在token之后插入识别到的最终答案事件
+        
+        工具调用开始说明这一轮模型输出不是最终回复，换一个新的解析器解析下一轮输出。
+        """
+        result = []
+        for event in events:
+            result.append(event)
+            if event["type"] == "tool_start":
+                parser = ReActStreamParser()
+            elif event["type"] == "token":
+                for parsed in parser.feed(event["content"]):
+                    if parsed["type"] == "final_answer_start":
+                        result.append({"type": "answer_start"})
+                    elif parsed["type"] == "final_answer_delta":
+                        result.append({"type": "answer", "content": parsed["content"]})
+        return result, parser
+    
+    def _should_stop_streaming(self, parser: ReActStreamParser) -> bool:
+        """最终答案段落已结束，且Agent配置了stop_on_final_answer"""
+        return parser.final_answer_done and bool(parser.final_answer) and self.config.get("stop_on_final_answer", False)
+    
+    def _build_final_event(self, last_ai_message: Optional[AIMessage]) -> Dict[str, Any]:
+        """根据最后一条AIMessage构造final事件"""
+        output_text = ""
+        if last_ai_message is not None:
+            output_text = self._extract_final_answer(_content_to_text(last_ai_message.content))
+        return {"type": "final", "output": output_text or ""}
     
     def _extract_final_answer(self, text: str) -> str:
-        """从ReAct格式输出中提取最终答案"""
-        if not text:
-            return text
-        
-        # 查找"最终答案:"或"Final Answer:"后面的内容
-        import re
-        
-        # 尝试匹配中文"最终答案:"
-        pattern_zh = r'最终答案[：:]\s*(.+?)(?:\n\n|\n思考:|$)'
-        match_zh = re.search(pattern_zh, text, re.DOTALL | re.IGNORECASE)
-        if match_zh:
-            answer = match_zh.group(1).strip()
-            # 如果答案很长，可能包含多行，取第一段
-            if '\n' in answer:
-                answer = answer.split('\n')[0].strip()
-            return answer
-        
-        # 尝试匹配英文"Final Answer:"
-        pattern_en = r'Final Answer[：:]\s*(.+?)(?:\n\n|\nThought:|$)'
-        match_en = re.search(pattern_en, text, re.DOTALL | re.IGNORECASE)
-        if match_en:
-            answer = match_en.group(1).strip()
-            if '\n' in answer:
-                answer = answer.split('\n')[0].strip()
-            return answer
-        
-        # 如果没有找到"最终答案"，检查是否整个输出就是一个简单的回答
-        # 如果输出很短且不包含"思考"、"行动"等关键词，可能是直接答案
-        if len(text) < 200 and not any(keyword in text for keyword in ['思考:', '行动:', '观察:', 'Thought:', 'Action:', 'Observation:']):
-            return text.strip()
-        
-        # 如果找不到最终答案，返回原始文本（至少能看到完整输出）
-        return text
+        """从ReAct格式输出中提取最终答案（见core.react_parser.extract_final_answer）"""
+        return extract_final_answer(text)
     
     def get_description(self) -> str:
         """获取Agent描述"""
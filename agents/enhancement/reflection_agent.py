@@ -3,7 +3,7 @@
 作为增强Agent的一种，继承BaseAgent
 """
 from typing import Dict, Any, List
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langchain_core.tools import Tool
 from agents.base.base_agent import BaseAgent
 
@@ -27,12 +27,9 @@ class ReflectionAgent(BaseAgent):
             config=config or {}
         )
         
-        self.reflection_prompt_template = """你是一个反思评估助手。请评估以下Agent的输出质量。
-
-用户输入: {user_input}
-
-Agent的初始输出:
-{initial_output}
+        # 提示词分为固定的系统提示词和变化的输入两部分，
+        # 系统提示词在前且逐字节不变，重复调用可以命中Provider的提示词前缀缓存
+        self.reflection_system_prompt = """你是一个反思评估助手。请评估用户给出的Agent输出质量。
 
 请进行以下评估：
 1. 输出是否准确回答了用户的问题？
@@ -44,21 +41,26 @@ Agent的初始输出:
 评估结果: [你的评估]
 是否需要改进: [是/否]
 改进建议: [如果需要改进，提供具体建议]"""
-        
-        self.improvement_prompt_template = """基于以下反思，请改进Agent的输出。
 
-用户输入: {user_input}
-初始输出: {initial_output}
-反思评估: {reflection_text}
+        self.reflection_input_template = """用户输入: {user_input}
+
+Agent的初始输出:
+{initial_output}"""
+
+        self.improvement_system_prompt = """请基于反思评估改进Agent的输出。
 
 请提供改进后的输出，确保：
 1. 更准确地回答用户问题
 2. 更完整地提供信息
 3. 修正所有错误
-4. 保持友好和专业的语气
+4. 保持友好和专业的语气"""
+
+        self.improvement_input_template = """用户输入: {user_input}
+初始输出: {initial_output}
+反思评估: {reflection_text}
 
 改进后的输出:"""
-    
+
     def create_agent_executor(self):
         """反思Agent不需要executor，直接使用LLM"""
         # 返回None，因为反思Agent直接使用LLM，不通过create_agent
@@ -66,44 +68,85 @@ Agent的初始输出:
     
     def reflect(self, user_input: str, agent_output: str, callbacks: List = None) -> Dict[str, Any]:
         """执行反思评估"""
-        prompt = self.reflection_prompt_template.format(
-            user_input=user_input,
-            initial_output=agent_output
+        messages = self._build_messages(
+            self.reflection_system_prompt,
+            self.reflection_input_template.format(user_input=user_input, initial_output=agent_output)
         )
         
         # 使用callbacks记录日志
         if callbacks:
-            response = self.llm.invoke([HumanMessage(content=prompt)], config={"callbacks": callbacks})
+            response = self.llm.invoke(messages, config={"callbacks": callbacks})
         else:
-            response = self.llm.invoke([HumanMessage(content=prompt)])
-        reflection_text = response.content if hasattr(response, 'content') else str(response)
-        
-        # 解析反思结果
-        needs_improvement = self._parse_reflection(reflection_text)
+            response = self.llm.invoke(messages)
+        return self._build_reflection_result(response, agent_output)
+    
+    async def areflect(self, user_input: str, agent_output: str, callbacks: List = None) -> Dict[str, Any]:
+        """异步执行反思评估"""
+        messages = self._build_messages(
+            self.reflection_system_prompt,
+            self.reflection_input_template.format(user_input=user_input, initial_output=agent_output)
+        )
         
-        return {
-            'reflection': reflection_text,
-            'needs_improvement': needs_improvement,
-            'original_output': agent_output
-        }
+        if callbacks:
+            response = await self.llm.ainvoke(messages, config={"callbacks": callbacks})
+        else:
+            response = await self.llm.ainvoke(messages)
+        return self._build_reflection_result(response, agent_output)
     
     def improve(self, user_input: str, original_output: str, reflection_text: str, callbacks: List = None) -> str:
         """基于反思改进输出"""
-        prompt = self.improvement_prompt_template.format(
-            user_input=user_input,
-            initial_output=original_output,
-            reflection_text=reflection_text
+        messages = self._build_messages(
+            self.improvement_system_prompt,
+            self.improvement_input_template.format(
+                user_input=user_input,
+                initial_output=original_output,
+                reflection_text=reflection_text
+            )
         )
         
         # 使用callbacks记录日志
         if callbacks:
-            response = self.llm.invoke([HumanMessage(content=prompt)], config={"callbacks": callbacks})
+            response = self.llm.invoke(messages, config={"callbacks": callbacks})
         else:
-            response = self.llm.invoke([HumanMessage(content=prompt)])
+            response = self.llm.invoke(messages)
         improved_output = response.content if hasattr(response, 'content') else str(response)
         
         return improved_output
     
+    async def aimprove(self, user_input: str, original_output: str, reflection_text: str, callbacks: List = None) -> str:
+        """异步基于反思改进输出"""
+        messages = self._build_messages(
+            self.improvement_system_prompt,
+            self.improvement_input_template.format(
+                user_input=user_input,
+                initial_output=original_output,
+                reflection_text=reflection_text
+            )
+        )
+        
+        if callbacks:
+            response = await self.llm.ainvoke(messages, config={"callbacks": callbacks})
+        else:
+            response = await self.llm.ainvoke(messages)
+        return response.content if hasattr(response, 'content') else str(response)
+    
+    def _build_messages(self, system_prompt: str, user_content: str) -> List[BaseMessage]:
+        """固定的系统提示词在前，变化的内容在后"""
+        return [SystemMessage(content=system_prompt), HumanMessage(content=user_content)]
+    
+    def _build_reflection_result(self, response: Any, agent_output: str) -> Dict[str, Any]:
+        """将反思LLM的响应转换为反思结果"""
+        reflection_text = response.content if hasattr(response, 'content') else str(response)
+        
+        # 解析反思结果
+        needs_improvement = self._parse_reflection(reflection_text)
+        
+        return {
+            'reflection': reflection_text,
+            'needs_improvement': needs_improvement,
+            'original_output': agent_output
+        }
+    
     def _parse_reflection(self, reflection_text: str) -> bool:
         """解析反思结果，判断是否需要改进"""
         # 检查"是否需要改进"后面的内容
@@ -2,9 +2,11 @@
 基于LangGraph的反思机制工作流
 """
 from typing import TypedDict, Literal, Dict, Any, List
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 from agents.base.base_agent import BaseAgent
 from agents.enhancement.reflection_agent import ReflectionAgent
+from core.tracing import tracer
 
 
 class ReflectionState(TypedDict, total=False):
@@ -63,6 +65,26 @@ class ReflectionGraph:
                 "iteration": 0
             }
         
+        async def aexecute_agent(state: ReflectionState) -> ReflectionState:
+            """异步执行Agent获取初始输出"""
+            # ainvoke不经过策略管理器，不会递归触发反思，
+            # 且并发协程共享同一Agent实例，这里不修改agent.config
+            callbacks = state.get("_callbacks", None)
+            if callbacks:
+                result = await self.agent.ainvoke(
+                    {"input": state["user_input"]},
+                    config={"callbacks": callbacks}
+                )
+            else:
+                result = await self.agent.ainvoke({"input": state["user_input"]})
+            output = result.get("output", "")
+            
+            return {
+                "agent_output": output,
+                "improved_output": output,
+                "iteration": 0
+            }
+        
         # 节点2: 反思评估
         def reflect(state: ReflectionState) -> ReflectionState:
             """对Agent输出进行反思评估"""
@@ -78,6 +100,20 @@ class ReflectionGraph:
                 "should_continue": reflection_result["needs_improvement"]
             }
         
+        async def areflect(state: ReflectionState) -> ReflectionState:
+            """异步对Agent输出进行反思评估"""
+            callbacks = state.get("_callbacks", None)
+            reflection_result = await self.reflection_agent.areflect(
+                state["user_input"],
+                state["improved_output"],
+                callbacks=callbacks
+            )
+            
+            return {
+                "reflection": reflection_result["reflection"],
+                "should_continue": reflection_result["needs_improvement"]
+            }
+        
         # 节点3: 改进输出
         def improve(state: ReflectionState) -> ReflectionState:
             """基于反思改进输出"""
@@ -100,6 +136,25 @@ class ReflectionGraph:
                     "improved_output": state["improved_output"]
                 }
         
+        async def aimprove(state: ReflectionState) -> ReflectionState:
+            """异步基于反思改进输出"""
+            callbacks = state.get("_callbacks", None)
+            if state["should_continue"]:
+                improved = await self.reflection_agent.aimprove(
+                    state["user_input"],
+                    state["improved_output"],
+                    state["reflection"],
+                    callbacks=callbacks
+                )
+                
+                return {
+                    "improved_output": improved,
+                    "iteration": state["iteration"] + 1
+                }
+            return {
+                "improved_output": state["improved_output"]
+            }
+        
         # 节点4: 判断是否继续
         def should_continue(state: ReflectionState) -> Literal["reflect", "end"]:
             """判断是否继续反思循环"""
@@ -121,10 +176,16 @@ class ReflectionGraph:
                 "final_output": state["improved_output"]
             }
         
-        # 添加节点
-        workflow.add_node("execute", execute_agent)
-        workflow.add_node("reflect", reflect)
-        workflow.add_node("improve", improve)
+        # 添加节点（同时提供同步和异步实现，invoke/ainvoke各走各的路径；每次执行记录为一个追踪span）
+        workflow.add_node("execute", RunnableLambda(
+            tracer.wrap("reflection.execute", execute_agent), afunc=tracer.awrap("reflection.execute", aexecute_agent)
+        ))
+        workflow.add_node("reflect", RunnableLambda(
+            tracer.wrap("reflection.reflect", reflect), afunc=tracer.awrap("reflection.reflect", areflect)
+        ))
+        workflow.add_node("improve", RunnableLambda(
+            tracer.wrap("reflection.improve", improve), afunc=tracer.awrap("reflection.improve", aimprove)
+        ))
         workflow.add_node("finalize", finalize)
         
         # 设置入口点
@@ -147,7 +208,17 @@ class ReflectionGraph:
     
     def invoke(self, user_input: str, callbacks: List = None) -> Dict[str, Any]:
         """执行反思工作流"""
-        initial_state: ReflectionState = {
+        final_state = self.graph.invoke(self._build_initial_state(user_input, callbacks))
+        return self._build_result(final_state)
+    
+    async def ainvoke(self, user_input: str, callbacks: List = None) -> Dict[str, Any]:
+        """异步执行反思工作流"""
+        final_state = await self.graph.ainvoke(self._build_initial_state(user_input, callbacks))
+        return self._build_result(final_state)
+    
+    def _build_initial_state(self, user_input: str, callbacks: List = None) -> ReflectionState:
+        """构造工作流初始状态"""
+        return {
             "user_input": user_input,
             "agent_output": "",
             "reflection": "",
@@ -158,10 +229,9 @@ class ReflectionGraph:
             "final_output": "",
             "_callbacks": callbacks  # 传递callbacks给节点
         }
-        
-        # 执行工作流
-        final_state = self.graph.invoke(initial_state)
-        
+    
+    def _build_result(self, final_state: Dict[str, Any]) -> Dict[str, Any]:
+        """从最终状态提取结果"""
         return {
             "output": final_state["final_output"],
             "iterations": final_state["iteration"],
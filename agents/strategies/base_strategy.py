@@ -1,9 +1,11 @@
 """
 增强策略基类 - 定义可插拔的增强机制接口
 """
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Dict, Any
 from agents.base.base_agent import BaseAgent
+from core.config_snapshot import ConfigSnapshot
 
 
 class EnhancementStrategy(ABC):
@@ -20,13 +22,14 @@ class EnhancementStrategy(ABC):
         self.name = self.__class__.__name__
     
     @abstractmethod
-    def enhance(self, agent: BaseAgent, input_data: Dict[str, Any], **kwargs) -> Any:
+    def enhance(self, agent: BaseAgent, input_data: Dict[str, Any], snapshot: ConfigSnapshot = None, **kwargs) -> Any:
         """
         增强Agent的执行
         
         Args:
             agent: 要增强的Agent实例
             input_data: 输入数据
+            snapshot: 本次请求的配置快照（为None时取当前快照）
             **kwargs: 其他参数（如callbacks等）
         
         Returns:
@@ -34,6 +37,24 @@ class EnhancementStrategy(ABC):
         """
         pass
     
+    async def aenhance(self, agent: BaseAgent, input_data: Dict[str, Any], snapshot: ConfigSnapshot = None, **kwargs) -> Any:
+        """
+        异步增强Agent的执行
+        
+        默认实现把同步的enhance放到线程池中执行，以免阻塞事件循环；
+        需要真正异步I/O的策略应覆盖此方法。
+        
+        Args:
+            agent: 要增强的Agent实例
+            input_data: 输入数据
+            snapshot: 本次请求的配置快照（为None时取当前快照）
+            **kwargs: 其他参数（如callbacks等）
+        
+        Returns:
+            增强后的执行结果
+        """
+        return await asyncio.to_thread(self.enhance, agent, input_data, snapshot, **kwargs)
+    
     def is_enabled(self) -> bool:
         """检查策略是否启用"""
         return self.config.get("enable", False)
@@ -1,12 +1,16 @@
 """
 反思策略 - 实现反思增强机制
 """
+from datetime import datetime
 from typing import Dict, Any
 from agents.strategies.base_strategy import EnhancementStrategy
 from agents.base.base_agent import BaseAgent
 from agents.enhancement.reflection_agent import ReflectionAgent
 from agents.enhancement.reflection_graph import ReflectionGraph
-import config
+from core.config_snapshot import ConfigSnapshot, config_store
+from core.metrics import reflection_iterations
+from core.log_writer import log_writer
+from core.structured_log import build_event, truncate, write_event
 
 
 class ReflectionStrategy(EnhancementStrategy):
@@ -22,62 +26,41 @@ class ReflectionStrategy(EnhancementStrategy):
         super().__init__(config)
         self._reflection_agent = None
     
-    def enhance(self, agent: BaseAgent, input_data: Dict[str, Any], **kwargs) -> Any:
+    def enhance(self, agent: BaseAgent, input_data: Dict[str, Any], snapshot: ConfigSnapshot = None, **kwargs) -> Any:
         """
         应用反思增强
         
         Args:
             agent: 要增强的Agent实例
             input_data: 输入数据
+            snapshot: 本次请求的配置快照
             **kwargs: 其他参数（如callbacks等）
         
         Returns:
             增强后的执行结果
         """
-        # 获取配置（优先使用enhancement配置，向后兼容reflection配置）
-        enhancement_config = config.DEFAULT_CONFIG.get("enhancement", {}).get("reflection", {})
-        reflection_config = config.DEFAULT_CONFIG.get("reflection", {})
-        # 合并配置，enhancement配置优先
-        merged_config = {**reflection_config, **enhancement_config, **self.config}
+        snapshot = snapshot or config_store.current()
+        merged_config = self._get_merged_config(snapshot)
         
         # 检查是否启用
-        is_enabled = merged_config.get("enable", False)
-        
-        if not is_enabled:
+        if not merged_config.get("enable", False):
             # 如果策略未启用，直接返回普通执行结果
             return agent.invoke(input_data, **kwargs)
         
-        max_iterations = merged_config.get("max_iterations", 2)
-        
         try:
-            # 创建反思Agent（如果还没有创建）
-            if self._reflection_agent is None:
-                self._reflection_agent = ReflectionAgent(agent.llm)
-            
-            # 创建反思工作流
-            reflection_graph = ReflectionGraph(
-                agent=agent,
-                reflection_agent=self._reflection_agent,
-                max_iterations=max_iterations
-            )
+            reflection_graph = self._create_reflection_graph(agent, merged_config)
             
             # 执行反思工作流
             user_input = input_data.get("input", "")
             callbacks = kwargs.get("config", {}).get("callbacks", None)
             result = reflection_graph.invoke(user_input, callbacks=callbacks)
+            reflection_iterations.observe(result.get("iterations", 0), agent=agent.name)
             
             # 记录反思过程（如果启用）
             if merged_config.get("log_reflection", True):
-                self._log_reflection(result)
+                self._log_reflection(result, snapshot)
             
-            return {
-                "output": result["output"],
-                "reflection_metadata": {
-                    "iterations": result["iterations"],
-                    "reflection": result.get("reflection", ""),
-                    "original_output": result.get("original_output", "")
-                }
-            }
+            return self._build_enhanced_result(result)
         except ImportError as e:
             # 如果LangGraph未安装，回退到普通模式
             print(f"⚠️ LangGraph未安装，无法使用反思机制: {e}")
@@ -88,30 +71,95 @@ class ReflectionStrategy(EnhancementStrategy):
             print(f"⚠️ 反思机制执行出错，回退到普通模式: {e}")
             return agent.invoke(input_data, **kwargs)
     
-    def _log_reflection(self, reflection_result: Dict[str, Any]) -> None:
-        """记录反思过程"""
+    async def aenhance(self, agent: BaseAgent, input_data: Dict[str, Any], snapshot: ConfigSnapshot = None, **kwargs) -> Any:
+        """异步应用反思增强（反思/改进的LLM调用均为异步I/O）"""
+        snapshot = snapshot or config_store.current()
+        merged_config = self._get_merged_config(snapshot)
+        
+        if not merged_config.get("enable", False):
+            return await agent.ainvoke(input_data, **kwargs)
+        
         try:
-            log_config = config.DEFAULT_CONFIG.get("logging", {})
-            log_file = log_config.get("llm_log_file", "logs/llm_interactions.log")
+            reflection_graph = self._create_reflection_graph(agent, merged_config)
             
-            from datetime import datetime
-            import os
+            user_input = input_data.get("input", "")
+            callbacks = kwargs.get("config", {}).get("callbacks", None)
+            result = await reflection_graph.ainvoke(user_input, callbacks=callbacks)
+            reflection_iterations.observe(result.get("iterations", 0), agent=agent.name)
             
-            # 确保日志目录存在
-            log_dir = os.path.dirname(log_file)
-            if log_dir and not os.path.exists(log_dir):
-                os.makedirs(log_dir, exist_ok=True)
+            if merged_config.get("log_reflection", True):
+                # 只是放入后台写入队列，不阻塞事件循环
+                self._log_reflection(result, snapshot)
             
-            # 写入反思日志
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write("\n" + "="*80 + "\n")
-                f.write(f"🔄 反思机制执行记录 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write("="*80 + "\n")
-                f.write(f"迭代次数: {reflection_result.get('iterations', 0)}\n")
-                f.write(f"\n原始输出:\n{reflection_result.get('original_output', '')}\n")
-                f.write(f"\n反思评估:\n{reflection_result.get('reflection', '')}\n")
-                f.write(f"\n最终输出:\n{reflection_result.get('output', '')}\n")
-                f.write("="*80 + "\n\n")
+            return self._build_enhanced_result(result)
+        except ImportError as e:
+            print(f"⚠️ LangGraph未安装，无法使用反思机制: {e}")
+            print("请运行: pip install langgraph>=0.2.0")
+            return await agent.ainvoke(input_data, **kwargs)
         except Exception as e:
-            print(f"⚠️ 记录反思日志失败: {e}")
-
+            print(f"⚠️ 反思机制执行出错，回退到普通模式: {e}")
+            return await agent.ainvoke(input_data, **kwargs)
+    
+    def _get_merged_config(self, snapshot: ConfigSnapshot) -> Dict[str, Any]:
+        """获取合并后的反思配置（优先使用enhancement配置，向后兼容reflection配置）"""
+        enhancement_config = snapshot.section("enhancement").get("reflection", {})
+        reflection_config = snapshot.section("reflection")
+        # 合并配置，enhancement配置优先
+        return {**reflection_config, **enhancement_config, **self.config}
+    
+    def _create_reflection_graph(self, agent: BaseAgent, merged_config: Dict[str, Any]) -> ReflectionGraph:
+        """创建反思工作流"""
+        # 创建反思Agent（如果还没有创建）
+        if self._reflection_agent is None:
+            self._reflection_agent = ReflectionAgent(agent.llm)
+        
+        return ReflectionGraph(
+            agent=agent,
+            reflection_agent=self._reflection_agent,
+            max_iterations=merged_config.get("max_iterations", 2)
+        )
+    
+    def _build_enhanced_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """将反思工作流的结果转换为策略输出"""
+        return {
+            "output": result["output"],
+            "reflection_metadata": {
+                "iterations": result["iterations"],
+                "reflection": result.get("reflection", ""),
+                "original_output": result.get("original_output", "")
+            }
+        }
+    
+    def _log_reflection(self, reflection_result: Dict[str, Any], snapshot: ConfigSnapshot) -> None:
+        """记录反思过程（作为一条记录交给后台写入器，按logging.format写入与LLM交互日志相同的文本和/或JSONL文件）"""
+        log_config = snapshot.section("logging")
+        log_format = log_config.get("format", "text")
+        written = True
+        
+        if log_format in ("jsonl", "both"):
+            limit = log_config.get("max_content_chars", 4000)
+            event = build_event(
+                "reflection",
+                iterations=reflection_result.get('iterations', 0),
+                original_output=truncate(reflection_result.get('original_output', ''), limit),
+                reflection=truncate(reflection_result.get('reflection', ''), limit),
+                output=truncate(reflection_result.get('output', ''), limit),
+            )
+            written = write_event(log_config.get("jsonl_file", "logs/llm_interactions.jsonl"), event)
+        
+        if log_format in ("text", "both"):
+            log_file = log_config.get("llm_log_file", "logs/llm_interactions.log")
+            record = (
+                "\n" + "="*80 + "\n"
+                f"🔄 反思机制执行记录 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                + "="*80 + "\n"
+                f"迭代次数: {reflection_result.get('iterations', 0)}\n"
+                f"\n原始输出:\n{reflection_result.get('original_output', '')}\n"
+                f"\n反思评估:\n{reflection_result.get('reflection', '')}\n"
+                f"\n最终输出:\n{reflection_result.get('output', '')}\n"
+                + "="*80 + "\n\n"
+            )
+            written = log_writer.write(log_file, record) and written
+        
+        if not written:
+            print("⚠️ 记录反思日志失败: 日志队列已满")
@@ -4,7 +4,8 @@
 from typing import Dict, List, Optional, Any
 from agents.strategies.base_strategy import EnhancementStrategy
 from agents.base.base_agent import BaseAgent
-import config
+from core.config_snapshot import ConfigSnapshot, config_store
+from core.tracing import tracer
 
 
 class StrategyManager:
@@ -32,31 +33,45 @@ class StrategyManager:
         """列出所有已注册的策略名称"""
         return list(self._strategies.keys())
     
-    def apply_strategies(self, agent: BaseAgent, input_data: Dict, **kwargs) -> Any:
+    def _get_configured_strategies(self, snapshot: ConfigSnapshot = None) -> List[str]:
+        """获取配置中启用的策略名称列表"""
+        snapshot = snapshot or config_store.current()
+        enabled_strategies = list(snapshot.section("enhancement").get("strategies", []))
+        
+        # 向后兼容：如果没有配置strategies，检查reflection配置
+        if not enabled_strategies:
+            if snapshot.section("reflection").get("enable", False):
+                enabled_strategies = ["reflection"]
+        return enabled_strategies
+    
+    def has_active_strategies(self, snapshot: ConfigSnapshot = None) -> bool:
+        """是否有实际生效的增强策略（已配置、已注册且已启用）"""
+        for strategy_name in self._get_configured_strategies(snapshot):
+            strategy = self.get_strategy(strategy_name)
+            if strategy and strategy.is_enabled():
+                return True
+        return False
+    
+    def apply_strategies(self, agent: BaseAgent, input_data: Dict, snapshot: ConfigSnapshot = None, **kwargs) -> Any:
         """
         按顺序应用所有启用的策略
         
         Args:
             agent: Agent实例
             input_data: 输入数据
+            snapshot: 本次请求的配置快照（默认取当前快照）
             **kwargs: 其他参数
         
         Returns:
             增强后的执行结果
         """
-        # 获取启用的策略列表（从配置中）
-        enhancement_config = config.DEFAULT_CONFIG.get("enhancement", {})
-        enabled_strategies = enhancement_config.get("strategies", [])
-        
-        # 向后兼容：如果没有配置strategies，检查reflection配置
-        if not enabled_strategies:
-            reflection_config = config.DEFAULT_CONFIG.get("reflection", {})
-            if reflection_config.get("enable", False):
-                enabled_strategies = ["reflection"]
+        snapshot = snapshot or config_store.current()
+        enabled_strategies = self._get_configured_strategies(snapshot)
         
         if not enabled_strategies:
             # 如果没有配置策略，直接执行Agent
-            return agent.invoke(input_data, **kwargs)
+            with tracer.span("agent.invoke", agent=agent.name):
+                return agent.invoke(input_data, **kwargs)
         
         # 按顺序应用策略
         result = input_data
@@ -66,7 +81,8 @@ class StrategyManager:
             strategy = self.get_strategy(strategy_name)
             if strategy and strategy.is_enabled():
                 try:
-                    result = strategy.enhance(agent, result, **kwargs)
+                    with tracer.span(f"strategy.{strategy_name}", agent=agent.name):
+                        result = strategy.enhance(agent, result, snapshot=snapshot, **kwargs)
                     strategy_applied = True
                 except Exception as e:
                     print(f"⚠️ 策略 '{strategy_name}' 执行出错: {e}")
@@ -75,7 +91,48 @@ class StrategyManager:
         
         # 如果没有任何策略被应用，直接执行Agent
         if not strategy_applied:
-            return agent.invoke(input_data, **kwargs)
+            with tracer.span("agent.invoke", agent=agent.name):
+                return agent.invoke(input_data, **kwargs)
+        
+        return result
+    
+    async def aapply_strategies(self, agent: BaseAgent, input_data: Dict, snapshot: ConfigSnapshot = None, **kwargs) -> Any:
+        """
+        异步按顺序应用所有启用的策略（语义与apply_strategies一致）
+        
+        Args:
+            agent: Agent实例
+            input_data: 输入数据
+            snapshot: 本次请求的配置快照（默认取当前快照）
+            **kwargs: 其他参数
+        
+        Returns:
+            增强后的执行结果
+        """
+        snapshot = snapshot or config_store.current()
+        enabled_strategies = self._get_configured_strategies(snapshot)
+        
+        if not enabled_strategies:
+            with tracer.span("agent.invoke", agent=agent.name):
+                return await agent.ainvoke(input_data, **kwargs)
+        
+        result = input_data
+        strategy_applied = False
+        
+        for strategy_name in enabled_strategies:
+            strategy = self.get_strategy(strategy_name)
+            if strategy and strategy.is_enabled():
+                try:
+                    with tracer.span(f"strategy.{strategy_name}", agent=agent.name):
+                        result = await strategy.aenhance(agent, result, snapshot=snapshot, **kwargs)
+                    strategy_applied = True
+                except Exception as e:
+                    print(f"⚠️ 策略 '{strategy_name}' 执行出错: {e}")
+                    continue
+        
+        if not strategy_applied:
+            with tracer.span("agent.invoke", agent=agent.name):
+                return await agent.ainvoke(input_data, **kwargs)
         
         return result
     
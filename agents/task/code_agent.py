@@ -19,10 +19,8 @@ class CodeAgent(BaseAgent):
     注意：这只是一个示例，需要配合相应的工具使用
     """
     
-    def create_agent_executor(self):
-        """创建代码Agent执行器（使用新的create_agent API）"""
-        # 中文系统提示词
-        system_prompt = """你是一个代码分析助手。
+    # 中文系统提示词
+    system_prompt = """你是一个代码分析助手。
 
 重要规则：
 1. 当用户要求分析代码时，你必须使用工具来执行分析
@@ -42,12 +40,14 @@ class CodeAgent(BaseAgent):
 最终答案: [对用户的最终回复]
 
 请始终使用工具来分析代码，不要直接编造答案。"""
-        
+    
+    def create_agent_executor(self):
+        """创建代码Agent执行器（使用新的create_agent API）"""
         # 使用新的create_agent API
         agent = create_agent(
             model=self.llm,
             tools=self.tools,
-            system_prompt=system_prompt,
+            system_prompt=self.system_prompt,
         )
         
         return agent
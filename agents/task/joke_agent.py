@@ -8,10 +8,8 @@ from agents.base.base_agent import BaseAgent
 class JokeAgent(BaseAgent):
     """笑话Agent"""
     
-    def create_agent_executor(self):
-        """创建笑话Agent执行器（使用新的create_agent API）"""
-        # 中文系统提示词 - 更强调必须使用工具
-        system_prompt = """你是一个专门讲笑话的智能助手。
+    # 中文系统提示词 - 更强调必须使用工具
+    system_prompt = """你是一个专门讲笑话的智能助手。
 
 ⚠️ 重要规则（必须严格遵守）：
 1. 当用户要求讲笑话时，你必须立即调用GetRandomJoke工具来获取笑话
@@ -28,12 +26,14 @@ class JokeAgent(BaseAgent):
 3. 将工具返回的笑话内容直接告诉用户
 
 请记住：必须调用工具，不能自己编造笑话！"""
-        
+    
+    def create_agent_executor(self):
+        """创建笑话Agent执行器（使用新的create_agent API）"""
         # 使用新的create_agent API
         agent = create_agent(
             model=self.llm,
             tools=self.tools,
-            system_prompt=system_prompt,
+            system_prompt=self.system_prompt,
         )
         
         return agent
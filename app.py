@@ -7,14 +7,22 @@ import sys
 # 必须在导入其他模块之前设置路径
 sys.path.insert(0, os.path.dirname(__file__))
 
+import json
 import time
 import threading
 import webbrowser
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 from flask_cors import CORS
 from core.agent_service import agent_service
 from core.agent_factory import AgentFactory
-import config
+from core.job_manager import job_manager, QueueFullError
+from core.response_cache import response_cache
+from core.config_snapshot import config_store
+from core.llm_logger import log_tier_override
+from core.metrics import metrics
+from core.tracing import tracer
+from core.trace_store import trace_store
+from providers.ollama_control import ollama_control
 
 app = Flask(__name__)
 CORS(app)
@@ -26,6 +34,12 @@ def index():
     return render_template('index.html')
 
 
+def requested_log_tier():
+    """读取请求头指定的日志级别（logging.tier_header为空时不允许按请求指定）"""
+    header = config_store.current().section("logging").get("tier_header")
+    return request.headers.get(header) if header else None
+
+
 @app.route('/api/agent/invoke', methods=['POST'])
 def invoke_agent():
     """调用Agent处理请求"""
@@ -34,16 +48,25 @@ def invoke_agent():
         agent_name = data.get('agent_name')
         user_input = data.get('input', '')
         
-        log_config = config.DEFAULT_CONFIG.get("logging", {})
+        log_config = config_store.current().section("logging")
         if log_config.get("llm_console_output", False):
             print(f"\n🎯 用户输入: {user_input}")
             print(f"🤖 使用Agent: {agent_name or '默认'}")
             print("🚀 开始Agent处理...\n")
         
-        result = agent_service.invoke_agent(agent_name=agent_name, user_input=user_input)
+        with log_tier_override(requested_log_tier()), \
+                tracer.start_trace("POST /api/agent/invoke", agent=agent_name) as trace:
+            result = agent_service.invoke_agent(agent_name=agent_name, user_input=user_input)
         
         status_code = 200 if result['success'] else 500
-        return jsonify(result), status_code
+        if trace is None:
+            return jsonify(result), status_code
+        if data.get('timings'):
+            result = {**result, 'timings': trace.timings()}
+        headers = {}
+        if config_store.current().section("tracing").get("server_timing", True):
+            headers['Server-Timing'] = trace.server_timing()
+        return jsonify(result), status_code, headers
     except Exception as e:
         return jsonify({
             'success': False,
@@ -52,6 +75,250 @@ def invoke_agent():
         }), 500
 
 
+def format_sse(event: dict) -> str:
+    """将事件编码为Server-Sent Events格式"""
+    payload = json.dumps(event, ensure_ascii=False)
+    return f"event: {event.get('type', 'message')}\ndata: {payload}\n\n"
+
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',  # 禁止反向代理（如Nginx）缓冲，保证逐条推送
+}
+
+
+@app.route('/api/agent/stream', methods=['POST'])
+def stream_agent():
+    """流式调用Agent（SSE）：边执行边推送token、工具调用和最终答案"""
+    data = request.json or {}
+    agent_name = data.get('agent_name')
+    user_input = data.get('input', '')
+    
+    log_config = config_store.current().section("logging")
+    if log_config.get("llm_console_output", False):
+        print(f"\n🎯 用户输入(流式): {user_input}")
+        print(f"🤖 使用Agent: {agent_name or '默认'}")
+    
+    log_tier = requested_log_tier()
+    
+    def generate():
+        # 先发送一个注释行，让客户端立即拿到首字节
+        yield ": stream-open\n\n"
+        with log_tier_override(log_tier):
+            for event in agent_service.stream_agent(agent_name=agent_name, user_input=user_input):
+                yield format_sse(event)
+        yield format_sse({'type': 'done'})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
+
+def parse_batch_request(data: dict):
+    """
+    解析批量调用请求体
+    
+    Returns:
+        (items, agent_name, max_concurrency)；请求体不合法时抛出ValueError
+    """
+    items = data.get('inputs')
+    if not isinstance(items, list) or not items:
+        raise ValueError('inputs必须是非空列表')
+    max_concurrency = data.get('max_concurrency')
+    if max_concurrency is not None and (not isinstance(max_concurrency, int) or max_concurrency < 1):
+        raise ValueError('max_concurrency必须是正整数')
+    return items, data.get('agent_name'), max_concurrency
+
+
+def build_batch_response(results: list) -> dict:
+    """构造批量调用的响应体"""
+    succeeded = sum(1 for r in results if r['success'])
+    return {
+        'success': True,
+        'results': results,
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded
+    }
+
+
+@app.route('/api/agent/batch', methods=['POST'])
+def batch_invoke_agent():
+    """批量调用Agent（有界并发，结果按输入顺序返回）"""
+    try:
+        items, agent_name, max_concurrency = parse_batch_request(request.json or {})
+        with log_tier_override(requested_log_tier()):
+            results = agent_service.batch_invoke(
+                items=items,
+                agent_name=agent_name,
+                max_concurrency=max_concurrency
+            )
+        return jsonify(build_batch_response(results))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """提交异步任务，立即返回任务ID"""
+    try:
+        data = request.json or {}
+        job = job_manager.submit(agent_name=data.get('agent_name'), user_input=data.get('input', ''))
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
+    except QueueFullError as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询异步任务状态和结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'任务不存在或已过期: {job_id}'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """获取服务运行统计信息"""
+    try:
+        return jsonify({
+            'success': True,
+            **agent_service.get_stats(),
+            'jobs': job_manager.stats(),
+            'ollama_control': ollama_control.stats()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus文本格式的运行指标（供监控系统抓取）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def trace_query_args() -> dict:
+    """解析运行记录查询参数（分页和过滤条件），非法的数字参数抛出ValueError"""
+    args = request.args
+    params = {
+        'limit': int(args.get('limit', 50)),
+        'offset': int(args.get('offset', 0)),
+    }
+    for name in ('agent', 'model', 'status', 'error_class'):
+        if args.get(name):
+            params[name] = args[name]
+    for name in ('since', 'until', 'min_duration_ms'):
+        if args.get(name):
+            params[name] = float(args[name])
+    return params
+
+
+@app.route('/api/traces', methods=['GET'])
+def list_traces():
+    """查询运行记录（?sort=time|duration|tokens，支持分页和按Agent/模型/状态/时间过滤）"""
+    try:
+        return jsonify({'success': True, **trace_store.query(request.args.get('sort', 'time'), **trace_query_args())})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/traces/slowest', methods=['GET'])
+def slowest_traces():
+    """耗时最长的执行"""
+    try:
+        return jsonify({'success': True, **trace_store.slowest(**trace_query_args())})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/traces/errors', methods=['GET'])
+def error_traces():
+    """出错的执行（最新优先，可用?error_class=过滤错误类型）"""
+    try:
+        return jsonify({'success': True, **trace_store.errors(**trace_query_args())})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/traces/agents', methods=['GET'])
+def trace_aggregates():
+    """按Agent汇总的执行数、出错率、耗时和Token数"""
+    try:
+        return jsonify({'success': True, **trace_store.aggregates(**trace_query_args())})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/traces/<run_id>', methods=['GET'])
+def get_trace(run_id):
+    """查询单次执行的记录"""
+    run = trace_store.get(run_id)
+    if run is None:
+        return jsonify({'success': False, 'error': f'执行记录不存在: {run_id}'}), 404
+    return jsonify({'success': True, 'run': run})
+
+
+@app.route('/api/admin/cache', methods=['GET'])
+def get_cache_stats():
+    """查看响应缓存统计（按Agent的命中率）"""
+    try:
+        return jsonify({'success': True, **response_cache.stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/admin/cache', methods=['DELETE'])
+def flush_cache():
+    """清空响应缓存（?agent=xxx 只清空指定Agent）"""
+    try:
+        agent_name = request.args.get('agent')
+        removed = response_cache.flush(agent_name)
+        return jsonify({'success': True, 'agent': agent_name, 'removed': removed})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/admin/agents', methods=['GET'])
+def get_agent_cache_stats():
+    """查看Agent实例缓存（条目数、命中率、构建耗时、各实例估算内存）"""
+    try:
+        return jsonify({'success': True, **agent_service.get_agent_cache_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/admin/agents', methods=['DELETE'])
+def clear_agent_cache():
+    """清空Agent实例缓存（下次请求时重建）"""
+    try:
+        removed = agent_service.clear_agent_cache()
+        return jsonify({'success': True, 'removed': removed})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/agents', methods=['GET'])
 def list_agents():
     """列出所有可用的Agent"""
@@ -84,38 +351,38 @@ def update_config():
 
 @app.route('/api/ollama/models', methods=['GET'])
 def get_ollama_models():
-    """获取Ollama本地可用模型列表"""
+    """
+    获取Ollama本地可用模型列表
+    
+    结果带短TTL缓存（过期后后台刷新），并返回ETag；
+    请求带If-None-Match且列表未变化时返回304，不重复传输。
+    """
     try:
-        import requests
-        base_url = config.DEFAULT_CONFIG.get('ollama', {}).get('base_url', 'http://localhost:11434')
-        response = requests.get(f"{base_url}/api/tags", timeout=2)
-        
-        if response.status_code == 200:
-            models = [model['name'] for model in response.json().get('models', [])]
-            return jsonify({'success': True, 'models': models})
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Ollama服务响应错误: {response.status_code}',
-                'models': []
-            }), 500
-    except requests.exceptions.RequestException as e:
+        result = ollama_control.list_models()
+    except Exception as e:
         return jsonify({
             'success': False,
             'error': f'无法连接到Ollama服务: {str(e)}',
             'models': []
         }), 500
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e), 'models': []}), 500
+    
+    response = jsonify({'success': True, 'models': result.models})
+    response.set_etag(result.etag)
+    # 允许浏览器缓存，但每次使用前都要带ETag重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 
 if __name__ == '__main__':
     print("🎭 Agent服务启动中...")
-    print(f"📦 当前模型: {config.DEFAULT_CONFIG.get('model_type', 'ollama')}")
-    print(f"🤖 默认Agent: {config.DEFAULT_CONFIG.get('default_agent', 'joke')}")
+    print(f"📦 当前模型: {config_store.current().model_type}")
+    print(f"🤖 默认Agent: {config_store.current().default_agent}")
     print("💡 可以通过 /api/config 接口切换模型和Agent")
     print("📱 打开浏览器访问: http://localhost:5000")
     
+    # 后台预加载当前模型并创建默认Agent
+    agent_service.warm_up()
+    
     is_reloader = os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
     if not is_reloader:
         def open_browser():
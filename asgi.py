@@ -0,0 +1,215 @@
+"""
+ASGI入口 - 异步服务路径
+
+Agent调用（/api/agent/invoke、/api/agent/stream、/api/agent/batch）在事件循环上原生异步执行，
+等待Ollama/DeepSeek等模型I/O时不占用线程，单进程即可同时承载大量进行中的请求；
+其余路由通过asgiref的WsgiToAsgi转发给Flask应用，与app.py保持完全一致。
+
+启动方式:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import os
+import sys
+
+# 必须在导入其他模块之前设置路径
+sys.path.insert(0, os.path.dirname(__file__))
+
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+from asgiref.wsgi import WsgiToAsgi
+from app import app as flask_app, format_sse, SSE_HEADERS, parse_batch_request, build_batch_response
+from core.agent_service import agent_service
+from core.config_snapshot import config_store
+from core.llm_logger import log_tier_override
+from core.tracing import tracer
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+async def read_json_body(receive: Receive) -> Dict[str, Any]:
+    """读取完整请求体并解析为JSON（请求体为空或非法时返回空字典）"""
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    body = b"".join(chunks)
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def requested_log_tier(scope: Scope) -> Optional[str]:
+    """读取请求头指定的日志级别（logging.tier_header为空时不允许按请求指定）"""
+    header = config_store.current().section("logging").get("tier_header")
+    if not header:
+        return None
+    name = header.lower().encode("latin-1")
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def encode_headers(headers: Dict[str, str]):
+    """将响应头转换为ASGI格式"""
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+
+
+async def send_json(send: Send, data: Dict[str, Any], status: int = 200, headers: Dict[str, str] = None) -> None:
+    """发送JSON响应（headers为额外的响应头）"""
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": encode_headers({
+            "Content-Type": "application/json; charset=utf-8",
+            "Content-Length": str(len(body)),
+            "Access-Control-Allow-Origin": "*",
+            **(headers or {}),
+        }),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def invoke_agent(scope: Scope, receive: Receive, send: Send) -> None:
+    """异步调用Agent处理请求"""
+    data = await read_json_body(receive)
+    agent_name = data.get('agent_name')
+    user_input = data.get('input', '')
+    
+    log_config = config_store.current().section("logging")
+    if log_config.get("llm_console_output", False):
+        print(f"\n🎯 用户输入: {user_input}")
+        print(f"🤖 使用Agent: {agent_name or '默认'}")
+        print("🚀 开始Agent处理(异步)...\n")
+    
+    try:
+        with log_tier_override(requested_log_tier(scope)), \
+                tracer.start_trace("POST /api/agent/invoke", agent=agent_name) as trace:
+            result = await agent_service.ainvoke_agent(agent_name=agent_name, user_input=user_input)
+        status_code = 200 if result['success'] else 500
+        headers = {}
+        if trace is not None:
+            if data.get('timings'):
+                result = {**result, 'timings': trace.timings()}
+            if config_store.current().section("tracing").get("server_timing", True):
+                headers['Server-Timing'] = trace.server_timing()
+        await send_json(send, result, status_code, headers)
+    except Exception as e:
+        await send_json(send, {
+            'success': False,
+            'output': f'错误: {str(e)}',
+            'error': str(e)
+        }, 500)
+
+
+async def stream_agent(scope: Scope, receive: Receive, send: Send) -> None:
+    """异步流式调用Agent（SSE）"""
+    data = await read_json_body(receive)
+    agent_name = data.get('agent_name')
+    user_input = data.get('input', '')
+    
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": encode_headers({
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Access-Control-Allow-Origin": "*",
+            **SSE_HEADERS,
+        }),
+    })
+    
+    async def send_chunk(text: str) -> None:
+        await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+    
+    events = agent_service.astream_agent(agent_name=agent_name, user_input=user_input)
+    try:
+        await send_chunk(": stream-open\n\n")
+        with log_tier_override(requested_log_tier(scope)):
+            async for event in events:
+                await send_chunk(format_sse(event))
+        await send_chunk(format_sse({'type': 'done'}))
+    finally:
+        # 客户端断开时关闭生成器，取消仍在进行的模型调用
+        await events.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def batch_invoke_agent(scope: Scope, receive: Receive, send: Send) -> None:
+    """异步批量调用Agent"""
+    data = await read_json_body(receive)
+    try:
+        items, agent_name, max_concurrency = parse_batch_request(data)
+        with log_tier_override(requested_log_tier(scope)):
+            results = await agent_service.abatch_invoke(
+                items=items,
+                agent_name=agent_name,
+                max_concurrency=max_concurrency
+            )
+        await send_json(send, build_batch_response(results))
+    except ValueError as e:
+        await send_json(send, {'success': False, 'error': str(e)}, 400)
+    except Exception as e:
+        await send_json(send, {'success': False, 'error': str(e)}, 500)
+
+
+# 原生异步处理的路由: (方法, 路径) -> 处理函数
+ASYNC_ROUTES = {
+    ("POST", "/api/agent/invoke"): invoke_agent,
+    ("POST", "/api/agent/stream"): stream_agent,
+    ("POST", "/api/agent/batch"): batch_invoke_agent,
+}
+
+
+class AgentASGIApp:
+    """ASGI应用：Agent调用走异步路径，其余请求转发给Flask"""
+    
+    def __init__(self, wsgi_app):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._handle_lifespan(receive, send)
+            return
+        
+        if scope["type"] == "http":
+            handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+            if handler is not None:
+                await handler(scope, receive, send)
+                return
+        
+        await self.wsgi(scope, receive, send)
+    
+    async def _handle_lifespan(self, receive: Receive, send: Send) -> None:
+        """处理ASGI lifespan事件（启动时在后台预热模型，Flask没有启动/关闭钩子，直接确认）"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # 后台预加载当前模型并创建默认Agent，不阻塞启动
+                agent_service.warm_up()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+app = AgentASGIApp(flask_app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    
+    print("🎭 Agent服务启动中（ASGI异步模式）...")
+    print(f"📦 当前模型: {config_store.current().model_type}")
+    print("📱 打开浏览器访问: http://localhost:5000")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
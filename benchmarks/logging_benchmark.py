@@ -0,0 +1,161 @@
+"""
+日志开销基准测试 - 测量LLMLogger在一次请求中给请求线程增加的耗时
+
+模拟一次ReAct请求的回调序列（模型调用 → 工具调用 → 模型调用），分别使用:
+- 逐行写入（旧实现：每行都打开、追加、关闭日志文件）
+- 后台写入器（core.log_writer：请求线程只把整条记录放入队列）
+
+    python benchmarks/logging_benchmark.py
+    python benchmarks/logging_benchmark.py --requests 500 --threads 8
+    python benchmarks/logging_benchmark.py --history 20     # 更长的对话历史（每次回调写入更多行）
+    python benchmarks/logging_benchmark.py --tier metadata  # 只记录元数据的日志级别
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, LLMResult  # noqa: E402
+from core.config_snapshot import config_store  # noqa: E402
+from core.llm_logger import LLMLogger  # noqa: E402
+from core.log_writer import log_writer  # noqa: E402
+
+
+class LineByLineLogger(LLMLogger):
+    """旧实现：每行日志单独打开、追加、关闭文件（在请求线程中执行）"""
+    
+    _file_lock = threading.Lock()
+    
+    def _record(self):
+        return _NoRecord()
+    
+    def _write_to_file(self, content: str):
+        with self._file_lock:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(content + "\n")
+
+
+class _NoRecord:
+    def __enter__(self):
+        return None
+    
+    def __exit__(self, *exc):
+        return False
+
+
+def build_messages(history: int) -> list:
+    messages = [
+        SystemMessage(content="你是一个乐于助人的助手，可以调用工具回答问题。" * 4),
+        HumanMessage(content="讲一个关于程序员的笑话"),
+    ]
+    for i in range(history):
+        call_id = f"call_{i}"
+        messages.append(AIMessage(
+            content=f"Thought: 需要先查询第{i}条资料",
+            tool_calls=[{"name": "search", "args": {"query": f"程序员笑话 {i}"}, "id": call_id}],
+        ))
+        messages.append(ToolMessage(content=f"第{i}条结果: " + "内容" * 40, tool_call_id=call_id))
+    return messages
+
+
+def build_result(text: str) -> LLMResult:
+    message = AIMessage(
+        content=text,
+        usage_metadata={"input_tokens": 420, "output_tokens": 60, "total_tokens": 480},
+        response_metadata={"model_name": "benchmark-model"},
+    )
+    return LLMResult(generations=[[ChatGeneration(message=message)]])
+
+
+def simulate_request(logger: LLMLogger, messages: list) -> float:
+    """执行一次请求的回调序列，返回回调总耗时（毫秒）"""
+    serialized = {"name": "BenchmarkChatModel"}
+    started = time.perf_counter()
+    
+    run_id = uuid.uuid4()
+    logger.on_chat_model_start(serialized, [messages], run_id=run_id)
+    logger.on_chat_model_end(build_result("Thought: 我需要调用工具"), run_id=run_id)
+    
+    tool_run = uuid.uuid4()
+    logger.on_tool_start({"name": "search"}, "程序员笑话", run_id=tool_run)
+    logger.on_tool_end("为什么程序员分不清万圣节和圣诞节？因为 Oct 31 == Dec 25。", run_id=tool_run)
+    
+    run_id = uuid.uuid4()
+    logger.on_chat_model_start(serialized, [messages + [ToolMessage(content="笑话", tool_call_id="x")]], run_id=run_id)
+    logger.on_chat_model_end(build_result("Final Answer: 因为 Oct 31 == Dec 25。"), run_id=run_id)
+    
+    return (time.perf_counter() - started) * 1000
+
+
+def run_variant(logger_cls, log_file: str, requests: int, threads: int, history: int, tier: str) -> list:
+    snapshot = config_store.current().with_updates({
+        "logging": {"llm_log_file": log_file, "llm_console_output": False, "tier": tier, "full_sample_rate": 0}
+    })
+    logger = logger_cls(snapshot)
+    messages = build_messages(history)
+    
+    # 预热（首次打开文件、创建写线程等）
+    for _ in range(5):
+        simulate_request(logger, messages)
+    log_writer.flush()
+    
+    if threads <= 1:
+        return [simulate_request(logger, messages) for _ in range(requests)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda _: simulate_request(logger, messages), range(requests)))
+
+
+def summarize(values: list) -> str:
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"平均 {statistics.mean(values):7.3f} ms | 中位数 {statistics.median(values):7.3f} ms | "
+        f"P95 {p95:7.3f} ms"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="LLMLogger请求线程日志开销基准测试")
+    parser.add_argument("--requests", type=int, default=200, help="模拟请求数")
+    parser.add_argument("--threads", type=int, default=1, help="并发线程数")
+    parser.add_argument("--history", type=int, default=5, help="对话历史中的工具调用轮数")
+    parser.add_argument("--tier", default="full", choices=["metadata", "full", "debug"], help="日志级别")
+    args = parser.parse_args()
+    
+    print(
+        f"📝 日志开销基准测试: {args.requests} 个请求, {args.threads} 个线程, "
+        f"历史 {args.history} 轮, 日志级别 {args.tier}\n"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        baseline_file = os.path.join(tmp_dir, "line_by_line.log")
+        writer_file = os.path.join(tmp_dir, "log_writer.log")
+        
+        baseline = run_variant(LineByLineLogger, baseline_file, args.requests, args.threads, args.history, args.tier)
+        writer = run_variant(LLMLogger, writer_file, args.requests, args.threads, args.history, args.tier)
+        
+        flush_started = time.perf_counter()
+        log_writer.flush()
+        flush_ms = (time.perf_counter() - flush_started) * 1000
+        
+        print(f"  逐行写入      {summarize(baseline)}")
+        print(f"  后台写入器    {summarize(writer)}")
+        print(f"\n  每请求开销降低 {statistics.mean(baseline) / statistics.mean(writer):.1f} 倍")
+        print(f"  写入器排空剩余队列 {flush_ms:.1f} ms")
+        print(f"  日志大小: 逐行写入 {os.path.getsize(baseline_file)} 字节, 后台写入器 {os.path.getsize(writer_file)} 字节")
+        stats = log_writer.stats()
+        print(f"  写入器统计: 记录 {stats['records']}, 刷新 {stats['flushes']}, 丢弃 {stats['dropped']}")
+        log_writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+ReAct解析基准测试 - 比较旧的正则解析和增量解析器（core.react_parser）在长输出上的耗时
+
+分两种场景:
+- 完整输出：对一次完整的模型输出解析一次（日志记录、提取最终答案）
+- 流式输出：逐个token到达，每个token之后都要知道最终答案是否已经出现
+  （旧实现只能对累积的文本重新跑一遍正则，增量解析器只处理新到达的文本）
+
+    python benchmarks/react_parser_benchmark.py
+    python benchmarks/react_parser_benchmark.py --steps 200 --token-chars 4
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.react_parser import ReActStreamParser, extract_final_answer, parse_react  # noqa: E402
+
+
+def legacy_parse_react_content(content: str) -> dict:
+    """旧实现：LLMLogger._parse_react_content（每次调用都重新编译匹配多条re.DOTALL正则）"""
+    result = {'thoughts': [], 'actions': [], 'observations': [], 'final_answer': None}
+    if not content:
+        return result
+    thought_patterns = [
+        r'思考[：:]\s*(.+?)(?=\n(?:行动|观察|最终答案|Final Answer|Action|Observation|Thought|$))',
+        r'Thought[：:]\s*(.+?)(?=\n(?:行动|观察|最终答案|Final Answer|Action|Observation|Thought|$))'
+    ]
+    for pattern in thought_patterns:
+        thoughts = re.findall(pattern, content, re.DOTALL | re.IGNORECASE)
+        result['thoughts'].extend([t.strip() for t in thoughts if t.strip()])
+    action_patterns = [
+        r'行动[：:]\s*(.+?)(?=\n(?:行动输入|观察|思考|最终答案|Final Answer|Action Input|Observation|Thought|$))',
+        r'Action[：:]\s*(.+?)(?=\n(?:行动输入|观察|思考|最终答案|Final Answer|Action Input|Observation|Thought|$))'
+    ]
+    for pattern in action_patterns:
+        actions = re.findall(pattern, content, re.DOTALL | re.IGNORECASE)
+        result['actions'].extend([a.strip() for a in actions if a.strip()])
+    final_answer_patterns = [
+        r'最终答案[：:]\s*(.+?)(?:\n\n|\n思考:|\nThought:|$)',
+        r'Final Answer[：:]\s*(.+?)(?:\n\n|\n思考:|\nThought:|$)'
+    ]
+    for pattern in final_answer_patterns:
+        final_match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
+        if final_match:
+            result['final_answer'] = final_match.group(1).strip()
+            break
+    return result
+
+
+def legacy_extract_final_answer(text: str) -> str:
+    """旧实现：BaseAgent._extract_final_answer"""
+    if not text:
+        return text
+    match_zh = re.search(r'最终答案[：:]\s*(.+?)(?:\n\n|\n思考:|$)', text, re.DOTALL | re.IGNORECASE)
+    if match_zh:
+        return match_zh.group(1).strip().split('\n')[0].strip()
+    match_en = re.search(r'Final Answer[：:]\s*(.+?)(?:\n\n|\nThought:|$)', text, re.DOTALL | re.IGNORECASE)
+    if match_en:
+        return match_en.group(1).strip().split('\n')[0].strip()
+    if len(text) < 200 and not any(k in text for k in ['思考:', '行动:', '观察:', 'Thought:', 'Action:', 'Observation:']):
+        return text.strip()
+    return text
+
+
+def build_output(steps: int) -> str:
+    """构造一段长的ReAct输出：steps轮思考/行动/观察，最后是最终答案和模型多输出的内容"""
+    parts = []
+    for i in range(steps):
+        parts.append(f"思考: 第{i}步需要继续查询资料，" + "分析当前已有的信息。" * 6)
+        parts.append(f"行动: search_{i % 5}")
+        parts.append(f'行动输入: {{"query": "程序员笑话 {i}"}}')
+        parts.append(f"观察: 第{i}条结果 " + "相关内容" * 20)
+    parts.append("思考: 我现在知道最终答案了")
+    parts.append("最终答案: 因为 Oct 31 == Dec 25。")
+    parts.append("")
+    parts.append("补充说明：" + "模型在答案之后继续输出的内容。" * 40)
+    return "\n".join(parts)
+
+
+def tokenize(text: str, token_chars: int) -> list:
+    return [text[i:i + token_chars] for i in range(0, len(text), token_chars)]
+
+
+def time_ms(func, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def legacy_stream(tokens: list) -> int:
+    """旧实现的流式用法：每个token之后对累积文本重新解析，返回识别到最终答案时已消费的token数"""
+    text = ""
+    for index, token in enumerate(tokens, 1):
+        text += token
+        if legacy_parse_react_content(text)['final_answer']:
+            return index
+    return len(tokens)
+
+
+def incremental_stream(tokens: list) -> int:
+    """增量解析器：只处理新到达的文本，返回最终答案段落结束时已消费的token数"""
+    parser = ReActStreamParser()
+    for index, token in enumerate(tokens, 1):
+        parser.feed(token)
+        if parser.final_answer_done:
+            return index
+    parser.close()
+    return len(tokens)
+
+
+def summarize(values: list) -> str:
+    return f"平均 {statistics.mean(values):9.3f} ms | 中位数 {statistics.median(values):9.3f} ms"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="ReAct解析基准测试")
+    parser.add_argument("--steps", type=int, default=50, help="输出中的思考/行动/观察轮数")
+    parser.add_argument("--token-chars", type=int, default=3, help="流式场景中每个token的字符数")
+    parser.add_argument("--repeat", type=int, default=20, help="完整输出场景的重复次数")
+    parser.add_argument("--stream-repeat", type=int, default=3, help="流式场景的重复次数")
+    args = parser.parse_args()
+    
+    text = build_output(args.steps)
+    tokens = tokenize(text, args.token_chars)
+    print(f"🔍 ReAct解析基准测试: 输出 {len(text)} 字符, {args.steps} 轮, 流式 {len(tokens)} 个token\n")
+    
+    print("完整输出（解析步骤 + 提取最终答案）:")
+    legacy = time_ms(lambda: (legacy_parse_react_content(text), legacy_extract_final_answer(text)), args.repeat)
+    incremental = time_ms(lambda: (parse_react(text), extract_final_answer(text)), args.repeat)
+    print(f"  旧正则        {summarize(legacy)}")
+    print(f"  增量解析器    {summarize(incremental)}")
+    print(f"  加速 {statistics.mean(legacy) / statistics.mean(incremental):.1f} 倍")
+    
+    print("\n流式输出（每个token之后判断最终答案）:")
+    legacy_hit = legacy_stream(tokens)
+    incremental_hit = incremental_stream(tokens)
+    legacy = time_ms(lambda: legacy_stream(tokens), args.stream_repeat)
+    incremental = time_ms(lambda: incremental_stream(tokens), args.stream_repeat)
+    print(f"  旧正则        {summarize(legacy)} | 第 {legacy_hit} 个token识别到最终答案")
+    print(f"  增量解析器    {summarize(incremental)} | 第 {incremental_hit} 个token最终答案段落结束")
+    print(f"  加速 {statistics.mean(legacy) / statistics.mean(incremental):.1f} 倍, "
+          f"提前结束可省去 {len(tokens) - incremental_hit} 个token")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
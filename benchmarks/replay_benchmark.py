@@ -0,0 +1,124 @@
+"""
+回放基准测试 - 用录像（core.cassette）离线运行完整的Agent链路，测量框架本身的耗时和吞吐
+
+先用真实模型录制（cassette.mode = "record"），再用replay模型回放录像中的对话，
+输入取自录像中每段对话的第一条用户消息，不需要Ollama或API Key:
+
+    python benchmarks/replay_benchmark.py --cassette cassettes/default.jsonl
+    python benchmarks/replay_benchmark.py --cassette cassettes/default.jsonl --latency recorded --concurrency 8
+    python benchmarks/replay_benchmark.py --cassette cassettes/default.jsonl --latency fixed --fixed-ms 200 --stream
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core.agent_factory import AgentFactory  # noqa: E402
+from core.cassette import CassetteMissError  # noqa: E402
+from core.config_snapshot import config_store  # noqa: E402
+
+
+def load_inputs(path: str) -> list:
+    """录像中每段对话的第一条用户消息（只有系统提示词和一条用户消息的模型请求）"""
+    inputs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry["kind"] != "llm":
+                continue
+            roles = [message["role"] for message in entry["request"]["messages"]]
+            if roles.count("human") == 1 and roles[-1] == "human" and "ai" not in roles:
+                text = entry["request"]["messages"][-1]["content"]
+                if text not in inputs:
+                    inputs.append(text)
+    return inputs
+
+
+def run_one(agent, text: str, stream: bool) -> dict:
+    """执行一次请求，返回总耗时和（流式时）最终答案开始的耗时"""
+    started = time.perf_counter()
+    answer_at = None
+    try:
+        if stream:
+            for event in agent.stream({"input": text}):
+                if event.get("type") == "answer_start" and answer_at is None:
+                    answer_at = time.perf_counter()
+        else:
+            agent.invoke({"input": text})
+    except CassetteMissError:
+        return {"miss": True}
+    ended = time.perf_counter()
+    result = {"total_ms": (ended - started) * 1000}
+    if answer_at is not None:
+        result["answer_ms"] = (answer_at - started) * 1000
+    return result
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def summarize(values: list) -> str:
+    return (f"平均 {statistics.mean(values):9.2f} ms | 中位数 {statistics.median(values):9.2f} ms | "
+            f"P95 {percentile(values, 95):9.2f} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="回放基准测试")
+    parser.add_argument("--cassette", default="cassettes/default.jsonl", help="录像文件路径")
+    parser.add_argument("--agent", default="joke", help="Agent名称（需要与录制时相同）")
+    parser.add_argument("--latency", choices=["none", "recorded", "fixed"], default="none",
+                        help="模型和工具的耗时：none不等待，recorded录制时的耗时，fixed固定耗时")
+    parser.add_argument("--fixed-ms", type=float, default=0, help="latency为fixed时每次调用的耗时（毫秒）")
+    parser.add_argument("--requests", type=int, default=100, help="请求总数（按顺序循环使用录像中的输入）")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发数")
+    parser.add_argument("--stream", action="store_true", help="使用流式调用，同时统计最终答案开始的耗时")
+    args = parser.parse_args()
+    
+    if not os.path.exists(args.cassette):
+        print(f"❌ 录像文件不存在: {args.cassette}（先设置 cassette.mode = \"record\" 用真实模型录制）")
+        return 1
+    inputs = load_inputs(args.cassette)
+    if not inputs:
+        print(f"❌ 录像中没有可用作输入的对话: {args.cassette}")
+        return 1
+    
+    config_store.update({
+        "model_type": "replay",
+        "cassette": {"mode": "off"},
+        "replay": {"cassette": args.cassette, "latency": args.latency, "fixed_latency_ms": args.fixed_ms},
+    })
+    agent = AgentFactory.create_agent(agent_name=args.agent, model_type="replay")
+    agent.get_agent_executor()
+    texts = [inputs[i % len(inputs)] for i in range(args.requests)]
+    print(f"🔍 回放基准测试: {len(inputs)} 段对话, {args.requests} 个请求, 并发 {args.concurrency}, "
+          f"耗时 {args.latency}{f' {args.fixed_ms}ms' if args.latency == 'fixed' else ''}\n")
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda text: run_one(agent, text, args.stream), texts))
+    elapsed = time.perf_counter() - started
+    
+    done = [r for r in results if not r.get("miss")]
+    misses = len(results) - len(done)
+    if done:
+        print(f"  总耗时        {summarize([r['total_ms'] for r in done])}")
+        answers = [r["answer_ms"] for r in done if "answer_ms" in r]
+        if answers:
+            print(f"  最终答案开始  {summarize(answers)}")
+    print(f"  吞吐 {len(done) / elapsed:.1f} 请求/秒, 未命中录像 {misses} 个")
+    # 有未命中时返回非0（用于CI检查Agent改动是否改变了对话）
+    return 1 if misses else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
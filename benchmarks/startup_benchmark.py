@@ -0,0 +1,130 @@
+"""
+启动耗时基准测试 - 测量app.py的导入耗时和首个请求就绪时间（冷启动）
+
+每一轮都在新的Python进程中执行，避免模块缓存影响结果:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 10 --path /api/agents
+    python benchmarks/startup_benchmark.py --importtime 15          # 列出累计导入耗时最高的模块
+    python benchmarks/startup_benchmark.py --max-import-ms 1500     # 超过阈值时返回非0（用于CI）
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只在使用对应Provider时才应该被导入的重量级依赖
+LAZY_MODULES = ["langchain_openai", "langchain_google_genai", "langchain_ollama"]
+
+CHILD_SCRIPT = r"""
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get({path!r})
+ready = time.perf_counter()
+print(json.dumps({{
+    "ready_at": time.time(),
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (ready - imported) * 1000,
+    "status": response.status_code,
+    "module_count": len(sys.modules),
+    "lazy_modules_loaded": [m for m in {lazy_modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once(path: str) -> dict:
+    """在新进程中导入app并发送第一个请求，返回各阶段耗时"""
+    script = CHILD_SCRIPT.format(root=ROOT, path=path, lazy_modules=LAZY_MODULES)
+    spawned_at = time.time()
+    proc = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"子进程执行失败:\n{proc.stderr}")
+    # app导入时可能打印初始化信息，结果在最后一行
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_ready_ms"] = (result.pop("ready_at") - spawned_at) * 1000
+    return result
+
+
+def import_profile(top: int) -> list:
+    """使用 -X importtime 统计累计导入耗时最高的模块"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        # 格式: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, module = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        rows.append((int(cumulative_us), int(self_us), module.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def summarize(values: list) -> str:
+    return (
+        f"中位数 {statistics.median(values):8.1f} ms | "
+        f"最小 {min(values):8.1f} ms | 最大 {max(values):8.1f} ms"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="app.py冷启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="测试轮数（每轮一个新进程）")
+    parser.add_argument("--path", default="/api/config", help="首个请求的路径（不应触发模型调用）")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="列出累计导入耗时最高的N个模块")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="导入耗时中位数上限，超过时返回1")
+    args = parser.parse_args()
+    
+    print(f"🚀 冷启动基准测试: {args.runs} 轮，首个请求 GET {args.path}\n")
+    results = []
+    for i in range(args.runs):
+        result = run_once(args.path)
+        results.append(result)
+        print(
+            f"  第{i + 1}轮: 导入 {result['import_ms']:.1f} ms, "
+            f"首个请求 {result['first_request_ms']:.1f} ms, "
+            f"进程启动到就绪 {result['process_ready_ms']:.1f} ms (HTTP {result['status']})"
+        )
+    
+    import_ms = [r["import_ms"] for r in results]
+    print("\n📊 汇总")
+    print(f"  导入app.py        {summarize(import_ms)}")
+    print(f"  首个请求          {summarize([r['first_request_ms'] for r in results])}")
+    print(f"  进程启动到就绪    {summarize([r['process_ready_ms'] for r in results])}")
+    print(f"  已加载模块数      {results[-1]['module_count']}")
+    
+    lazy_loaded = results[-1]["lazy_modules_loaded"]
+    if lazy_loaded:
+        print(f"  ⚠️ 启动时加载了应按需导入的模块: {', '.join(lazy_loaded)}")
+    else:
+        print(f"  ✅ 未提前加载Provider依赖: {', '.join(LAZY_MODULES)}")
+    
+    if args.importtime:
+        print(f"\n🐢 累计导入耗时最高的 {args.importtime} 个模块")
+        for cumulative_us, self_us, module in import_profile(args.importtime):
+            print(f"  {cumulative_us / 1000:8.1f} ms (自身 {self_us / 1000:6.1f} ms)  {module}")
+    
+    if args.max_import_ms is not None and statistics.median(import_ms) > args.max_import_ms:
+        print(f"\n❌ 导入耗时中位数超过阈值 {args.max_import_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,12 +5,12 @@ import os
 from typing import Literal
 
 # 模型类型
-ModelType = Literal["ollama", "gemini", "deepseek"]
+ModelType = Literal["ollama", "gemini", "deepseek", "replay"]
 
-# 默认配置
+# 默认配置（启动时的初始配置，运行时通过core.config_snapshot.config_store读取和更新，不要直接修改）
 DEFAULT_CONFIG = {
     # 当前使用的模型类型
-    "model_type": os.getenv("MODEL_TYPE", "ollama"),  # 可以改为 "gemini", "deepseek"
+    "model_type": os.getenv("MODEL_TYPE", "ollama"),  # 可以改为 "gemini", "deepseek", "replay"
     
     # 默认Agent类型
     "default_agent": os.getenv("DEFAULT_AGENT", "joke"),  # 可以改为其他Agent类型
@@ -20,6 +20,12 @@ DEFAULT_CONFIG = {
         "model": "qwen2.5:1.5b",  # 可以改为 "llama3.2:3b" 或其他
         "base_url": "http://localhost:11434",
         "temperature": 0.7,
+        "keep_alive": "30m",  # 模型在Ollama中保持加载的时间（如"30m"、"1h"，-1表示一直保持）
+        "model_keep_alive": {},  # 按模型覆盖keep_alive，如 {"qwen2.5:7b": "10m"}
+        "warmup": True,  # 启动时和切换模型后预加载模型，首个请求不再等待模型加载
+        "keep_alive_ping_interval": 0,  # 定期发送保活请求的间隔（秒），0表示不发送
+        # 进程级共享连接池（所有Agent的Ollama客户端共用）
+        "http_pool": {"max_connections": 8, "max_keepalive_connections": 4, "keepalive_expiry": 300},
     },
     
     # Google Gemini配置
@@ -27,6 +33,8 @@ DEFAULT_CONFIG = {
         "model": "gemini-2.0-flash-exp",  # 或 "gemini-pro", "gemini-1.5-flash", "gemini-2.0-flash-exp"
         "api_key": os.getenv("GOOGLE_API_KEY", ""),
         "temperature": 0.7,
+        "cached_content": "",  # 显式缓存的名称（"cachedContents/..."），为空则只使用隐式缓存
+        "http_pool": {"max_connections": 10, "max_keepalive_connections": 5, "keepalive_expiry": 60},
     },
     
     # DeepSeek配置（支持官方API和硅基流动）
@@ -35,6 +43,18 @@ DEFAULT_CONFIG = {
         "api_key": os.getenv("DEEPSEEK_API_KEY", "") or os.getenv("SILICONFLOW_API_KEY", ""),
         "base_url": "https://api.siliconflow.cn/v1",  # 硅基流动API，或 "https://api.deepseek.com/v1"（官方）
         "temperature": 0.7,
+        # max_connections应不小于scheduler中该Provider的max_concurrency（对冲请求也占用连接）
+        "http_pool": {"max_connections": 20, "max_keepalive_connections": 10, "keepalive_expiry": 60},
+    },
+    
+    # 回放配置（model_type为"replay"时按请求哈希返回录像中的响应，不访问模型服务，见cassette配置）
+    "replay": {
+        "cassette": "cassettes/default.jsonl",  # 录像文件路径
+        "model": "replay",  # 指标、日志和运行记录中显示的模型名称
+        "latency": "recorded",  # "recorded"按录制时的耗时等待，"fixed"固定等待fixed_latency_ms，"none"不等待
+        "fixed_latency_ms": 0,  # latency为"fixed"时每次模型/工具调用的耗时（毫秒）
+        "stream_chunk_chars": 4,  # 流式回放时每个块的字符数
+        "tools": "replay",  # 工具调用："replay"回放录制的输出，"fallback"没有录制时执行真实工具，"live"总是执行真实工具
     },
     
     # Agent配置
@@ -44,10 +64,140 @@ DEFAULT_CONFIG = {
         "max_iterations": 5,
     },
     
+    # Agent实例缓存配置（每个"Agent:模型类型"组合缓存一个实例，包含LLM客户端、工具和编译后的执行器）
+    "agent_cache": {
+        "max_entries": 16,  # 最多缓存的Agent实例数（LRU淘汰）
+        "idle_ttl": 1800,  # 超过该时间（秒）未使用的实例被淘汰，0表示不按空闲时间淘汰
+        "max_memory_mb": 512,  # 所有实例的估算内存上限（MB），0表示不限制
+    },
+    
+    # 批量调用配置（/api/agent/batch）
+    "batch": {
+        "max_concurrency": 4,  # 默认最大并发数（请求中可指定更小的值）
+        "max_items": 200,  # 单次批量请求的最大条目数
+    },
+    
+    # 异步任务配置（/api/jobs）
+    "jobs": {
+        "max_workers": 2,  # 工作线程数（按模型服务实际承载能力设置，Ollama建议1-2）
+        "max_queue_size": 50,  # 最大排队任务数，超过后返回429
+        "result_ttl": 3600,  # 已完成任务结果保留时间（秒）
+        "max_stored_jobs": 1000,  # 最多保留的任务记录数
+    },
+    
+    # 响应缓存配置（内存LRU + SQLite磁盘两级缓存）
+    # Agent可在default_config中用 cache_enabled=False 关闭缓存、cache_ttl 指定TTL（秒）
+    "response_cache": {
+        "enable": True,
+        "ttl": 3600,  # 默认缓存时间（秒）
+        "max_memory_entries": 256,  # 内存层最大条目数（LRU淘汰）
+        "db_path": "cache/responses.sqlite3",  # 磁盘层路径，为空则只使用内存层
+    },
+    
+    # Provider调度配置（限制每个模型服务的并发数和请求/Token速率，超出的调用按Agent轮转排队）
+    # 未配置的Provider使用其类上声明的default_limits，各项取0表示不限制
+    "scheduler": {
+        "enable": True,
+        "queue_timeout": 120,  # 排队等待超时时间（秒），0表示不超时
+        "providers": {
+            # "ollama": {"max_concurrency": 1},
+            # "deepseek": {"max_concurrency": 8, "requests_per_minute": 60, "tokens_per_minute": 0},
+        },
+    },
+    
+    # 请求对冲配置（调用超过该Provider近期延迟的分位数仍未返回时，再发一个相同请求，采用先完成的结果）
+    # 会增加请求量和费用，默认关闭；只对providers中列出的Provider生效，各Provider可覆盖下面的参数
+    # 同步调用中落败的请求无法取消，会继续占用调度器并发槽和连接池连接直到完成：
+    # 调度器max_concurrency为1的Provider（如Ollama）同步调用不做对冲，其他Provider的max_concurrency和http_pool要留出余量
+    "hedging": {
+        "enable": False,
+        "percentile": 95,  # 对冲延迟取近期主请求延迟的该分位数
+        "min_delay": 1.0,  # 对冲延迟下限（秒）
+        "max_delay": 10.0,  # 对冲延迟上限（秒）
+        "initial_delay": 5.0,  # 延迟样本不足时使用的对冲延迟（秒）
+        "min_samples": 20,  # 按分位数计算前至少需要的样本数
+        "window": 200,  # 参与计算的最近请求数
+        "providers": {
+            "deepseek": {},  # 可指定对冲请求发往的备用Provider，如 {"secondary": "gemini"}
+        },
+    },
+    
+    # Provider健康监控配置（后台探测模型服务，连续失败后熔断，请求立即失败或切换到备用模型）
+    "provider_health": {
+        "enable": True,
+        "probe_interval": 15,  # 后台探测间隔（秒）
+        "probe_timeout": 2,  # 单次探测超时时间（秒）
+        "failure_threshold": 3,  # 连续失败多少次后熔断（探测和实际请求的失败都计入）
+        "open_timeout": 30,  # 熔断多久后进入半开状态，允许探测和请求重新尝试（秒）
+        "fallback": {
+            # "ollama": "deepseek",  # Ollama熔断时改用DeepSeek
+        },
+    },
+    
+    # Ollama控制面配置（模型列表、健康探测等管理请求共用连接池）
+    "ollama_control": {
+        "pool_maxsize": 4,  # 连接池大小
+        "timeout": 2,  # 请求超时时间（秒）
+        "models_cache_ttl": 10,  # 模型列表缓存时间（秒），过期后先返回旧数据并在后台刷新
+        "models_max_stale": 300,  # 旧数据最长可用时间（秒），超过后同步刷新
+        "warmup_timeout": 120,  # 预加载模型的超时时间（秒），大模型首次加载较慢
+    },
+    
+    # 链路追踪配置（记录每次请求中创建Agent、LLM调用、工具调用、反思节点等阶段的耗时）
+    "tracing": {
+        "enable": True,
+        "export_path": "logs/traces.jsonl",  # OTLP JSON导出文件（每行一次请求），为空则不导出
+        "service_name": "langchain-agent",  # 导出数据中的service.name
+        "server_timing": True,  # /api/agent/invoke 响应是否带Server-Timing头
+    },
+    
+    # 后台日志写入器配置（LLM交互日志、反思日志由一个后台线程批量写入，请求线程不做文件I/O）
+    "log_writer": {
+        "max_queue_size": 10000,  # 队列中最多等待写入的记录数（一次回调为一条记录）
+        "overflow": "block",  # 队列满时："block"等待最多block_timeout秒后丢弃，"drop"直接丢弃
+        "block_timeout": 1.0,  # 队列满时最长等待时间（秒）
+        "flush_bytes": 65536,  # 缓冲数据达到该字节数时刷新到磁盘
+        "flush_interval": 0.5,  # 最早的未刷新记录超过该时间（秒）时刷新到磁盘
+        "rotate_max_bytes": 50 * 1024 * 1024,  # 日志文件超过该大小时轮转（0表示不按大小轮转）
+        "rotate_interval": 0,  # 日志文件打开超过该时间（秒）时轮转，如86400为每天（0表示不按时间轮转）
+        "rotate_backups": 10,  # 每个日志文件保留的轮转备份数（0表示全部保留）
+        "rotate_compress": True,  # 是否用gzip压缩轮转后的备份
+    },
+    
+    # 运行记录存储（每次Agent执行的耗时、Token数、错误等摘要写入SQLite，通过 /api/traces 查询）
+    "trace_store": {
+        "enable": True,
+        "db_path": "logs/traces.sqlite3",  # 数据库路径，为空则不记录
+        "retention_days": 7,  # 保留天数（0表示不按时间清理）
+        "max_runs": 100000,  # 最多保留的执行记录数，超出时删除最旧的（0表示不限制）
+        "compact_interval": 300,  # 清理过期记录并回收文件空间的间隔（秒）
+        "max_queue_size": 10000,  # 等待写入的记录数上限，超出时丢弃
+        "batch_size": 200,  # 后台线程一个事务最多写入的记录数
+        "max_page_size": 500,  # 查询接口每页最多返回的条数
+    },
+    
+    # 录制配置（mode为"record"时，每次模型请求/响应和工具调用按请求哈希追加到录像文件，供replay模型离线回放）
+    "cassette": {
+        "mode": "off",  # "off"不录制，"record"录制
+        "path": "cassettes/default.jsonl",  # 录像文件路径（追加写入）
+    },
+    
     # 日志配置
     "logging": {
         "llm_console_output": False,  # 是否在控制台显示LLM详细日志（False=只保存到文件）
         "llm_log_file": "logs/llm_interactions.log",  # LLM交互日志文件路径
+        "format": "text",  # 日志格式："text"易读文本，"jsonl"每个事件一行JSON，"both"同时写两种
+        "jsonl_file": "logs/llm_interactions.jsonl",  # 结构化日志文件路径（可用 python -m core.log_renderer 渲染）
+        "max_content_chars": 4000,  # 结构化日志中每段内容（消息、工具输入输出）的最大字符数
+        # 日志级别："off"不记录，"metadata"只记录模型、耗时、Token等元数据，"full"记录完整内容，"debug"再加调试信息
+        # Agent可在default_config中用 log_tier 单独指定，开启tier_header后请求头指定的级别优先
+        "tier": "metadata",
+        "full_sample_rate": 0.01,  # metadata级别下按该比例抽样记录完整内容
+        "slow_request_ms": 10000,  # 耗时超过该值（毫秒）的请求补记完整内容（0表示不按耗时补记）
+        "capture_errors": True,  # 出错的请求补记完整内容
+        # 指定单个请求日志级别的请求头（如"X-Log-Tier"），默认为空即不允许按请求指定：
+        # 任何客户端都能用它强制记录debug日志或关闭自己请求的错误补记，只应在可信的内部部署中开启
+        "tier_header": "",
         "log_level": "INFO",  # 日志级别：DEBUG, INFO, WARNING, ERROR
     },
     
@@ -1,8 +1,5 @@
 """
-核心模块初始化 - 自动注册默认工具
+核心模块
+
+默认工具不在导入时构建，由AgentFactory在首次创建Agent时注册。
 """
-try:
-    from tools.joke_tools import get_joke_tools
-    get_joke_tools()
-except ImportError:
-    pass
@@ -0,0 +1,228 @@
+"""
+Agent实例缓存 - 有界LRU + 空闲超时淘汰，带内存估算和统计
+"""
+import gc
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from types import FunctionType, ModuleType
+from typing import Any, Callable, Dict, Hashable, Optional
+from core.config_snapshot import config_store
+
+# 不计入实例内存的共享对象类型（类、模块、函数等属于进程级别）
+_SHARED_TYPES = (type, ModuleType, FunctionType)
+
+
+def estimate_size(obj: Any, max_objects: int = 50000) -> int:
+    """
+    估算对象图占用的内存（字节）
+    
+    沿gc引用遍历，跳过类、模块和函数；Agent之间共享的对象（如工具、HTTP连接池）
+    会在每个Agent中重复计入，因此结果偏向上界。遍历对象数超过max_objects时提前结束。
+    """
+    seen = set()
+    pending = deque([obj])
+    total = 0
+    while pending and len(seen) < max_objects:
+        current = pending.popleft()
+        if id(current) in seen or isinstance(current, _SHARED_TYPES):
+            continue
+        seen.add(id(current))
+        try:
+            total += sys.getsizeof(current)
+        except TypeError:
+            continue
+        pending.extend(gc.get_referents(current))
+    return total
+
+
+class _Entry:
+    """缓存项"""
+    
+    __slots__ = ("value", "versions", "memory_bytes", "build_time", "created_at", "last_used", "hits")
+    
+    def __init__(self, value: Any, versions: Hashable, memory_bytes: int, build_time: float):
+        self.value = value
+        self.versions = versions
+        self.memory_bytes = memory_bytes
+        self.build_time = build_time
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.hits = 0
+
+
+class AgentCache:
+    """
+    Agent实例缓存
+    
+    - 条目数超过max_entries或估算内存超过max_memory_mb时，按最近最少使用淘汰
+    - 超过idle_ttl秒未被使用的条目在下次访问缓存时淘汰
+    - 条目记录创建时的配置版本，版本不一致视为未命中并重建
+    - 同一个key的并发未命中只构建一次
+    """
+    
+    def __init__(self, cache_config: Dict[str, Any] = None):
+        """
+        初始化Agent缓存
+        
+        Args:
+            cache_config: 缓存配置，默认读取当前配置快照的"agent_cache"配置节
+        """
+        self._config = cache_config
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._builds = 0
+        self._build_errors = 0
+        self._total_build_time = 0.0
+        self._evictions = {"lru": 0, "idle": 0, "memory": 0, "stale": 0}
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("agent_cache")
+    
+    def get_or_build(self, key: str, versions: Hashable, builder: Callable[[], Any]) -> Any:
+        """
+        获取缓存的实例，未命中或版本不一致时调用builder构建
+        
+        Args:
+            key: 缓存key（如"joke:ollama"）
+            versions: 实例依赖的配置版本，与缓存项不一致时重建
+            builder: 构建函数，抛出的异常原样向上传递（不缓存失败结果）
+        """
+        value = self._lookup(key, versions)
+        if value is not None:
+            return value
+        
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            # 等待期间可能已被其他线程构建完成
+            value = self._lookup(key, versions, count_miss=False)
+            if value is not None:
+                return value
+            
+            start = time.perf_counter()
+            try:
+                value = builder()
+            except Exception:
+                with self._lock:
+                    self._build_errors += 1
+                raise
+            build_time = time.perf_counter() - start
+            memory_bytes = estimate_size(value)
+            
+            with self._lock:
+                self._builds += 1
+                self._total_build_time += build_time
+                self._entries[key] = _Entry(value, versions, memory_bytes, build_time)
+                self._entries.move_to_end(key)
+                self._evict_locked(protect=key)
+            return value
+    
+    def _lookup(self, key: str, versions: Hashable, count_miss: bool = True) -> Optional[Any]:
+        with self._lock:
+            self._evict_idle_locked()
+            entry = self._entries.get(key)
+            if entry is not None and entry.versions != versions:
+                del self._entries[key]
+                self._evictions["stale"] += 1
+                entry = None
+            if entry is None:
+                if count_miss:
+                    self._misses += 1
+                return None
+            entry.hits += 1
+            entry.last_used = time.time()
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry.value
+    
+    def _evict_idle_locked(self) -> None:
+        """淘汰空闲超时的条目（调用方需持有锁）"""
+        idle_ttl = self._get_config().get("idle_ttl", 0)
+        if not idle_ttl:
+            return
+        deadline = time.time() - idle_ttl
+        # OrderedDict按最近使用排序，从最旧的开始检查
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_used > deadline:
+                break
+            del self._entries[key]
+            self._evictions["idle"] += 1
+    
+    def _evict_locked(self, protect: str = None) -> None:
+        """按条目数和内存预算淘汰最久未使用的条目（刚插入的protect条目除外）"""
+        cache_config = self._get_config()
+        max_entries = cache_config.get("max_entries", 0)
+        max_memory = (cache_config.get("max_memory_mb", 0) or 0) * 1024 * 1024
+        
+        self._evict_idle_locked()
+        while max_entries and len(self._entries) > max_entries:
+            if not self._pop_oldest_locked(protect):
+                break
+            self._evictions["lru"] += 1
+        while max_memory and self._total_memory_locked() > max_memory:
+            if not self._pop_oldest_locked(protect):
+                break
+            self._evictions["memory"] += 1
+    
+    def _pop_oldest_locked(self, protect: str = None) -> bool:
+        for key in self._entries:
+            if key != protect:
+                del self._entries[key]
+                return True
+        return False
+    
+    def _total_memory_locked(self) -> int:
+        return sum(entry.memory_bytes for entry in self._entries.values())
+    
+    def clear(self) -> int:
+        """清空缓存，返回清除的条目数"""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（大小、命中、构建次数和耗时、各条目内存估算）"""
+        cache_config = self._get_config()
+        now = time.time()
+        with self._lock:
+            self._evict_idle_locked()
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": cache_config.get("max_entries", 0),
+                "idle_ttl": cache_config.get("idle_ttl", 0),
+                "memory_mb": round(self._total_memory_locked() / 1024 / 1024, 2),
+                "max_memory_mb": cache_config.get("max_memory_mb", 0),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "builds": self._builds,
+                "build_errors": self._build_errors,
+                "avg_build_ms": round(self._total_build_time / self._builds * 1000, 1) if self._builds else 0.0,
+                "evictions": dict(self._evictions),
+                "entries": [
+                    {
+                        "key": key,
+                        "hits": entry.hits,
+                        "memory_mb": round(entry.memory_bytes / 1024 / 1024, 2),
+                        "build_ms": round(entry.build_time * 1000, 1),
+                        "idle_seconds": round(now - entry.last_used, 1),
+                    }
+                    for key, entry in reversed(self._entries.items())
+                ],
+            }
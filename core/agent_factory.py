@@ -5,38 +5,88 @@ from core.agent_registry import agent_registry, AgentDefinition
 from core.tool_registry import tool_registry
 from agents.base.base_agent import BaseAgent
 from agents.task.joke_agent import JokeAgent
-from typing import Dict, Any, List
-import config
+from core.provider_scheduler import provider_scheduler, ScheduledChatModel
+from core.provider_health import provider_health
+from core.request_hedging import request_hedging, HedgedChatModel
+from langchain_core.language_models import BaseChatModel
+from core.config_snapshot import config_store
+from core.tracing import tracer
+from core.cassette import cassette_store
+from typing import Dict, Any, Iterator, List, Mapping
+import importlib
+
+
+class _LazyProviders(Mapping):
+    """
+    按需加载的提供者映射
+    
+    键为已登记的模型类型，首次取值时才导入对应模块并创建提供者实例，
+    只使用Ollama时不会导入langchain_openai、langchain_google_genai等依赖。
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+    
+    def __getitem__(self, model_type: str):
+        if model_type not in self._factory._provider_paths:
+            raise KeyError(model_type)
+        return self._factory.get_provider(model_type)
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._factory._provider_paths)
+    
+    def __len__(self) -> int:
+        return len(self._factory._provider_paths)
 
 
 class AgentFactory:
     """Agent工厂类"""
     
-    _providers = None
+    # 模型类型 -> 提供者类的导入路径（"模块:类名"）
+    _provider_paths: Dict[str, str] = {
+        "ollama": "providers.ollama_provider:OllamaProvider",
+        "gemini": "providers.gemini_provider:GeminiProvider",
+        "deepseek": "providers.deepseek_provider:DeepSeekProvider",
+        "replay": "providers.replay_provider:ReplayProvider",
+    }
+    _providers: Dict[str, Any] = {}
     _agent_classes = {"joke": JokeAgent}
+    _default_tools_registered = False
     
     @classmethod
-    def _get_providers(cls):
-        """延迟加载提供者"""
-        if cls._providers is None:
-            from providers.ollama_provider import OllamaProvider
-            from providers.gemini_provider import GeminiProvider
-            from providers.deepseek_provider import DeepSeekProvider
-            cls._providers = {
-                "ollama": OllamaProvider(),
-                "gemini": GeminiProvider(),
-                "deepseek": DeepSeekProvider(),
-            }
-        return cls._providers
+    def register_provider(cls, model_type: str, import_path: str) -> None:
+        """登记提供者（import_path格式为"模块:类名"，首次使用时才导入）"""
+        cls._provider_paths[model_type] = import_path
+        cls._providers.pop(model_type, None)
+    
+    @classmethod
+    def get_provider(cls, model_type: str):
+        """获取提供者实例（首次调用时导入模块）"""
+        provider = cls._providers.get(model_type)
+        if provider is None:
+            import_path = cls._provider_paths.get(model_type)
+            if import_path is None:
+                raise ValueError(f"不支持的模型类型: {model_type}。可用模型: {list(cls._provider_paths.keys())}")
+            module_name, class_name = import_path.split(":")
+            provider_class = getattr(importlib.import_module(module_name), class_name)
+            provider = cls._providers[model_type] = provider_class()
+        return provider
+    
+    @classmethod
+    def _get_providers(cls) -> Mapping:
+        """延迟加载提供者（返回按需导入的映射）"""
+        return _LazyProviders(cls)
     
     @classmethod
     def _register_default_agents(cls):
-        """注册默认Agent定义"""
-        try:
-            from tools.joke_tools import get_joke_tools
-            get_joke_tools()
-        except ImportError:
-            pass
+        """注册默认Agent定义（默认工具只在首次调用时构建）"""
+        if not cls._default_tools_registered:
+            try:
+                from tools.joke_tools import get_joke_tools
+                get_joke_tools()
+            except ImportError:
+                pass
+            cls._default_tools_registered = True
         
         if "joke" not in agent_registry.list_agents():
             agent_def = AgentDefinition(
@@ -44,7 +94,14 @@ class AgentFactory:
                 display_name="笑话Agent",
                 description="专门用于讲笑话的Agent",
                 tool_groups=["joke"],
-                default_config={"verbose": True, "max_iterations": 5}
+                default_config={
+                    "verbose": True,
+                    "max_iterations": 5,
+                    # 热门请求（如"讲个笑话"）并发到达时合并为一次执行
+                    "coalesce_requests": True,
+                    # 笑话需要每次随机，不缓存结果
+                    "cache_enabled": False,
+                }
             )
             agent_registry.register_agent(agent_def)
     
@@ -53,12 +110,16 @@ class AgentFactory:
         cls,
         agent_name: str = None,
         model_type: str = None,
-        custom_config: Dict = None
+        custom_config: Mapping = None
     ) -> BaseAgent:
-        """创建Agent实例"""
+        """
+        创建Agent实例
+        
+        custom_config为完整配置（dict或ConfigSnapshot），默认使用当前配置快照。
+        """
         cls._register_default_agents()
         
-        config_dict = custom_config or config.DEFAULT_CONFIG
+        config_dict = custom_config or config_store.current()
         agent_name = agent_name or config_dict.get("default_agent", "joke")
         model_type = model_type or config_dict.get("model_type", "ollama")
         
@@ -67,22 +128,32 @@ class AgentFactory:
         if not agent_def:
             raise ValueError(f"未找到Agent定义: {agent_name}。可用Agent: {agent_registry.list_agents()}")
         
-        # 获取模型提供者
-        providers = cls._get_providers()
-        provider = providers.get(model_type)
-        if not provider:
-            raise ValueError(f"不支持的模型类型: {model_type}。可用模型: {list(providers.keys())}")
+        # 获取模型提供者（首次使用时才导入对应的模块）
+        provider = cls.get_provider(model_type)
         
-        # 验证并创建LLM
+        # 读取后台探测的健康状态，熔断中直接失败，不在请求路径上探测
         model_config = config_dict.get(model_type, {})
-        if not provider.validate_config(model_config):
-            raise ValueError(f"{model_type} 配置无效或服务不可用")
-        llm = provider.get_llm(model_config)
+        with tracer.span("provider.validate", model=model_type):
+            provider_health.watch(model_type)
+            # 经AgentService.get_agent创建时已经检查过（半开状态下已占用试探请求），这里不再占用
+            provider_health.check(model_type, admit_trial=False)
+            if not provider.validate_config(model_config):
+                raise ValueError(f"{model_type} 配置无效或服务不可用")
+        
+        # 创建LLM
+        with tracer.span("provider.get_llm", model=model_type):
+            llm = provider.get_llm(model_config)
+            # 录制模式下录制Provider的原始响应（在调度器之内，耗时不含排队）
+            llm = cassette_store.wrap_llm(llm)
+            llm = cls._wrap_llm(llm, model_type, agent_name, provider, config_dict)
         
-        # 获取工具
-        tools = []
+        # 获取工具（按名称去重排序：工具定义是提示词前缀的一部分，顺序固定才能命中Provider的前缀缓存）
+        tools_by_name = {}
         for group in agent_def.tool_groups:
-            tools.extend(tool_registry.get_tools(group=group))
+            for tool in tool_registry.get_tools(group=group):
+                tools_by_name.setdefault(tool.name, tool)
+        tools = [tools_by_name[name] for name in sorted(tools_by_name)]
+        tools = cassette_store.wrap_tools(provider.wrap_tools(tools, model_config))
         
         if not tools:
             raise ValueError(f"Agent '{agent_name}' 没有可用的工具。工具组: {agent_def.tool_groups}")
@@ -91,17 +162,52 @@ class AgentFactory:
         agent_config = {**agent_def.default_config, **config_dict.get("agent", {})}
         agent_class = cls._agent_classes.get(agent_name, JokeAgent)
         
-        return agent_class(
+        agent = agent_class(
             name=agent_name,
             tools=tools,
             llm=llm,
             config=agent_config
         )
+        agent.model_type = model_type
+        return agent
+    
+    @classmethod
+    def _wrap_llm(cls, llm, model_type: str, agent_name: str, provider, config_dict: Mapping):
+        """为LLM接入Provider调度器，并按配置开启请求对冲（对冲请求同样经过调度器）"""
+        llm = cls._schedule_llm(llm, model_type, agent_name, provider)
+        policy = request_hedging.get_policy(model_type)
+        if policy is None or not isinstance(llm, BaseChatModel):
+            return llm
+        
+        secondary = None
+        if policy.secondary:
+            secondary_provider = cls.get_provider(policy.secondary)
+            secondary_config = config_dict.get(policy.secondary, {})
+            if secondary_provider.validate_config(secondary_config):
+                secondary = cls._schedule_llm(
+                    secondary_provider.get_llm(secondary_config), policy.secondary, agent_name, secondary_provider
+                )
+            else:
+                print(f"⚠️ 对冲备用模型 {policy.secondary} 配置无效，对冲请求改为发往 {model_type}")
+        return HedgedChatModel(inner=llm, secondary=secondary, policy=policy)
+    
+    @classmethod
+    def _schedule_llm(cls, llm, model_type: str, agent_name: str, provider):
+        """为LLM接入Provider调度器（同一Provider的所有Agent共享并发和速率限制）"""
+        if not provider_scheduler.is_enabled() or not isinstance(llm, BaseChatModel):
+            return llm
+        scheduler = provider_scheduler.get(model_type, provider.default_limits)
+        return ScheduledChatModel(
+            inner=llm,
+            scheduler=scheduler,
+            agent_name=agent_name,
+            queue_timeout=provider_scheduler.get_queue_timeout()
+        )
     
     @classmethod
     def get_available_models(cls) -> List[str]:
         """获取可用的模型列表"""
-        return list(cls._get_providers().keys())
+        return list(cls._provider_paths.keys())
     
     @classmethod
     def get_available_agents(cls) -> List[str]:
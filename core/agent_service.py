@@ -1,48 +1,174 @@
 """
 Agent服务层 - 处理Agent相关的业务逻辑
 """
-from typing import Dict, Any, List
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from typing import Dict, Any, List, AsyncIterator, Iterator
+from langchain_core.runnables import RunnableLambda
 from core.agent_factory import AgentFactory
 from agents.base.base_agent import BaseAgent
 from core.llm_logger import LLMLogger
+from core.single_flight import SingleFlight
+from core.response_cache import ResponseCache, response_cache
+from core.provider_scheduler import SchedulerTimeoutError, provider_scheduler
+from core.config_snapshot import ConfigSnapshot, config_store
+from core.agent_cache import AgentCache
+from core.provider_health import ProviderUnavailableError, is_provider_failure, provider_health
+from core.request_hedging import request_hedging
+from core.http_pools import http_pools
+from core.prompt_cache import PromptCacheTracker, prompt_cache_stats
+from core.metrics import agent_request_duration, agent_requests, metrics, metrics_callback
+from core.tracing import tracer, tracing_callback
+from core.trace_store import trace_callback, trace_store
+from core.cassette import cassette_store
+from core.log_writer import log_writer
 from agents.strategies.strategy_manager import strategy_manager
 from agents.strategies.reflection_strategy import ReflectionStrategy
-import config
+
+
+def normalize_input(user_input: str) -> str:
+    """
+    规范化用户输入（用于请求合并/缓存的key）
+    
+    只去掉首尾空白、统一换行符和Unicode表示；不改变大小写和内部空白，
+    因为代码类输入的缩进和大小写是有意义的。
+    """
+    text = unicodedata.normalize("NFC", user_input or "")
+    return text.replace("\r\n", "\n").strip()
 
 
 class AgentService:
     """Agent服务层"""
     
+    # update_config允许修改的模型配置字段
+    _UPDATABLE_MODEL_FIELDS = {
+        "ollama": ("model", "base_url"),
+        "gemini": ("api_key", "model"),
+        "deepseek": ("api_key", "model", "base_url"),
+        "replay": ("cassette", "latency", "fixed_latency_ms"),
+    }
+    
     def __init__(self):
-        self._agents: Dict[str, BaseAgent] = {}
+        # key为"agent_name:model_type"，缓存项带依赖配置节的版本号
+        self._agents = AgentCache()
+        self._single_flight = SingleFlight()
         self._init_strategies()
+        metrics.register_collector(self._collect_cache_metrics)
     
     def _init_strategies(self):
         """初始化增强策略"""
         # 注册反思策略（优先使用enhancement配置，向后兼容reflection配置）
-        enhancement_config = config.DEFAULT_CONFIG.get("enhancement", {}).get("reflection", {})
-        reflection_config = config.DEFAULT_CONFIG.get("reflection", {})
+        snapshot = config_store.current()
+        enhancement_config = snapshot.section("enhancement").get("reflection", {})
+        reflection_config = snapshot.section("reflection")
         # 合并配置，enhancement配置优先
         merged_config = {**reflection_config, **enhancement_config}
         reflection_strategy = ReflectionStrategy(merged_config)
         strategy_manager.register_strategy("reflection", reflection_strategy)
     
-    def get_agent(self, agent_name: str = None, model_type: str = None) -> BaseAgent:
-        """获取Agent实例（带缓存）"""
-        agent_name = agent_name or config.DEFAULT_CONFIG.get("default_agent", "joke")
-        model_type = model_type or config.DEFAULT_CONFIG.get("model_type", "ollama")
+    def get_agent(self, agent_name: str = None, model_type: str = None, snapshot: ConfigSnapshot = None) -> BaseAgent:
+        """
+        获取Agent实例（带缓存）
+        
+        缓存项记录创建时所依赖配置节（模型配置、agent、scheduler、hedging、cassette）的版本号，
+        这些配置节在新快照中发生变化时重新创建Agent。
+        模型服务熔断中时立即失败；未显式指定model_type时，可切换到provider_health.fallback配置的备用模型。
+        """
+        snapshot = snapshot or config_store.current()
+        agent_name = agent_name or snapshot.default_agent
+        if model_type:
+            provider_health.check(model_type)
+        else:
+            model_type = self._resolve_model_type(snapshot.model_type)
         cache_key = f"{agent_name}:{model_type}"
+        sections = [model_type, "agent", "scheduler", "hedging", "cassette"]
+        secondary = snapshot.section("hedging").get("providers", {}).get(model_type, {}).get("secondary")
+        if secondary:
+            # 对冲备用模型的配置变化同样需要重建
+            sections.append(secondary)
+        versions = tuple(snapshot.section_version(name) for name in sections)
         
-        if cache_key not in self._agents:
+        def build() -> BaseAgent:
             try:
-                self._agents[cache_key] = AgentFactory.create_agent(
-                    agent_name=agent_name,
-                    model_type=model_type
-                )
+                with tracer.span("agent_factory.create_agent", agent=agent_name, model=model_type):
+                    agent = AgentFactory.create_agent(
+                        agent_name=agent_name,
+                        model_type=model_type,
+                        custom_config=snapshot
+                    )
+                # 构建时就编译执行器，首个请求不再承担编译开销，内存估算也包含执行器
+                with tracer.span("agent.compile_executor", agent=agent_name):
+                    agent.get_agent_executor()
+                return agent
             except Exception as e:
                 raise ValueError(f"创建Agent失败: {str(e)}")
         
-        return self._agents[cache_key]
+        with tracer.span("agent_service.get_agent", agent=agent_name, model=model_type):
+            return self._agents.get_or_build(cache_key, versions, build)
+    
+    def warm_up(self, snapshot: ConfigSnapshot = None, background: bool = True) -> None:
+        """
+        预热当前模型：由Provider预加载模型（如Ollama加载模型到内存），并预先创建默认Agent
+        
+        服务启动时和切换模型后调用，首个请求不再承担模型加载和Agent创建的耗时。
+        """
+        snapshot = snapshot or config_store.current()
+        
+        def run():
+            model_type = snapshot.model_type
+            try:
+                AgentFactory.get_provider(model_type).warm_up(snapshot.section(model_type))
+                self.get_agent(snapshot=snapshot)
+            except Exception as e:
+                print(f"⚠️ 预热 {model_type} 失败: {e}")
+        
+        if background:
+            threading.Thread(target=run, name="agent-warm-up", daemon=True).start()
+        else:
+            run()
+    
+    def _resolve_model_type(self, model_type: str) -> str:
+        """返回实际使用的模型类型（熔断时切换到备用模型）"""
+        try:
+            provider_health.check(model_type)
+            return model_type
+        except ProviderUnavailableError:
+            fallback = provider_health.get_fallback(model_type)
+            if fallback:
+                return fallback
+            raise
+    
+    def _record_health(self, agent: BaseAgent, error: Exception = None) -> None:
+        """将实际调用结果计入Provider健康状态（只有服务故障类错误计入熔断）"""
+        if error is None:
+            provider_health.record_success(agent.model_type)
+        elif is_provider_failure(error):
+            provider_health.record_failure(agent.model_type, error)
+        else:
+            provider_health.release_trial(agent.model_type)
+    
+    def _record_request(self, agent: BaseAgent, mode: str, started: float = None, error: Exception = None) -> None:
+        """
+        记录一次Agent请求的结果：Provider健康状态和请求指标
+        
+        Args:
+            mode: 调用方式（invoke/stream）
+            started: 开始时间（time.perf_counter()），为None时只计数（如命中缓存）
+            error: 调用出错时的异常
+        """
+        if started is not None:
+            self._record_health(agent, error)
+        else:
+            provider_health.release_trial(agent.model_type)
+        status = "cached" if started is None else ("error" if error is not None else "success")
+        labels = {"agent": agent.name, "model": agent.model_type, "mode": mode}
+        agent_requests.inc(status=status, **labels)
+        if started is not None:
+            agent_request_duration.observe(time.perf_counter() - started, **labels)
     
     def invoke_agent(
         self,
@@ -50,67 +176,571 @@ class AgentService:
         user_input: str = "",
         callbacks: List = None
     ) -> Dict[str, Any]:
-        """调用Agent处理用户输入"""
+        """
+        调用Agent处理用户输入
+        
+        Agent定义的default_config中开启coalesce_requests时，相同Agent、
+        相同模型配置和相同（规范化后）输入的并发请求只执行一次，共享结果。
+        """
+        with tracer.start_trace("agent_service.invoke", agent=agent_name):
+            return self._invoke_agent(agent_name, user_input, callbacks)
+    
+    def _invoke_agent(self, agent_name: str, user_input: str, callbacks: List = None) -> Dict[str, Any]:
+        snapshot = config_store.current()
         try:
-            agent = self.get_agent(agent_name=agent_name)
-            
-            if callbacks is None:
-                callbacks = [LLMLogger()]
-            elif not any(isinstance(cb, LLMLogger) for cb in callbacks):
-                callbacks.append(LLMLogger())
+            agent = self.get_agent(agent_name=agent_name, snapshot=snapshot)
+        except Exception as e:
+            return self._error_result(e)
+        
+        cache_key = self._response_cache_key(agent, user_input, snapshot)
+        if cache_key is not None:
+            with tracer.span("response_cache.get"):
+                cached = response_cache.get(cache_key, agent.name)
+            if cached is not None:
+                self._record_request(agent, "invoke")
+                return {**cached, "cached": True}
+        
+        def run():
+            result = self._run_agent(agent, agent_name, user_input, callbacks, snapshot)
+            self._store_response(cache_key, agent, result)
+            return result
+        
+        if not agent.config.get("coalesce_requests", False):
+            return run()
+        result, shared = self._single_flight.do(self._coalesce_key(agent, user_input, snapshot), run)
+        return {**result, "coalesced": True} if shared else result
+    
+    def _run_agent(
+        self,
+        agent: BaseAgent,
+        agent_name: str,
+        user_input: str,
+        callbacks: List = None,
+        snapshot: ConfigSnapshot = None
+    ) -> Dict[str, Any]:
+        """执行一次Agent调用（应用增强策略）并转换为接口结果"""
+        snapshot = snapshot or config_store.current()
+        started = time.perf_counter()
+        try:
+            callbacks = self._ensure_logger(callbacks, snapshot, agent)
             
             # 使用策略管理器应用增强策略
             input_data = {"input": user_input}
             result = strategy_manager.apply_strategies(
                 agent=agent,
                 input_data=input_data,
+                snapshot=snapshot,
                 config={"callbacks": callbacks}
             )
+            self._record_request(agent, "invoke", started)
+            self._finish_logging(callbacks, started)
             
-            # 提取输出
-            if isinstance(result, dict):
-                output = result.get("output", result if isinstance(result, str) else str(result))
+            return self._success_result(result, agent_name, snapshot, agent.model_type)
+        except Exception as e:
+            self._record_request(agent, "invoke", started, e)
+            self._finish_logging(callbacks, started, e)
+            return self._error_result(e)
+    
+    def stream_agent(
+        self,
+        agent_name: str = None,
+        user_input: str = "",
+        callbacks: List = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        流式调用Agent，逐个产出事件（token、工具调用开始/结束、最终答案）
+        
+        启用了增强策略（如反思）时，中间结果会被策略改写，无法逐token输出，
+        此时退化为执行完成后一次性产出final事件。
+        """
+        snapshot = config_store.current()
+        resolved_agent = agent_name or snapshot.default_agent
+        agent = None
+        started = time.perf_counter()
+        try:
+            agent, callbacks = self._prepare_run(agent_name, callbacks, snapshot)
+            
+            yield {"type": "start", "agent_name": resolved_agent, "model_type": agent.model_type or snapshot.model_type}
+            
+            input_data = {"input": user_input}
+            run_config = {"callbacks": callbacks}
+            if strategy_manager.has_active_strategies(snapshot):
+                result = strategy_manager.apply_strategies(
+                    agent=agent,
+                    input_data=input_data,
+                    snapshot=snapshot,
+                    config=run_config
+                )
+                yield {"type": "final", "output": self._result_to_output(result)}
             else:
-                output = str(result)
+                yield from agent.stream(input_data, config=run_config)
+            self._record_request(agent, "stream", started)
+            self._finish_logging(callbacks, started)
+        except Exception as e:
+            if agent is not None:
+                self._record_request(agent, "stream", started, e)
+            self._finish_logging(callbacks, started, e)
+            error_msg = self._format_error(e)
+            yield {"type": "error", "error": error_msg, "output": f"错误: {error_msg}"}
+    
+    async def ainvoke_agent(
+        self,
+        agent_name: str = None,
+        user_input: str = "",
+        callbacks: List = None
+    ) -> Dict[str, Any]:
+        """异步调用Agent处理用户输入（等待模型I/O时不占用线程）"""
+        with tracer.start_trace("agent_service.ainvoke", agent=agent_name):
+            return await self._ainvoke_agent(agent_name, user_input, callbacks)
+    
+    async def _ainvoke_agent(self, agent_name: str, user_input: str, callbacks: List = None) -> Dict[str, Any]:
+        snapshot = config_store.current()
+        try:
+            # 创建Agent（含Provider校验）是阻塞操作，放到线程池执行
+            agent = await asyncio.to_thread(self.get_agent, agent_name, None, snapshot)
+        except Exception as e:
+            return self._error_result(e)
+        
+        cache_key = self._response_cache_key(agent, user_input, snapshot)
+        if cache_key is not None:
+            # 磁盘层是SQLite读取，放到线程池执行
+            with tracer.span("response_cache.get"):
+                cached = await asyncio.to_thread(response_cache.get, cache_key, agent.name)
+            if cached is not None:
+                self._record_request(agent, "invoke")
+                return {**cached, "cached": True}
+        
+        async def run():
+            result = await self._arun_agent(agent, agent_name, user_input, callbacks, snapshot)
+            await asyncio.to_thread(self._store_response, cache_key, agent, result)
+            return result
+        
+        if not agent.config.get("coalesce_requests", False):
+            return await run()
+        result, shared = await self._single_flight.ado(self._coalesce_key(agent, user_input, snapshot), run)
+        return {**result, "coalesced": True} if shared else result
+    
+    async def _arun_agent(
+        self,
+        agent: BaseAgent,
+        agent_name: str,
+        user_input: str,
+        callbacks: List = None,
+        snapshot: ConfigSnapshot = None
+    ) -> Dict[str, Any]:
+        """异步执行一次Agent调用（应用增强策略）并转换为接口结果"""
+        snapshot = snapshot or config_store.current()
+        started = time.perf_counter()
+        try:
+            # 日志由后台写入器落盘，创建LLMLogger不做文件I/O，可直接在事件循环上执行
+            callbacks = self._ensure_logger(callbacks, snapshot, agent)
             
-            # 确保输出是字符串
-            if not isinstance(output, str):
-                output = str(output)
+            input_data = {"input": user_input}
+            result = await strategy_manager.aapply_strategies(
+                agent=agent,
+                input_data=input_data,
+                snapshot=snapshot,
+                config={"callbacks": callbacks}
+            )
+            self._record_request(agent, "invoke", started)
+            self._finish_logging(callbacks, started)
             
-            return {
-                "success": True,
-                "output": output,
-                "agent_name": agent_name or config.DEFAULT_CONFIG.get("default_agent", "joke"),
-                "model_type": config.DEFAULT_CONFIG.get("model_type", "ollama")
-            }
+            return self._success_result(result, agent_name, snapshot, agent.model_type)
         except Exception as e:
-            error_msg = str(e)
-            error_str = str(e)
+            self._record_request(agent, "invoke", started, e)
+            self._finish_logging(callbacks, started, e)
+            return self._error_result(e)
+    
+    async def astream_agent(
+        self,
+        agent_name: str = None,
+        user_input: str = "",
+        callbacks: List = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """异步流式调用Agent，事件格式与stream_agent相同"""
+        snapshot = config_store.current()
+        resolved_agent = agent_name or snapshot.default_agent
+        agent = None
+        started = time.perf_counter()
+        try:
+            agent, callbacks = await asyncio.to_thread(self._prepare_run, agent_name, callbacks, snapshot)
             
-            # 提供更友好的错误信息
-            if "402" in error_str or "Insufficient Balance" in error_str or "余额不足" in error_str:
-                error_msg = "💰 账户余额不足，请充值后重试。"
-            elif "401" in error_str or "Unauthorized" in error_str or "Invalid API key" in error_str:
-                error_msg = "🔑 API Key无效或已过期，请检查API Key是否正确。"
-            elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-                error_msg = "⏱️ 请求超时，请检查网络连接。如果使用Gemini，可能需要VPN。"
-            elif "API key" in error_msg or "api_key" in error_msg.lower():
-                error_msg = f"🔑 API Key错误: {error_msg}"
-            elif "connection" in error_msg.lower() or "network" in error_msg.lower():
-                error_msg = "🌐 网络连接失败，请检查网络或VPN设置。"
-            elif "rate limit" in error_msg.lower() or "429" in error_str:
-                error_msg = "🚦 请求频率过高，请稍后再试。"
-            elif "model" in error_msg.lower() and ("not found" in error_msg.lower() or "invalid" in error_msg.lower()):
-                error_msg = f"❌ 模型不存在或无效: {error_msg}"
+            yield {"type": "start", "agent_name": resolved_agent, "model_type": agent.model_type or snapshot.model_type}
             
-            return {
+            input_data = {"input": user_input}
+            run_config = {"callbacks": callbacks}
+            if strategy_manager.has_active_strategies(snapshot):
+                result = await strategy_manager.aapply_strategies(
+                    agent=agent,
+                    input_data=input_data,
+                    snapshot=snapshot,
+                    config=run_config
+                )
+                yield {"type": "final", "output": self._result_to_output(result)}
+            else:
+                async for event in agent.astream(input_data, config=run_config):
+                    yield event
+            self._record_request(agent, "stream", started)
+            self._finish_logging(callbacks, started)
+        except Exception as e:
+            if agent is not None:
+                self._record_request(agent, "stream", started, e)
+            self._finish_logging(callbacks, started, e)
+            error_msg = self._format_error(e)
+            yield {"type": "error", "error": error_msg, "output": f"错误: {error_msg}"}
+    
+    def batch_invoke(
+        self,
+        items: List[Dict[str, Any]],
+        agent_name: str = None,
+        max_concurrency: int = None,
+        callbacks: List = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量调用Agent
+        
+        按Agent分组，每组复用缓存中的Agent实例，通过执行器的batch在
+        max_concurrency限制下并发执行；结果按输入顺序返回，单项失败不影响其他项。
+        
+        Args:
+            items: 输入列表，每项为 {"input": str, "agent_name": 可选}
+            agent_name: 未单独指定agent_name的条目使用的Agent
+            max_concurrency: 最大并发数（不超过配置中的上限）
+            callbacks: 回调列表（所有条目共享）
+        """
+        snapshot = config_store.current()
+        items, results, groups, concurrency = self._plan_batch(items, agent_name, max_concurrency, snapshot)
+        if not groups:
+            return results
+        callbacks = self._ensure_logger(callbacks, snapshot)
+        
+        for group_agent, indices in groups.items():
+            try:
+                agent = self.get_agent(agent_name=group_agent, snapshot=snapshot)
+            except Exception as e:
+                self._fill_batch_errors(results, indices, group_agent, e)
+                continue
+            
+            inputs = [{"input": items[i]["input"]} for i in indices]
+            run_config = {"callbacks": callbacks}
+            if strategy_manager.has_active_strategies(snapshot):
+                # 增强策略需要逐条应用，仍由Runnable.batch控制并发
+                runner = RunnableLambda(
+                    lambda data, _agent=agent: strategy_manager.apply_strategies(
+                        agent=_agent, input_data=data, snapshot=snapshot, config=run_config
+                    )
+                )
+                outputs = runner.batch(inputs, config={"max_concurrency": concurrency}, return_exceptions=True)
+            else:
+                outputs = agent.batch(inputs, max_concurrency=concurrency, config=run_config)
+            self._fill_batch_results(results, indices, group_agent, outputs)
+            self._count_batch(agent, outputs)
+        
+        self._finish_logging(callbacks)
+        return results
+    
+    async def abatch_invoke(
+        self,
+        items: List[Dict[str, Any]],
+        agent_name: str = None,
+        max_concurrency: int = None,
+        callbacks: List = None
+    ) -> List[Dict[str, Any]]:
+        """异步批量调用Agent，参数和返回值与batch_invoke相同"""
+        snapshot = config_store.current()
+        items, results, groups, concurrency = self._plan_batch(items, agent_name, max_concurrency, snapshot)
+        if not groups:
+            return results
+        callbacks = self._ensure_logger(callbacks, snapshot)
+        
+        for group_agent, indices in groups.items():
+            try:
+                agent = await asyncio.to_thread(self.get_agent, group_agent, None, snapshot)
+            except Exception as e:
+                self._fill_batch_errors(results, indices, group_agent, e)
+                continue
+            
+            inputs = [{"input": items[i]["input"]} for i in indices]
+            run_config = {"callbacks": callbacks}
+            if strategy_manager.has_active_strategies(snapshot):
+                async def run_with_strategies(data, _agent=agent):
+                    return await strategy_manager.aapply_strategies(
+                        agent=_agent, input_data=data, snapshot=snapshot, config=run_config
+                    )
+                outputs = await RunnableLambda(run_with_strategies).abatch(
+                    inputs, config={"max_concurrency": concurrency}, return_exceptions=True
+                )
+            else:
+                outputs = await agent.abatch(inputs, max_concurrency=concurrency, config=run_config)
+            self._fill_batch_results(results, indices, group_agent, outputs)
+            self._count_batch(agent, outputs)
+        
+        self._finish_logging(callbacks)
+        return results
+    
+    def _plan_batch(
+        self,
+        items: List[Dict[str, Any]],
+        agent_name: str = None,
+        max_concurrency: int = None,
+        snapshot: ConfigSnapshot = None
+    ):
+        """
+        校验批量输入并按Agent分组
+        
+        Returns:
+            (规范化后的条目列表, 按输入顺序的结果占位列表, {agent_name: [条目下标]}, 实际并发数)
+        """
+        snapshot = snapshot or config_store.current()
+        batch_config = snapshot.section("batch")
+        max_items = batch_config.get("max_items", 200)
+        if len(items) > max_items:
+            raise ValueError(f"批量条目过多: {len(items)}，单次最多 {max_items} 条")
+        
+        limit = batch_config.get("max_concurrency", 4)
+        concurrency = min(max_concurrency, limit) if max_concurrency else limit
+        default_agent = agent_name or snapshot.default_agent
+        
+        # 允许直接传字符串作为输入
+        items = [{"input": item} if isinstance(item, str) else item for item in items]
+        results: List[Dict[str, Any]] = [None] * len(items)
+        groups: Dict[str, List[int]] = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not isinstance(item.get("input"), str):
+                results[index] = {
+                    "index": index,
+                    "success": False,
+                    "output": "错误: 缺少input字段",
+                    "error": "缺少input字段"
+                }
+                continue
+            groups.setdefault(item.get("agent_name") or default_agent, []).append(index)
+        return items, results, groups, max(1, concurrency)
+    
+    def _fill_batch_results(
+        self,
+        results: List[Dict[str, Any]],
+        indices: List[int],
+        agent_name: str,
+        outputs: List[Any]
+    ) -> None:
+        """将一组批量执行结果按原始下标写回"""
+        for index, output in zip(indices, outputs):
+            if isinstance(output, Exception):
+                self._fill_batch_errors(results, [index], agent_name, output)
+            else:
+                results[index] = {
+                    "index": index,
+                    "success": True,
+                    "output": self._result_to_output(output),
+                    "agent_name": agent_name
+                }
+    
+    def _count_batch(self, agent: BaseAgent, outputs: List[Any]) -> None:
+        """批量调用按条目计数（条目并发执行，没有单独的耗时）"""
+        labels = {"agent": agent.name, "model": agent.model_type, "mode": "batch"}
+        for output in outputs:
+            agent_requests.inc(status="error" if isinstance(output, Exception) else "success", **labels)
+    
+    def _fill_batch_errors(self, results: List[Dict[str, Any]], indices: List[int], agent_name: str, error: Exception) -> None:
+        """将错误写入对应下标的结果"""
+        error_msg = self._format_error(error)
+        for index in indices:
+            results[index] = {
+                "index": index,
                 "success": False,
                 "output": f"错误: {error_msg}",
-                "error": error_msg
+                "error": error_msg,
+                "agent_name": agent_name
             }
     
+    def _prepare_run(self, agent_name: str = None, callbacks: List = None, snapshot: ConfigSnapshot = None):
+        """
+        获取Agent并准备callbacks
+        
+        创建Agent（含Provider校验）是阻塞操作，
+        异步路径通过asyncio.to_thread调用本方法。
+        """
+        agent = self.get_agent(agent_name=agent_name, snapshot=snapshot)
+        return agent, self._ensure_logger(callbacks, snapshot, agent)
+    
+    def _ensure_logger(self, callbacks: List = None, snapshot: ConfigSnapshot = None, agent: BaseAgent = None) -> List:
+        """
+        确保callbacks中包含LLMLogger、提示词缓存统计、运行指标、链路追踪和运行记录
+        
+        agent不为None时使用其default_config中的log_tier作为日志级别（批量调用多个Agent共享日志记录器，使用全局配置）。
+        """
+        tier = agent.config.get("log_tier") if agent is not None else None
+        if callbacks is None:
+            return [LLMLogger(snapshot, tier), PromptCacheTracker(), metrics_callback, tracing_callback, trace_callback]
+        if not any(isinstance(cb, LLMLogger) for cb in callbacks):
+            callbacks.append(LLMLogger(snapshot, tier))
+        if not any(isinstance(cb, PromptCacheTracker) for cb in callbacks):
+            callbacks.append(PromptCacheTracker())
+        if metrics_callback not in callbacks:
+            callbacks.append(metrics_callback)
+        if tracing_callback not in callbacks:
+            callbacks.append(tracing_callback)
+        if trace_callback not in callbacks:
+            callbacks.append(trace_callback)
+        return callbacks
+    
+    def _finish_logging(self, callbacks: List = None, started: float = None, error: Exception = None) -> None:
+        """请求结束时通知LLMLogger（出错或过慢的请求补记完整日志）"""
+        duration = time.perf_counter() - started if started is not None else None
+        for cb in callbacks or []:
+            if isinstance(cb, LLMLogger):
+                cb.finish(duration, error)
+    
+    def _response_cache_key(self, agent: BaseAgent, user_input: str, snapshot: ConfigSnapshot):
+        """
+        计算响应缓存key；缓存未启用或Agent选择不缓存时返回None
+        
+        Agent可在default_config中设置 cache_enabled=False 关闭缓存，或用 cache_ttl 指定TTL。
+        """
+        if not response_cache.is_enabled() or not agent.config.get("cache_enabled", True):
+            return None
+        model_type = agent.model_type or snapshot.model_type
+        return ResponseCache.make_key(
+            agent_name=agent.name,
+            model_type=model_type,
+            model_config=snapshot.section(model_type),
+            agent_version=agent.get_version(),
+            user_input=normalize_input(user_input),
+            # 增强策略（如反思）会改变输出，启用与否需要区分缓存
+            extra={"strategies": strategy_manager.has_active_strategies(snapshot)}
+        )
+    
+    def _store_response(self, cache_key, agent: BaseAgent, result: Dict[str, Any]) -> None:
+        """只缓存成功的结果"""
+        if cache_key is None or not result.get("success"):
+            return
+        response_cache.set(cache_key, agent.name, result, ttl=agent.config.get("cache_ttl"))
+    
+    def _coalesce_key(self, agent: BaseAgent, user_input: str, snapshot: ConfigSnapshot) -> str:
+        """请求合并的key：Agent名称 + 模型类型 + 模型配置哈希 + 规范化输入"""
+        model_type = agent.model_type or snapshot.model_type
+        config_hash = hashlib.sha256(
+            json.dumps(snapshot.to_dict(model_type), sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:16]
+        return f"{agent.name}:{model_type}:{config_hash}:{normalize_input(user_input)}"
+    
+    def _success_result(
+        self,
+        result: Any,
+        agent_name: str = None,
+        snapshot: ConfigSnapshot = None,
+        model_type: str = None
+    ) -> Dict[str, Any]:
+        """构造调用成功的接口结果（model_type为实际使用的模型类型，熔断切换后与配置不同）"""
+        snapshot = snapshot or config_store.current()
+        return {
+            "success": True,
+            "output": self._result_to_output(result),
+            "agent_name": agent_name or snapshot.default_agent,
+            "model_type": model_type or snapshot.model_type
+        }
+    
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        """构造调用失败的接口结果"""
+        error_msg = self._format_error(e)
+        return {
+            "success": False,
+            "output": f"错误: {error_msg}",
+            "error": error_msg
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取服务运行统计信息"""
+        return {
+            "coalescing": self._single_flight.stats(),
+            "response_cache": response_cache.stats(),
+            "scheduler": provider_scheduler.stats(),
+            "provider_health": provider_health.stats(),
+            "hedging": request_hedging.stats(),
+            "http_pools": http_pools.stats(),
+            "prompt_cache": prompt_cache_stats.stats(),
+            "tracing": tracer.stats(),
+            "log_writer": log_writer.stats(),
+            "trace_store": trace_store.stats(),
+            "cassette": cassette_store.get_stats(),
+            "agent_cache": self._agents.stats()
+        }
+    
+    def _collect_cache_metrics(self):
+        """/metrics抓取时读取响应缓存、Agent实例缓存和提示词缓存的命中情况"""
+        cache_stats = response_cache.stats()
+        agents = cache_stats.get("agents", {})
+        yield ("response_cache_hits_total", "counter", "响应缓存命中次数",
+               [({"agent": name}, stats["hits"]) for name, stats in agents.items()])
+        yield ("response_cache_misses_total", "counter", "响应缓存未命中次数",
+               [({"agent": name}, stats["misses"]) for name, stats in agents.items()])
+        yield ("response_cache_hit_ratio", "gauge", "响应缓存命中率",
+               [({"agent": name}, stats["hit_rate"]) for name, stats in agents.items()])
+        
+        agent_cache_stats = self._agents.stats()
+        yield ("agent_cache_hit_ratio", "gauge", "Agent实例缓存命中率", [({}, agent_cache_stats["hit_rate"])])
+        yield ("agent_cache_entries", "gauge", "缓存的Agent实例数", [({}, agent_cache_stats["size"])])
+        
+        prompt_stats = prompt_cache_stats.stats()
+        yield ("llm_prompt_cached_tokens_total", "counter", "命中Provider提示词缓存的输入Token数",
+               [({"model": name}, stats["cached_tokens"]) for name, stats in prompt_stats.items()])
+        yield ("llm_prompt_cache_hit_ratio", "gauge", "提示词缓存命中率（只统计返回缓存字段的模型）",
+               [({"model": name}, stats["hit_ratio"]) for name, stats in prompt_stats.items()
+                if stats["hit_ratio"] is not None])
+    
+    def get_agent_cache_stats(self) -> Dict[str, Any]:
+        """获取Agent实例缓存统计信息"""
+        return self._agents.stats()
+    
+    def clear_agent_cache(self) -> int:
+        """清空Agent实例缓存，返回清除的实例数"""
+        return self._agents.clear()
+    
+    def _result_to_output(self, result: Any) -> str:
+        """将Agent/策略的执行结果转换为输出字符串"""
+        if isinstance(result, dict):
+            output = result.get("output", result if isinstance(result, str) else str(result))
+        else:
+            output = str(result)
+        
+        # 确保输出是字符串
+        if not isinstance(output, str):
+            output = str(output)
+        return output
+    
+    def _format_error(self, e: Exception) -> str:
+        """将异常转换为更友好的错误信息"""
+        error_msg = str(e)
+        error_str = str(e)
+        
+        if isinstance(e, SchedulerTimeoutError):
+            error_msg = "🚦 模型服务繁忙，排队等待超时，请稍后再试。"
+        elif isinstance(e, ProviderUnavailableError):
+            error_msg = f"🔌 {e.model_type} 服务暂时不可用，约{int(e.retry_after)}秒后重试。"
+        elif "402" in error_str or "Insufficient Balance" in error_str or "余额不足" in error_str:
+            error_msg = "💰 账户余额不足，请充值后重试。"
+        elif "401" in error_str or "Unauthorized" in error_str or "Invalid API key" in error_str:
+            error_msg = "🔑 API Key无效或已过期，请检查API Key是否正确。"
+        elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
+            error_msg = "⏱️ 请求超时，请检查网络连接。如果使用Gemini，可能需要VPN。"
+        elif "API key" in error_msg or "api_key" in error_msg.lower():
+            error_msg = f"🔑 API Key错误: {error_msg}"
+        elif "connection" in error_msg.lower() or "network" in error_msg.lower():
+            error_msg = "🌐 网络连接失败，请检查网络或VPN设置。"
+        elif "rate limit" in error_msg.lower() or "429" in error_str:
+            error_msg = "🚦 请求频率过高，请稍后再试。"
+        elif "model" in error_msg.lower() and ("not found" in error_msg.lower() or "invalid" in error_msg.lower()):
+            error_msg = f"❌ 模型不存在或无效: {error_msg}"
+        return error_msg
+    
     def update_config(self, config_data: Dict[str, Any]) -> Dict[str, Any]:
-        """更新配置"""
+        """
+        更新配置
+        
+        基于当前快照构造新快照并原子替换，进行中的请求继续使用各自的旧快照；
+        已缓存的Agent在下次获取时按依赖配置节的版本号判断是否需要重建。
+        """
         try:
             model_type = config_data.get("model_type")
             agent_name = config_data.get("agent_name")
@@ -121,59 +751,47 @@ class AgentService:
             if agent_name and agent_name not in AgentFactory.get_available_agents():
                 return {"success": False, "error": f"不支持的Agent类型: {agent_name}"}
             
-            # 更新配置
+            current = config_store.current()
+            updates: Dict[str, Any] = {}
             if model_type:
-                config.DEFAULT_CONFIG["model_type"] = model_type
+                updates["model_type"] = model_type
             if agent_name:
-                config.DEFAULT_CONFIG["default_agent"] = agent_name
+                updates["default_agent"] = agent_name
             
             # 更新模型特定配置
             # 如果指定了model_type，更新对应模型的配置
-            if model_type == "ollama":
-                if "model" in config_data:
-                    config.DEFAULT_CONFIG["ollama"]["model"] = config_data["model"]
-                if "base_url" in config_data:
-                    config.DEFAULT_CONFIG["ollama"]["base_url"] = config_data["base_url"]
-            elif model_type == "gemini":
-                if "api_key" in config_data:
-                    config.DEFAULT_CONFIG["gemini"]["api_key"] = config_data["api_key"]
-                if "model" in config_data:
-                    config.DEFAULT_CONFIG["gemini"]["model"] = config_data["model"]
-            elif model_type == "deepseek":
-                if "api_key" in config_data:
-                    config.DEFAULT_CONFIG["deepseek"]["api_key"] = config_data["api_key"]
-                if "model" in config_data:
-                    config.DEFAULT_CONFIG["deepseek"]["model"] = config_data["model"]
-                if "base_url" in config_data:
-                    config.DEFAULT_CONFIG["deepseek"]["base_url"] = config_data["base_url"]
+            if model_type in self._UPDATABLE_MODEL_FIELDS:
+                fields = {
+                    key: config_data[key]
+                    for key in self._UPDATABLE_MODEL_FIELDS[model_type] if key in config_data
+                }
+                if fields:
+                    updates[model_type] = fields
             # 如果没有指定model_type，但提供了api_key，说明用户只想更新api_key
             elif not model_type and "api_key" in config_data:
                 # 如果当前模型类型是需要API key的模型，更新api_key
-                current_model_type = config.DEFAULT_CONFIG.get("model_type", "ollama")
-                if current_model_type == "gemini":
-                    config.DEFAULT_CONFIG["gemini"]["api_key"] = config_data["api_key"]
-                elif current_model_type == "deepseek":
-                    config.DEFAULT_CONFIG["deepseek"]["api_key"] = config_data["api_key"]
-                else:
+                target = current.model_type
+                if target not in ("gemini", "deepseek"):
                     # 如果当前不是需要API key的模型，也保存api_key（可能是为后续切换准备）
                     # 尝试保存到deepseek（优先）或gemini
-                    if "deepseek" in config.DEFAULT_CONFIG:
-                        config.DEFAULT_CONFIG["deepseek"]["api_key"] = config_data["api_key"]
-                    elif "gemini" in config.DEFAULT_CONFIG:
-                        config.DEFAULT_CONFIG["gemini"]["api_key"] = config_data["api_key"]
+                    target = "deepseek" if "deepseek" in current else "gemini" if "gemini" in current else None
+                if target:
+                    updates[target] = {"api_key": config_data["api_key"]}
             
-            # 清除相关缓存（切换模型类型时，清除所有缓存以确保使用新配置）
-            if model_type:
-                # 如果切换了模型类型，清除所有缓存，避免使用旧的缓存
-                self._agents.clear()
-            else:
-                # 如果没有切换模型类型，只清除相关缓存
-                self._clear_agent_cache(model_type, agent_name)
+            snapshot = config_store.update(updates)
+            # 模型配置（如base_url、api_key）变化后，之前的健康状态不再有效
+            for section in updates:
+                if section in self._UPDATABLE_MODEL_FIELDS and snapshot.section_version(section) == snapshot.version:
+                    provider_health.reset(section)
+            # 切换了模型类型或当前模型的配置，预热新模型
+            if snapshot.section_version("model_type") == snapshot.version or \
+                    snapshot.section_version(snapshot.model_type) == snapshot.version:
+                self.warm_up(snapshot)
             
             # 验证配置（只有在提供了model_type且配置完整时才验证）
             if model_type:
                 # 检查配置是否完整
-                model_config = config.DEFAULT_CONFIG.get(model_type, {})
+                model_config = snapshot.to_dict(model_type)
                 if model_type in ["gemini", "deepseek"]:
                     # 对于需要API key的模型，如果API key为空，允许切换但不验证
                     api_key = model_config.get("api_key") or config_data.get("api_key")
@@ -183,7 +801,7 @@ class AgentService:
                             "success": True,
                             "message": "模型类型已切换，请输入API Key",
                             "model_type": model_type,
-                            "agent_name": agent_name or config.DEFAULT_CONFIG.get("default_agent", "joke"),
+                            "agent_name": agent_name or snapshot.default_agent,
                             "current_model_config": model_config,
                             "warning": "API Key未设置，请先输入API Key"
                         }
@@ -191,7 +809,7 @@ class AgentService:
                 # 配置完整，尝试验证
                 try:
                     # 明确传入model_type，确保使用正确的模型类型
-                    self.get_agent(agent_name=agent_name, model_type=model_type)
+                    self.get_agent(agent_name=agent_name, model_type=model_type, snapshot=snapshot)
                 except Exception as e:
                     # 如果验证失败，返回错误但不阻止配置保存
                     error_msg = str(e)
@@ -208,7 +826,7 @@ class AgentService:
                             "success": True,
                             "message": "模型类型已切换，但配置验证失败",
                             "model_type": model_type,
-                            "agent_name": agent_name or config.DEFAULT_CONFIG.get("default_agent", "joke"),
+                            "agent_name": agent_name or snapshot.default_agent,
                             "current_model_config": model_config,
                             "warning": f"请检查配置: {error_msg}"
                         }
@@ -221,11 +839,10 @@ class AgentService:
             return {
                 "success": True,
                 "message": "配置已更新",
-                "model_type": model_type or config.DEFAULT_CONFIG.get("model_type"),
-                "agent_name": agent_name or config.DEFAULT_CONFIG.get("default_agent", "joke"),
-                "current_model_config": config.DEFAULT_CONFIG.get(
-                    model_type or config.DEFAULT_CONFIG.get("model_type"), {}
-                )
+                "model_type": snapshot.model_type,
+                "agent_name": agent_name or snapshot.default_agent,
+                "current_model_config": snapshot.to_dict(snapshot.model_type),
+                "config_version": snapshot.version
             }
         except Exception as e:
             error_msg = str(e)
@@ -236,46 +853,16 @@ class AgentService:
                 error_msg = f"模型不存在: {error_msg}。请检查模型名称是否正确。"
             return {"success": False, "error": error_msg}
     
-    def _clear_agent_cache(self, model_type: str = None, agent_name: str = None):
-        """清除Agent缓存"""
-        if not (model_type or agent_name):
-            self._agents.clear()
-            return
-        
-        # 缓存键格式: "{agent_name}:{model_type}"
-        keys_to_remove = []
-        for key in self._agents.keys():
-            should_remove = False
-            if agent_name and model_type:
-                # 如果同时指定了agent_name和model_type，精确匹配
-                if key == f"{agent_name}:{model_type}":
-                    should_remove = True
-            elif agent_name:
-                # 如果只指定了agent_name，清除所有该agent的缓存
-                if key.startswith(f"{agent_name}:"):
-                    should_remove = True
-            elif model_type:
-                # 如果只指定了model_type，清除所有该模型类型的缓存
-                if key.endswith(f":{model_type}"):
-                    should_remove = True
-            
-            if should_remove:
-                keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del self._agents[key]
-    
     def get_config(self) -> Dict[str, Any]:
         """获取当前配置"""
+        snapshot = config_store.current()
         return {
-            "model_type": config.DEFAULT_CONFIG.get("model_type", "ollama"),
-            "default_agent": config.DEFAULT_CONFIG.get("default_agent", "joke"),
+            "model_type": snapshot.model_type,
+            "default_agent": snapshot.default_agent,
             "available_models": AgentFactory.get_available_models(),
             "available_agents": AgentFactory.get_available_agents(),
-            "current_model_config": config.DEFAULT_CONFIG.get(
-                config.DEFAULT_CONFIG.get("model_type", "ollama"), {}
-            )
+            "current_model_config": snapshot.to_dict(snapshot.model_type),
+            "config_version": snapshot.version
         }
 
-
 agent_service = AgentService()
@@ -0,0 +1,531 @@
+"""
+录制/回放 - 把模型请求、响应和工具调用录制到录像文件（cassette），离线时按请求回放
+
+录制：配置 cassette.mode = "record" 后，AgentFactory创建的ChatModel和工具都会被包装，
+每次模型调用和工具调用结束后追加一行JSON到cassette.path：
+
+    {"kind": "llm" | "tool", "key": 请求哈希, "request": 归一化的请求, "response": 响应,
+     "duration_ms": 耗时, "first_token_ms": 流式首个token耗时, "ts": 录制时间}
+
+回放：把 model_type 设为 "replay"（providers.replay_provider），模型按请求哈希返回录制的响应，
+工具按工具名和参数返回录制的输出，可按录制耗时或固定耗时等待，不访问任何模型服务。
+
+请求哈希只包含对话内容：消息角色、文本（空白归一化）、工具调用的名称和参数、绑定的工具名和stop，
+不包含消息id、tool_call_id、模型名和temperature等，换一个模型录制的录像也能回放。
+同一个请求录制了多次时按录制顺序依次返回，用完后从头循环。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessageChunk, BaseMessage, message_chunk_to_message, messages_from_dict, messages_to_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool, ToolException
+from core.config_snapshot import config_store
+from core.delegating_chat_model import DelegatingChatModel
+
+
+class CassetteMissError(LookupError):
+    """录像中没有与请求匹配的记录"""
+    pass
+
+
+def _normalize_text(content: Any) -> str:
+    """消息内容归一化：分段列表转为JSON，连续空白合并为一个空格"""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, sort_keys=True, default=str)
+    return " ".join(content.split())
+
+
+def _tool_names(tools: Any) -> List[str]:
+    """从bind_tools绑定的参数中取出工具名（兼容OpenAI/Ollama格式、Gemini的function_declarations和工具对象）"""
+    names = []
+    for tool in tools or []:
+        if isinstance(tool, dict):
+            declarations = tool.get("function_declarations")
+            if declarations:
+                names.extend(_tool_names(declarations))
+            else:
+                names.append((tool.get("function") or tool).get("name"))
+        elif getattr(tool, "function_declarations", None):
+            names.extend(_tool_names(tool.function_declarations))
+        else:
+            names.append(getattr(tool, "name", None) or str(tool))
+    return sorted(str(name) for name in names)
+
+
+def normalize_llm_request(messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                          **kwargs: Any) -> Dict[str, Any]:
+    """把一次模型请求归一化为只包含对话内容的字典"""
+    entries = []
+    for message in messages:
+        entry = {"role": message.type, "content": _normalize_text(message.content)}
+        tool_calls = getattr(message, "tool_calls", None)
+        if tool_calls:
+            entry["tool_calls"] = [{"name": call.get("name"), "args": call.get("args")} for call in tool_calls]
+        if message.type == "tool" and getattr(message, "name", None):
+            entry["name"] = message.name
+        entries.append(entry)
+    request = {"messages": entries}
+    if kwargs.get("tools"):
+        request["tools"] = _tool_names(kwargs["tools"])
+    if stop:
+        request["stop"] = list(stop)
+    return request
+
+
+def normalize_tool_request(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """把一次工具调用归一化为工具名和参数"""
+    return {"tool": name, "args": args}
+
+
+def request_key(kind: str, request: Dict[str, Any]) -> str:
+    """计算请求哈希"""
+    payload = json.dumps([kind, request], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class Cassette:
+    """
+    录像文件（JSONL，每次调用一行）
+    
+    录制时追加写入文件，同时加入内存索引；回放时按请求哈希查找，同一请求的多条记录按顺序循环返回。
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._mtime: Optional[float] = None
+        self.reload()
+    
+    def reload(self) -> None:
+        """从文件重新加载录像（文件不存在时为空录像），回放顺序从头开始"""
+        entries: Dict[str, List[Dict[str, Any]]] = {}
+        mtime = None
+        if os.path.exists(self.path):
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        entries.setdefault(entry["key"], []).append(entry)
+        with self._lock:
+            self._entries = entries
+            self._cursors = {}
+            self._mtime = mtime
+    
+    def reload_if_changed(self) -> None:
+        """文件在加载后被修改过（如重新录制）时重新加载"""
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime != self._mtime:
+            self.reload()
+    
+    def record(self, kind: str, request: Dict[str, Any], response: Any, duration_ms: float,
+               **extra: Any) -> str:
+        """录制一次调用，返回请求哈希"""
+        key = request_key(kind, request)
+        entry = {
+            "kind": kind,
+            "key": key,
+            "request": request,
+            "response": response,
+            "duration_ms": round(duration_ms, 1),
+        }
+        entry.update((name, value) for name, value in extra.items() if value is not None)
+        entry["ts"] = datetime.now().isoformat(timespec="milliseconds")
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._mtime = os.path.getmtime(self.path)
+            self._entries.setdefault(key, []).append(entry)
+        return key
+    
+    def lookup(self, kind: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """查找请求对应的下一条记录（没有时返回None）"""
+        key = request_key(kind, request)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+            return entries[index % len(entries)]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {"llm": 0, "tool": 0}
+            for entries in self._entries.values():
+                for entry in entries:
+                    counts[entry["kind"]] = counts.get(entry["kind"], 0) + 1
+            return {"path": self.path, "keys": len(self._entries), **counts}
+
+
+def _describe_miss(request: Dict[str, Any]) -> str:
+    if "tool" in request:
+        return f"工具 {request['tool']}，参数 {json.dumps(request['args'], ensure_ascii=False, default=str)}"
+    messages = request.get("messages") or [{}]
+    last = messages[-1]
+    return f"{len(messages)} 条消息，最后一条[{last.get('role')}]: {last.get('content', '')[:80]}"
+
+
+class RecordingChatModel(DelegatingChatModel):
+    """录制模式的ChatModel，把每次请求和完整响应写入录像"""
+    
+    cassette: Any
+    
+    def _record(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any],
+                message: BaseMessage, started: float, first_token: Optional[float] = None) -> None:
+        ended = time.perf_counter()
+        self.cassette.record(
+            "llm",
+            normalize_llm_request(messages, stop, **kwargs),
+            messages_to_dict([message])[0],
+            (ended - started) * 1000,
+            first_token_ms=round((first_token - started) * 1000, 1) if first_token is not None else None,
+        )
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        started = time.perf_counter()
+        result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._record(messages, stop, kwargs, result.generations[0].message, started)
+        return result
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        started = time.perf_counter()
+        result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._record(messages, stop, kwargs, result.generations[0].message, started)
+        return result
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        # 只录制完整结束的流（调用方提前停止时响应不完整，不录制）
+        started = time.perf_counter()
+        first_token = None
+        merged = None
+        for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            if first_token is None:
+                first_token = time.perf_counter()
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            self._record(messages, stop, kwargs, message_chunk_to_message(merged.message), started, first_token)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        started = time.perf_counter()
+        first_token = None
+        merged = None
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            if first_token is None:
+                first_token = time.perf_counter()
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            self._record(messages, stop, kwargs, message_chunk_to_message(merged.message), started, first_token)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    回放录像的ChatModel
+    
+    latency: "recorded"按录制耗时等待，"fixed"每次等待fixed_latency_ms，"none"不等待。
+    流式调用时先等待首个token的耗时，再把文本按stream_chunk_chars切块，剩余耗时平均分配到各块之间。
+    """
+    
+    cassette: Any
+    model_name: str = "replay"
+    latency: str = "recorded"
+    fixed_latency_ms: float = 0
+    stream_chunk_chars: int = 4
+    
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+    
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        # 不可序列化，回调中的模型名称取自invocation_params（即这里的model_name）
+        return {"model_name": self.model_name, "cassette": self.cassette.path, "latency": self.latency}
+    
+    def bind_tools(self, tools, **kwargs: Any):
+        """按OpenAI格式绑定工具（请求哈希只使用工具名，与录制时的Provider格式无关）"""
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+    
+    def _lookup(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]):
+        """返回 (录制的响应消息, 首个token前等待秒数, 总等待秒数)"""
+        request = normalize_llm_request(messages, stop, **kwargs)
+        entry = self.cassette.lookup("llm", request)
+        if entry is None:
+            raise CassetteMissError(f"录像 {self.cassette.path} 中没有匹配的模型请求（{_describe_miss(request)}）")
+        message = messages_from_dict([entry["response"]])[0]
+        if self.latency == "recorded":
+            total = entry.get("duration_ms", 0) / 1000
+            first = entry.get("first_token_ms", entry.get("duration_ms", 0)) / 1000
+        elif self.latency == "fixed":
+            total = first = self.fixed_latency_ms / 1000
+        else:
+            total = first = 0.0
+        return message, first, total
+    
+    def _split(self, message: BaseMessage) -> List[AIMessageChunk]:
+        """把响应切成流式块（工具调用、用量等放在最后一块）"""
+        content = message.content
+        if isinstance(content, str) and content:
+            size = max(1, self.stream_chunk_chars)
+            pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        else:
+            pieces = [content] if content else []
+        chunks = [AIMessageChunk(content=piece, id=message.id) for piece in pieces]
+        chunks.append(AIMessageChunk(
+            content="" if isinstance(content, str) else [],
+            additional_kwargs=message.additional_kwargs,
+            response_metadata=getattr(message, "response_metadata", {}),
+            tool_calls=getattr(message, "tool_calls", []),
+            usage_metadata=getattr(message, "usage_metadata", None),
+            id=message.id,
+        ))
+        return chunks
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message, _, total = self._lookup(messages, stop, kwargs)
+        if total > 0:
+            time.sleep(total)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message, _, total = self._lookup(messages, stop, kwargs)
+        if total > 0:
+            await asyncio.sleep(total)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        message, first, total = self._lookup(messages, stop, kwargs)
+        chunks = self._split(message)
+        interval = max(0.0, total - first) / len(chunks)
+        if first > 0:
+            time.sleep(first)
+        for index, chunk in enumerate(chunks):
+            if index and interval > 0:
+                time.sleep(interval)
+            yield ChatGenerationChunk(message=chunk)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message, first, total = self._lookup(messages, stop, kwargs)
+        chunks = self._split(message)
+        interval = max(0.0, total - first) / len(chunks)
+        if first > 0:
+            await asyncio.sleep(first)
+        for index, chunk in enumerate(chunks):
+            if index and interval > 0:
+                await asyncio.sleep(interval)
+            yield ChatGenerationChunk(message=chunk)
+
+
+class CassetteTool(BaseTool):
+    """
+    录制或回放工具调用的包装工具（名称、描述和参数结构与原工具相同，Agent版本指纹不变）
+    
+    mode: "record"执行原工具并录制输出，"replay"只返回录制的输出，"fallback"有录制时回放、没有时执行原工具。
+    原工具在没有回调的情况下执行，日志和追踪中只出现一次工具调用。
+    """
+    
+    inner: BaseTool
+    cassette: Any
+    mode: str = "record"
+    latency: str = "recorded"
+    fixed_latency_ms: float = 0
+    
+    @classmethod
+    def wrap(cls, tool: BaseTool, cassette: Cassette, mode: str, **options: Any) -> "CassetteTool":
+        return cls(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            return_direct=tool.return_direct,
+            inner=tool,
+            cassette=cassette,
+            mode=mode,
+            **options
+        )
+    
+    def _replay(self, request: Dict[str, Any]):
+        """返回 (是否命中, 输出, 等待秒数)，录制时出错的调用回放时抛出同样的错误"""
+        if self.mode == "record":
+            return False, None, 0.0
+        entry = self.cassette.lookup("tool", request)
+        if entry is None:
+            if self.mode == "replay":
+                raise CassetteMissError(f"录像 {self.cassette.path} 中没有匹配的工具调用（{_describe_miss(request)}）")
+            return False, None, 0.0
+        if self.latency == "recorded":
+            delay = entry.get("duration_ms", 0) / 1000
+        elif self.latency == "fixed":
+            delay = self.fixed_latency_ms / 1000
+        else:
+            delay = 0.0
+        return True, entry, delay
+    
+    @staticmethod
+    def _result(entry: Dict[str, Any]) -> Any:
+        if entry.get("error") is not None:
+            raise ToolException(entry["error"])
+        return entry["response"]
+    
+    def _record(self, request: Dict[str, Any], started: float, output: Any = None, error: Exception = None):
+        if self.mode != "record":
+            return
+        self.cassette.record(
+            "tool", request, output, (time.perf_counter() - started) * 1000,
+            error=f"{type(error).__name__}: {error}" if error is not None else None,
+        )
+    
+    def _run(self, *args: Any, run_manager: Any = None, **kwargs: Any) -> Any:
+        request = normalize_tool_request(self.name, kwargs)
+        hit, entry, delay = self._replay(request)
+        if hit:
+            if delay > 0:
+                time.sleep(delay)
+            return self._result(entry)
+        started = time.perf_counter()
+        try:
+            output = self.inner.run(kwargs, callbacks=[])
+        except Exception as e:
+            self._record(request, started, error=e)
+            raise
+        self._record(request, started, output)
+        return output
+    
+    async def _arun(self, *args: Any, run_manager: Any = None, **kwargs: Any) -> Any:
+        request = normalize_tool_request(self.name, kwargs)
+        hit, entry, delay = self._replay(request)
+        if hit:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return self._result(entry)
+        started = time.perf_counter()
+        try:
+            output = await self.inner.arun(kwargs, callbacks=[])
+        except Exception as e:
+            self._record(request, started, error=e)
+            raise
+        self._record(request, started, output)
+        return output
+
+
+class CassetteStore:
+    """录像管理器：按路径缓存录像，录制模式下为AgentFactory创建的ChatModel和工具接入录制"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cassettes: Dict[str, Cassette] = {}
+    
+    def _get_config(self) -> Dict[str, Any]:
+        return config_store.current().section("cassette")
+    
+    def get(self, path: str) -> Cassette:
+        """获取录像（同一路径共享一个实例，文件在加载后被修改过时重新加载）"""
+        path = os.path.abspath(path)
+        with self._lock:
+            cassette = self._cassettes.get(path)
+            if cassette is None:
+                cassette = self._cassettes[path] = Cassette(path)
+                return cassette
+        cassette.reload_if_changed()
+        return cassette
+    
+    def _recording_cassette(self) -> Optional[Cassette]:
+        config = self._get_config()
+        if config.get("mode", "off") != "record" or not config.get("path"):
+            return None
+        return self.get(config["path"])
+    
+    def wrap_llm(self, llm):
+        """录制模式下包装ChatModel（回放的ChatModel不再录制）"""
+        cassette = self._recording_cassette()
+        if cassette is None or not isinstance(llm, BaseChatModel) or isinstance(llm, ReplayChatModel):
+            return llm
+        return RecordingChatModel(inner=llm, cassette=cassette)
+    
+    def wrap_tools(self, tools: List[BaseTool]) -> List[BaseTool]:
+        """录制模式下包装工具（已经是回放包装的工具不再录制）"""
+        cassette = self._recording_cassette()
+        if cassette is None:
+            return tools
+        return [tool if isinstance(tool, CassetteTool) else CassetteTool.wrap(tool, cassette, "record")
+                for tool in tools]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        config = self._get_config()
+        with self._lock:
+            cassettes = list(self._cassettes.values())
+        return {
+            "mode": config.get("mode", "off"),
+            "path": config.get("path"),
+            "cassettes": [cassette.stats() for cassette in cassettes],
+        }
+
+
+# 全局录像管理器
+cassette_store = CassetteStore()
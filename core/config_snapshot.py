@@ -0,0 +1,143 @@
+"""
+配置快照 - 不可变、带版本号的运行时配置
+
+请求开始时取一次快照（config_store.current()，无锁），整个请求期间只读这一份；
+修改配置时由config_store.update()基于当前快照构造新快照并原子替换，
+正在执行的请求不受影响。config.DEFAULT_CONFIG只作为初始配置，运行时不再修改。
+"""
+import copy
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Mapping
+import config
+
+_EMPTY = MappingProxyType({})
+
+
+def _freeze(value: Any) -> Any:
+    """递归转换为只读结构（dict -> MappingProxyType，list -> tuple）"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    """_freeze的逆操作，得到可修改、可JSON序列化的普通结构"""
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+def _deep_merge(base: Dict[str, Any], updates: Mapping) -> Dict[str, Any]:
+    """将updates递归合并到base（base为普通dict，会被原地修改）"""
+    for key, value in updates.items():
+        if isinstance(value, Mapping) and isinstance(base.get(key), dict):
+            _deep_merge(base[key], value)
+        else:
+            base[key] = copy.deepcopy(_thaw(value))
+    return base
+
+
+class ConfigSnapshot(Mapping):
+    """
+    不可变配置快照
+    
+    - version: 全局版本号，每次更新递增
+    - section_version(name): 顶层配置节最后一次变化时的版本号，
+      缓存可以只依赖相关配置节的版本，无关配置变化时不失效
+    
+    支持dict风格的只读访问（get/[]/in），可直接作为AgentFactory.create_agent的custom_config。
+    """
+    
+    __slots__ = ("_data", "version", "_section_versions")
+    
+    def __init__(self, data: Mapping, version: int = 1, section_versions: Dict[str, int] = None):
+        self._data = _freeze(data)
+        self.version = version
+        self._section_versions = MappingProxyType(
+            dict(section_versions) if section_versions is not None else {key: version for key in self._data}
+        )
+    
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def section(self, name: str) -> Mapping:
+        """获取配置节（不存在时返回空的只读字典）"""
+        value = self._data.get(name)
+        return value if isinstance(value, Mapping) else _EMPTY
+    
+    def section_version(self, name: str) -> int:
+        """获取配置节的版本号（不存在的配置节为0）"""
+        return self._section_versions.get(name, 0)
+    
+    @property
+    def model_type(self) -> str:
+        return self._data.get("model_type", "ollama")
+    
+    @property
+    def default_agent(self) -> str:
+        return self._data.get("default_agent", "joke")
+    
+    @property
+    def model_config(self) -> Mapping:
+        """当前模型类型的配置节"""
+        return self.section(self.model_type)
+    
+    def to_dict(self, section: str = None) -> Any:
+        """转换为普通dict（用于JSON序列化），指定section时只转换该配置节"""
+        if section is not None:
+            return _thaw(self.section(section))
+        return _thaw(self._data)
+    
+    def with_updates(self, updates: Mapping) -> "ConfigSnapshot":
+        """基于当前快照构造合并了updates的新快照，只有实际变化的配置节更新版本号"""
+        version = self.version + 1
+        data = _deep_merge(self.to_dict(), updates)
+        section_versions = dict(self._section_versions)
+        for key in updates:
+            if _freeze(data.get(key)) != self._data.get(key):
+                section_versions[key] = version
+        return ConfigSnapshot(data, version, section_versions)
+    
+    def __repr__(self) -> str:
+        return f"ConfigSnapshot(version={self.version})"
+
+
+class ConfigStore:
+    """配置快照的持有者：读无锁，写串行化后原子替换"""
+    
+    def __init__(self, initial: Mapping):
+        self._current = ConfigSnapshot(initial)
+        self._write_lock = threading.Lock()
+    
+    def current(self) -> ConfigSnapshot:
+        """获取当前快照（属性读取是原子的，不需要加锁）"""
+        return self._current
+    
+    def update(self, updates: Mapping) -> ConfigSnapshot:
+        """
+        合并更新并原子替换当前快照
+        
+        Args:
+            updates: 嵌套字典，如 {"model_type": "deepseek", "deepseek": {"api_key": "..."}}
+        
+        Returns:
+            新的快照
+        """
+        with self._write_lock:
+            snapshot = self._current.with_updates(updates)
+            self._current = snapshot
+            return snapshot
+
+
+config_store = ConfigStore(config.DEFAULT_CONFIG)
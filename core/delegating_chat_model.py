@@ -0,0 +1,132 @@
+"""
+委托ChatModel基类 - 包装Provider创建的ChatModel，在调用前后插入横切逻辑（调度、对冲等）
+"""
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+
+class DelegatingChatModel(BaseChatModel):
+    """
+    委托ChatModel
+    
+    所有生成请求都转发给inner，子类只需覆盖需要插入逻辑的方法。
+    bind_tools由inner完成工具格式转换，再把绑定参数绑定到包装器自身，
+    保证create_agent绑定工具后的调用仍然经过包装器。
+    """
+    
+    inner: BaseChatModel
+    
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+    
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+    
+    def _combine_llm_outputs(self, llm_outputs: List[Optional[dict]]) -> dict:
+        return self.inner._combine_llm_outputs(llm_outputs)
+    
+    def to_json(self):
+        # 回调中的serialized信息使用inner的，日志里显示的仍是实际模型
+        return self.inner.to_json()
+    
+    def bind_tools(self, tools, **kwargs: Any):
+        """使用inner的工具格式转换，但绑定到包装器自身"""
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+    
+    def _inner_supports_stream(self) -> bool:
+        return type(self.inner)._stream is not BaseChatModel._stream
+    
+    def _inner_supports_astream(self) -> bool:
+        return type(self.inner)._astream is not BaseChatModel._astream
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if not self._inner_supports_stream():
+            # inner不支持流式时，退化为一次性生成
+            result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            for generation in result.generations:
+                yield _to_chunk(generation)
+            return
+        yield from self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if not self._inner_supports_astream():
+            result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            for generation in result.generations:
+                yield _to_chunk(generation)
+            return
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
+
+
+def _to_chunk(generation) -> ChatGenerationChunk:
+    """将完整的ChatGeneration转换为单个ChatGenerationChunk"""
+    from langchain_core.messages import AIMessageChunk
+    
+    message = generation.message
+    return ChatGenerationChunk(
+        message=AIMessageChunk(
+            content=message.content,
+            additional_kwargs=message.additional_kwargs,
+            response_metadata=getattr(message, "response_metadata", {}),
+            tool_calls=getattr(message, "tool_calls", []),
+            usage_metadata=getattr(message, "usage_metadata", None),
+            id=message.id,
+        ),
+        generation_info=generation.generation_info,
+    )
+
+
+def usage_from_result(result: ChatResult) -> Dict[str, int]:
+    """从ChatResult中提取token用量（input_tokens/output_tokens/total_tokens）"""
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    for generation in result.generations:
+        _add_usage(usage, getattr(generation.message, "usage_metadata", None))
+    return usage
+
+
+def add_chunk_usage(usage: Dict[str, int], chunk: ChatGenerationChunk) -> None:
+    """累加流式chunk中的token用量"""
+    _add_usage(usage, getattr(chunk.message, "usage_metadata", None))
+
+
+def _add_usage(usage: Dict[str, int], usage_metadata: Optional[Dict[str, Any]]) -> None:
+    if not usage_metadata:
+        return
+    for key in ("input_tokens", "output_tokens", "total_tokens"):
+        usage[key] += usage_metadata.get(key, 0) or 0
@@ -0,0 +1,172 @@
+"""
+HTTP连接池 - 每个Provider一个进程级共享的连接池
+
+Provider的get_llm每次都会创建新的SDK客户端（重建Agent、切换配置时都会发生），
+通过共享同一个transport，这些客户端复用同一组keep-alive连接，不再重复TCP/TLS握手。
+"""
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+from core.config_snapshot import config_store
+
+# 未在Provider配置节中设置http_pool时使用的默认值
+DEFAULT_POOL_CONFIG = {
+    "max_connections": 20,  # 最大连接数（含正在使用的）
+    "max_keepalive_connections": 10,  # 最多保留的空闲keep-alive连接数
+    "keepalive_expiry": 60,  # 空闲连接保留时间（秒）
+}
+
+
+class SharedTransport:
+    """
+    共享transport，同时实现httpx的同步和异步transport接口
+    
+    可以同时传给httpx.Client和httpx.AsyncClient（部分SDK只接受一份客户端参数，同时用于同步和异步客户端）。
+    客户端关闭时不会关闭连接池，连接池由HttpPool管理。
+    """
+    
+    def __init__(self, pool: "HttpPool"):
+        self._pool = pool
+    
+    def handle_request(self, request):
+        with self._pool.track():
+            return self._pool.sync_transport.handle_request(request)
+    
+    async def handle_async_request(self, request):
+        with self._pool.track():
+            return await self._pool.async_transport.handle_async_request(request)
+    
+    def close(self) -> None:
+        pass
+    
+    async def aclose(self) -> None:
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args) -> None:
+        pass
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *args) -> None:
+        pass
+
+
+class HttpPool:
+    """单个Provider的连接池（同步和异步各一个httpcore连接池，共享同一套限制）"""
+    
+    def __init__(self, name: str, pool_config: Dict[str, Any]):
+        import httpx
+        
+        self.name = name
+        self.config = {**DEFAULT_POOL_CONFIG, **pool_config}
+        limits = httpx.Limits(
+            max_connections=self.config["max_connections"],
+            max_keepalive_connections=self.config["max_keepalive_connections"],
+            keepalive_expiry=self.config["keepalive_expiry"],
+        )
+        self.sync_transport = httpx.HTTPTransport(limits=limits)
+        self.async_transport = httpx.AsyncHTTPTransport(limits=limits)
+        self.transport = SharedTransport(self)
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+    
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """统计请求数和等待响应头的请求数"""
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+    
+    def client(self):
+        """共享的httpx.Client（用于接受http_client参数的SDK，如OpenAI）"""
+        if self._client is None:
+            import httpx
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(transport=self.transport)
+        return self._client
+    
+    def async_client(self):
+        """共享的httpx.AsyncClient"""
+        if self._async_client is None:
+            import httpx
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = httpx.AsyncClient(transport=self.transport)
+        return self._async_client
+    
+    def stats(self) -> Dict[str, Any]:
+        """连接池使用情况（active为正在使用的连接数，in_flight为等待响应头的请求数）"""
+        connections = list(getattr(self.sync_transport._pool, "connections", []))
+        async_connections = list(getattr(self.async_transport._pool, "connections", []))
+        all_connections = connections + async_connections
+        idle = sum(1 for connection in all_connections if connection.is_idle())
+        with self._lock:
+            return {
+                "max_connections": self.config["max_connections"],
+                "max_keepalive_connections": self.config["max_keepalive_connections"],
+                "keepalive_expiry": self.config["keepalive_expiry"],
+                "connections": len(all_connections),
+                "sync_connections": len(connections),
+                "async_connections": len(async_connections),
+                "active": len(all_connections) - idle,
+                "idle": idle,
+                "utilization": round((len(all_connections) - idle) / self.config["max_connections"], 4)
+                if self.config["max_connections"] else 0.0,
+                "requests": self._requests,
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+            }
+
+
+class HttpPoolRegistry:
+    """
+    按Provider管理连接池
+    
+    连接池配置读取Provider配置节中的"http_pool"（如 "deepseek": {"http_pool": {...}}），
+    配置变化时创建新的连接池，旧连接池在使用它的客户端释放后回收。
+    """
+    
+    def __init__(self):
+        self._pools: Dict[str, HttpPool] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, provider: str, pool_config: Optional[Dict[str, Any]] = None) -> HttpPool:
+        """
+        获取Provider的连接池（同一Provider的所有客户端共享）
+        
+        Args:
+            provider: Provider名称（模型类型）
+            pool_config: 连接池配置，默认读取当前配置快照中该Provider配置节的http_pool
+        """
+        if pool_config is None:
+            pool_config = config_store.current().section(provider).get("http_pool", {})
+        merged = {**DEFAULT_POOL_CONFIG, **pool_config}
+        with self._lock:
+            pool = self._pools.get(provider)
+            if pool is None or pool.config != merged:
+                pool = self._pools[provider] = HttpPool(provider, merged)
+            return pool
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取所有连接池的使用情况"""
+        with self._lock:
+            pools = dict(self._pools)
+        return {name: pool.stats() for name, pool in pools.items()}
+
+
+http_pools = HttpPoolRegistry()
@@ -0,0 +1,189 @@
+"""
+异步任务管理器 - 长时间运行的Agent调用以任务方式提交，客户端轮询结果
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+from core.config_snapshot import config_store
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+    pass
+
+
+@dataclass
+class Job:
+    """任务记录"""
+    id: str
+    agent_name: Optional[str]
+    input: str
+    status: str = "queued"  # queued / running / succeeded / failed
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为接口返回格式"""
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "agent_name": self.agent_name,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.started_at is not None:
+            end = self.finished_at or time.time()
+            data["duration"] = round(end - self.started_at, 3)
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """
+    任务管理器
+    
+    - 有界工作线程池执行任务，线程数按模型服务的实际承载能力配置
+    - 排队任务数达到上限时拒绝新任务（由路由层返回429）
+    - 已完成任务的结果保留result_ttl秒后自动清理
+    """
+    
+    def __init__(self, runner: Callable[[Optional[str], str], Dict[str, Any]] = None, job_config: Dict[str, Any] = None):
+        """
+        初始化任务管理器
+        
+        Args:
+            runner: 任务执行函数 runner(agent_name, user_input) -> invoke_agent格式的结果，
+                    默认使用agent_service.invoke_agent
+            job_config: 任务配置，默认读取当前配置快照的"jobs"配置节
+        """
+        self._runner = runner
+        self._config = job_config
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queued = 0
+        self._running = 0
+        self._rejected = 0
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("jobs")
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """懒加载线程池（首次提交任务时才创建工作线程）"""
+        if self._executor is None:
+            max_workers = self._get_config().get("max_workers", 2)
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-job")
+        return self._executor
+    
+    def _get_runner(self) -> Callable[[Optional[str], str], Dict[str, Any]]:
+        if self._runner is None:
+            from core.agent_service import agent_service
+            self._runner = lambda agent_name, user_input: agent_service.invoke_agent(
+                agent_name=agent_name, user_input=user_input
+            )
+        return self._runner
+    
+    def submit(self, agent_name: Optional[str], user_input: str) -> Job:
+        """
+        提交任务
+        
+        Raises:
+            QueueFullError: 排队任务数已达上限
+        """
+        max_queue_size = self._get_config().get("max_queue_size", 50)
+        with self._lock:
+            self._purge_expired_locked()
+            if self._queued >= max_queue_size:
+                self._rejected += 1
+                raise QueueFullError(f"任务队列已满（{self._queued}/{max_queue_size}），请稍后重试")
+            job = Job(id=uuid.uuid4().hex, agent_name=agent_name, input=user_input)
+            self._jobs[job.id] = job
+            self._queued += 1
+        
+        self._get_executor().submit(self._run, job)
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        """获取任务（已过期的任务返回None）"""
+        with self._lock:
+            self._purge_expired_locked()
+            return self._jobs.get(job_id)
+    
+    def _run(self, job: Job) -> None:
+        """在工作线程中执行任务"""
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            job.status = "running"
+            job.started_at = time.time()
+        
+        try:
+            result = self._get_runner()(job.agent_name, job.input)
+            status = "succeeded" if result.get("success") else "failed"
+            error = None if result.get("success") else result.get("error")
+        except Exception as e:
+            result = None
+            status = "failed"
+            error = str(e)
+        
+        with self._lock:
+            self._running -= 1
+            job.result = result
+            job.error = error
+            job.status = status
+            job.finished_at = time.time()
+    
+    def _purge_expired_locked(self) -> None:
+        """清理超过保留时间的已完成任务（调用方需持有锁）"""
+        ttl = self._get_config().get("result_ttl", 3600)
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.is_finished and now - job.finished_at > ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        
+        # 结果条数超过上限时，按完成时间从早到晚清理已完成任务
+        max_stored = self._get_config().get("max_stored_jobs", 1000)
+        overflow = len(self._jobs) - max_stored
+        if overflow > 0:
+            finished = sorted(
+                (job for job in self._jobs.values() if job.is_finished),
+                key=lambda job: job.finished_at
+            )
+            for job in finished[:overflow]:
+                del self._jobs[job.id]
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取任务队列统计信息"""
+        job_config = self._get_config()
+        with self._lock:
+            self._purge_expired_locked()
+            return {
+                "queued": self._queued,
+                "running": self._running,
+                "stored": len(self._jobs),
+                "rejected": self._rejected,
+                "max_workers": job_config.get("max_workers", 2),
+                "max_queue_size": job_config.get("max_queue_size", 50),
+            }
+
+
+job_manager = JobManager()
@@ -1,227 +1,231 @@
 """
 LLM交互日志记录器 - 记录每次ChatModel的询问和回答，包括ReAct循环的每一步
+
+logging.format为"text"时写易读文本，为"jsonl"时每个事件写一行JSON（见core.structured_log），
+"both"时两种都写。
+
+日志级别（tier）决定每个请求记录多少内容：
+- off：不记录
+- metadata：只记录模型、耗时、Token数、工具名称等元数据（默认）
+- full：记录完整的消息和响应内容
+- debug：full基础上再记录回调调试信息（[DEBUG]行）
+
+metadata级别的请求按full_sample_rate抽样升级为full；未被抽中的请求保留回调参数的引用（不做格式化），
+请求出错或耗时超过slow_request_ms时再补记完整内容（尾部采样）。
 """
 from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import AIMessage, ToolMessage, HumanMessage, SystemMessage
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 import sys
-import os
+import functools
+import hashlib
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
-import config
-import re
+from core.config_snapshot import ConfigSnapshot, config_store
+from core.log_renderer import format_react_step
+from core.log_writer import log_writer
+from core.prompt_cache import prompt_cache_usage
+from core.react_parser import parse_react
+from core.structured_log import build_event, duration_ms, flatten_messages, message_to_dict, truncate, write_event
+
+
+LOG_TIERS = ("off", "metadata", "full", "debug")
+
+# 当前请求指定的日志级别（来自请求头，优先于Agent和全局配置）
+_request_tier: ContextVar[Optional[str]] = ContextVar("llm_log_tier", default=None)
+
+
+@contextmanager
+def log_tier_override(tier: Optional[str]):
+    """在当前上下文中覆盖日志级别（无效值忽略）"""
+    tier = (tier or "").strip().lower()
+    if tier not in LOG_TIERS:
+        yield
+        return
+    token = _request_tier.set(tier)
+    try:
+        yield
+    finally:
+        _request_tier.reset(token)
+
+
+def _single_record(method):
+    """
+    把一次回调写入的所有行合并为一条日志记录
+    
+    日志级别为off时跳过；需要尾部采样时保存回调参数，出错或过慢时用于补记完整内容。
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.tier == "off":
+            return None
+        with self._record():
+            result = method(self, *args, **kwargs)
+        deferred = self._deferred
+        if deferred is not None:
+            deferred.append((method, args, kwargs))
+        return result
+    return wrapper
+
 
 class LLMLogger(BaseCallbackHandler):
-    """LLM交互日志记录器（支持ChatModel和ReAct循环记录）"""
+    """
+    LLM交互日志记录器（支持ChatModel和ReAct循环记录）
+    
+    异步执行（ainvoke/astream）时，LangChain会把同步回调放到线程池中执行，
+    多个请求可能同时写同一个日志文件：每次回调写入的所有行先在当前线程中收集，
+    回调结束时作为一条记录交给后台写入器（core.log_writer），请求线程不做文件I/O，
+    并发请求的记录也不会交错。
+    
+    每个请求创建一个实例，请求结束时由AgentService调用finish()。
+    """
     
-    def __init__(self):
+    def __init__(self, snapshot: ConfigSnapshot = None, tier: str = None):
+        """
+        Args:
+            snapshot: 配置快照
+            tier: Agent指定的日志级别（default_config中的log_tier），请求头指定的级别优先
+        """
         super().__init__()
+        self._state_lock = threading.Lock()
+        self._local = threading.local()
         self.call_count = 0
-        self._pending_calls = {}  # 跟踪未完成的调用
-        self._react_steps = {}  # 跟踪ReAct循环的步骤
+        self._pending_calls = {}  # 跟踪未完成的调用（调用结束或出错时释放）
+        self._react_steps = {}  # 跟踪ReAct循环的步骤（调用结束或出错时释放）
+        self._logged_messages = {}  # 会话标识 -> (已记录的消息数, 最后一条已记录消息的标识)
+        self._system_prompts = set()  # 已记录过的系统提示词哈希
+        self._run_started = {}  # run_id -> 开始时间（结构化日志计算耗时）
         
         # 从配置读取日志设置
-        log_config = config.DEFAULT_CONFIG.get("logging", {})
+        log_config = (snapshot or config_store.current()).section("logging")
         self.console_output = log_config.get("llm_console_output", False)
         self.log_file = log_config.get("llm_log_file", "logs/llm_interactions.log")
-        
-        # 确保日志目录存在
-        log_dir = os.path.dirname(self.log_file)
-        if log_dir and not os.path.exists(log_dir):
-            os.makedirs(log_dir, exist_ok=True)
-        
-        # 初始化日志文件（追加模式）
-        self._write_to_file("="*80)
-        self._write_to_file(f"LLM交互日志 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        self._write_to_file("="*80 + "\n")
+        log_format = log_config.get("format", "text")
+        self.text_output = log_format in ("text", "both")
+        self.jsonl_output = log_format in ("jsonl", "both")
+        self.jsonl_file = log_config.get("jsonl_file", "logs/llm_interactions.jsonl")
+        self.max_content_chars = log_config.get("max_content_chars", 4000)
+        self.slow_request_ms = log_config.get("slow_request_ms", 0)
+        
+        self.tier = self._resolve_tier(_request_tier.get(), tier, log_config.get("tier", "metadata"))
+        self.sampled = self.tier == "metadata" and random.random() < log_config.get("full_sample_rate", 0)
+        self._full = self.tier in ("full", "debug") or self.sampled
+        self._debug = self.tier == "debug"
+        # 尾部采样：未记录完整内容的请求保存回调参数，出错或过慢时补记
+        tail_capture = self.slow_request_ms or log_config.get("capture_errors", True)
+        self._deferred: Optional[List] = [] if self.tier == "metadata" and not self._full and tail_capture else None
+        
+        # 初始化日志文件（追加模式，目录由写入器创建）
+        if self.text_output and self._full:
+            with self._record():
+                self._write_to_file("="*80)
+                self._write_to_file(f"LLM交互日志 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                self._write_to_file("="*80 + "\n")
         
         if self.console_output:
             print("✅ LLMLogger初始化完成（控制台+文件，支持ReAct循环记录）")
         else:
             print("✅ LLMLogger初始化完成（仅保存到文件，支持ReAct循环记录）")
     
-    def _write_to_file(self, content: str):
-        """写入日志到文件"""
+    @staticmethod
+    def _resolve_tier(*candidates: Optional[str]) -> str:
+        """返回第一个有效的日志级别"""
+        for tier in candidates:
+            if tier in LOG_TIERS:
+                return tier
+        return "metadata"
+    
+    def finish(self, duration: float = None, error: BaseException = None) -> None:
+        """
+        请求结束时调用：请求出错或耗时（秒）超过slow_request_ms时补记完整内容，然后释放保存的回调参数
+        """
+        if error is not None:
+            self._escalate(f"请求出错: {type(error).__name__}")
+        elif duration is not None and self.slow_request_ms and duration * 1000 >= self.slow_request_ms:
+            self._escalate(f"请求耗时 {duration * 1000:.0f}ms 超过 {self.slow_request_ms}ms")
+        self._deferred = None
+    
+    def _escalate(self, reason: str) -> None:
+        """切换为完整记录，并按原顺序重放之前只记录了元数据的回调"""
+        with self._state_lock:
+            deferred, self._deferred = self._deferred, None
+            if deferred is None:
+                return
+            self._full = True
+        
+        self._local.replaying = True
         try:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(content + '\n')
-        except Exception as e:
-            print(f"⚠️ 写入日志文件失败: {e}")
+            with self._record():
+                if self.text_output:
+                    self._write_to_file(f"\n[尾部采样] {reason}，补记本请求的完整内容（{len(deferred)} 个回调）")
+                if self.jsonl_output:
+                    self._emit("tail_capture", {}, reason=reason, callbacks=len(deferred))
+                for method, args, kwargs in deferred:
+                    method(self, *args, **kwargs)
+        finally:
+            self._local.replaying = False
     
-    def _format_react_step(self, step_type: str, content: str, tool_name: str = None, tool_args: Any = None) -> str:
-        """格式化ReAct步骤为易读格式，自动处理换行"""
-        # 计算标题长度
-        title_length = len(step_type)
-        border_length = 78
-        
-        formatted = f"\n┌─ {step_type} " + "─" * (border_length - title_length - 4) + "┐\n"
-        
-        if step_type == "💭 思考 (Thought)":
-            # 格式化思考内容，自动换行（每行最多76个字符）
-            if content:
-                lines = content.split('\n')
-                for line in lines:
-                    if line.strip():
-                        # 如果行太长，自动换行
-                        max_width = 76
-                        if len(line) > max_width:
-                            words = line.split()
-                            current_line = ""
-                            for word in words:
-                                if len(current_line) + len(word) + 1 > max_width:
-                                    if current_line:
-                                        formatted += f"│ {current_line.strip()}\n"
-                                    current_line = word + " "
-                                else:
-                                    current_line += word + " "
-                            if current_line:
-                                formatted += f"│ {current_line.strip()}\n"
-                        else:
-                            formatted += f"│ {line.strip()}\n"
-            else:
-                formatted += "│ (无内容)\n"
-        
-        elif step_type == "🔧 行动 (Action)":
-            formatted += f"│ 工具名称: {tool_name}\n"
-            if tool_args:
-                # 格式化工具参数
-                args_str = str(tool_args)
-                if isinstance(tool_args, dict):
-                    args_str = ", ".join([f"{k}={v}" for k, v in tool_args.items()])
-                
-                # 自动换行
-                max_width = 76
-                if len(args_str) > max_width:
-                    words = args_str.split()
-                    current_line = "│ 工具参数: "
-                    for word in words:
-                        if len(current_line) + len(word) + 1 > max_width:
-                            formatted += current_line + "\n"
-                            current_line = "│            " + word + " "
-                        else:
-                            current_line += word + " "
-                    if current_line.strip() != "│":
-                        formatted += current_line + "\n"
-                else:
-                    formatted += f"│ 工具参数: {args_str}\n"
-            else:
-                formatted += "│ 工具参数: (无参数)\n"
-        
-        elif step_type == "👀 观察 (Observation)":
-            # 格式化观察内容，自动换行
-            if content:
-                lines = content.split('\n')
-                for line in lines:
-                    if line.strip():
-                        max_width = 76
-                        if len(line) > max_width:
-                            words = line.split()
-                            current_line = ""
-                            for word in words:
-                                if len(current_line) + len(word) + 1 > max_width:
-                                    if current_line:
-                                        formatted += f"│ {current_line.strip()}\n"
-                                    current_line = word + " "
-                                else:
-                                    current_line += word + " "
-                            if current_line:
-                                formatted += f"│ {current_line.strip()}\n"
-                        else:
-                            formatted += f"│ {line.strip()}\n"
-            else:
-                formatted += "│ (无内容)\n"
-        
-        elif step_type == "✅ 最终答案 (Final Answer)":
-            # 格式化最终答案，自动换行
-            if content:
-                lines = content.split('\n')
-                for line in lines:
-                    if line.strip():
-                        max_width = 76
-                        if len(line) > max_width:
-                            words = line.split()
-                            current_line = ""
-                            for word in words:
-                                if len(current_line) + len(word) + 1 > max_width:
-                                    if current_line:
-                                        formatted += f"│ {current_line.strip()}\n"
-                                    current_line = word + " "
-                                else:
-                                    current_line += word + " "
-                            if current_line:
-                                formatted += f"│ {current_line.strip()}\n"
-                        else:
-                            formatted += f"│ {line.strip()}\n"
-            else:
-                formatted += "│ (无内容)\n"
-        
-        formatted += "└" + "─" * border_length + "┘\n"
-        return formatted
+    def _replaying(self) -> bool:
+        return getattr(self._local, "replaying", False)
     
-    def _parse_react_content(self, content: str) -> Dict[str, Any]:
-        """解析LLM返回的内容，提取ReAct格式的步骤"""
-        result = {
-            'thoughts': [],
-            'actions': [],
-            'observations': [],
-            'final_answer': None
-        }
-        
-        if not content:
-            return result
-        
-        # 提取思考（支持中英文）
-        thought_patterns = [
-            r'思考[：:]\s*(.+?)(?=\n(?:行动|观察|最终答案|Final Answer|Action|Observation|Thought|$))',
-            r'Thought[：:]\s*(.+?)(?=\n(?:行动|观察|最终答案|Final Answer|Action|Observation|Thought|$))'
-        ]
-        for pattern in thought_patterns:
-            thoughts = re.findall(pattern, content, re.DOTALL | re.IGNORECASE)
-            result['thoughts'].extend([t.strip() for t in thoughts if t.strip()])
-        
-        # 提取行动
-        action_patterns = [
-            r'行动[：:]\s*(.+?)(?=\n(?:行动输入|观察|思考|最终答案|Final Answer|Action Input|Observation|Thought|$))',
-            r'Action[：:]\s*(.+?)(?=\n(?:行动输入|观察|思考|最终答案|Final Answer|Action Input|Observation|Thought|$))'
-        ]
-        for pattern in action_patterns:
-            actions = re.findall(pattern, content, re.DOTALL | re.IGNORECASE)
-            result['actions'].extend([a.strip() for a in actions if a.strip()])
-        
-        # 提取最终答案（支持中英文）
-        final_answer_patterns = [
-            r'最终答案[：:]\s*(.+?)(?:\n\n|\n思考:|\nThought:|$)',
-            r'Final Answer[：:]\s*(.+?)(?:\n\n|\n思考:|\nThought:|$)'
-        ]
-        for pattern in final_answer_patterns:
-            final_match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
-            if final_match:
-                result['final_answer'] = final_match.group(1).strip()
-                break
-        
-        return result
+    @contextmanager
+    def _record(self):
+        """收集期间写入的所有行，结束时作为一条记录提交（可嵌套，只在最外层提交）"""
+        if getattr(self._local, "lines", None) is not None:
+            yield
+            return
+        self._local.lines = []
+        try:
+            yield
+        finally:
+            lines, self._local.lines = self._local.lines, None
+            if lines:
+                log_writer.write(self.log_file, "\n".join(lines) + "\n")
     
-    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, **kwargs: Any) -> None:
-        """ChatModel开始调用时触发（新API）"""
-        self.call_count += 1
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # 调试：记录回调被触发
-        self._write_to_file(f"\n[DEBUG] on_chat_model_start 被触发 - {timestamp}")
-        self._write_to_file(f"[DEBUG] call_count: {self.call_count}")
-        
-        # 记录调用ID用于匹配
-        run_id = kwargs.get("run_id", f"run_{self.call_count}")
-        self._pending_calls[run_id] = {
-            "start_time": timestamp, 
-            "call_count": self.call_count,
-            "messages": messages
-        }
-        
-        # 初始化ReAct步骤记录
-        if run_id not in self._react_steps:
-            self._react_steps[run_id] = []
-        
-        # 提取模型信息
+    def _write_to_file(self, content: str):
+        """写入一行日志（在回调中时并入当前记录，否则单独提交）"""
+        lines = getattr(self._local, "lines", None)
+        if lines is not None:
+            lines.append(content)
+        else:
+            log_writer.write(self.log_file, content + "\n")
+    
+    def _emit(self, event: str, kwargs: Dict[str, Any], **fields) -> None:
+        """写入一条结构化事件（run_id和parent_run_id取自回调参数，尾部采样补记的事件带replay标记）"""
+        if self._replaying():
+            fields["replay"] = True
+        write_event(self.jsonl_file, build_event(
+            event, kwargs.get("run_id"), kwargs.get("parent_run_id"), tier="full" if self._full else "metadata", **fields
+        ))
+    
+    def _start_run(self, kwargs: Dict[str, Any]) -> None:
+        if self._replaying():
+            return
+        with self._state_lock:
+            self._run_started[kwargs.get("run_id")] = time.perf_counter()
+    
+    def _elapsed(self, kwargs: Dict[str, Any]) -> Any:
+        """取出run_id对应的开始时间，返回耗时（毫秒；重放时耗时已记录在元数据中，返回None）"""
+        if self._replaying():
+            return None
+        with self._state_lock:
+            started = self._run_started.pop(kwargs.get("run_id"), None)
+        return duration_ms(started, time.perf_counter())
+    
+    def _release_run(self, kwargs: Dict[str, Any]) -> None:
+        """释放一次模型调用的跟踪状态"""
+        run_id = kwargs.get("run_id")
+        with self._state_lock:
+            self._pending_calls.pop(run_id, None)
+            self._react_steps.pop(run_id, None)
+    
+    @staticmethod
+    def _model_name(serialized: Dict[str, Any], kwargs: Dict[str, Any]) -> str:
+        """从回调参数中提取模型名称"""
         model_name = "unknown"
         if isinstance(serialized, dict):
             model_name = serialized.get("name", serialized.get("id", "unknown"))
@@ -242,10 +246,85 @@ class LLMLogger(BaseCallbackHandler):
                 model_name = llm.model
             elif hasattr(llm, "_default_params") and isinstance(llm._default_params, dict):
                 model_name = llm._default_params.get("model", "unknown")
+        return model_name
+    
+    def _format_react_step(self, step_type: str, content: str, tool_name: str = None, tool_args: Any = None) -> str:
+        """格式化ReAct步骤为易读格式，自动处理换行（见core.log_renderer.format_react_step）"""
+        return format_react_step(step_type, content, tool_name=tool_name, tool_args=tool_args)
+    
+    def _parse_react_content(self, content: str) -> Dict[str, Any]:
+        """解析LLM返回的内容，提取ReAct格式的步骤（见core.react_parser）"""
+        result = {
+            'thoughts': [],
+            'actions': [],
+            'observations': [],
+            'final_answer': None
+        }
+        for step in parse_react(content):
+            if step['type'] == 'thought':
+                result['thoughts'].append(step['content'])
+            elif step['type'] == 'action':
+                result['actions'].append(step['content'])
+            elif step['type'] == 'observation':
+                result['observations'].append(step['content'])
+            elif step['type'] == 'final_answer' and result['final_answer'] is None:
+                result['final_answer'] = step['content']
+        return result
+    
+    @_single_record
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, **kwargs: Any) -> None:
+        """
+        ChatModel开始调用时触发（新API）
+        
+        ReAct循环每一轮都会带上完整的历史消息，完整记录时只记录本会话中尚未记录过的消息，
+        系统提示词按内容哈希只记录一次，日志量和解析开销随轮数线性增长。
+        """
+        with self._state_lock:
+            if not self._replaying():
+                self.call_count += 1
+            call_count = self.call_count
+        self._start_run(kwargs)
+        flat_messages = flatten_messages(messages)
+        model_name = self._model_name(serialized, kwargs)
+        
+        if not self._full:
+            if self.jsonl_output:
+                self._emit("llm_start", kwargs, model=model_name, message_count=len(flat_messages))
+            if self.text_output:
+                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self._write_to_file(
+                    f"\n🤖 ChatModel调用 #{call_count} - {timestamp} | 模型: {model_name}"
+                    f" | Messages数量: {len(flat_messages)}"
+                )
+            return
+        
+        start = self._message_delta(flat_messages, kwargs)
+        new_messages = flat_messages[start:]
+        if self.jsonl_output:
+            self._emit(
+                "llm_start", kwargs,
+                model=model_name,
+                message_count=len(flat_messages),
+                message_offset=start,
+                messages=[self._message_entry(msg) for msg in new_messages],
+            )
+        if not self.text_output:
+            return
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # 分析messages，提取ReAct步骤
-        react_log = []
-        for msg in messages:
+        # 调试：记录回调被触发
+        if self._debug:
+            self._write_to_file(f"\n[DEBUG] on_chat_model_start 被触发 - {timestamp}")
+            self._write_to_file(f"[DEBUG] call_count: {call_count}")
+        
+        # 记录调用ID用于匹配（调用结束或出错时释放）
+        run_id = kwargs.get("run_id", f"run_{call_count}")
+        with self._state_lock:
+            self._pending_calls[run_id] = {"start_time": timestamp, "call_count": call_count}
+            react_log = self._react_steps.setdefault(run_id, [])
+        
+        # 只分析新增的messages，提取ReAct步骤
+        for msg in new_messages:
             if isinstance(msg, AIMessage):
                 # 提取思考过程和最终答案
                 if hasattr(msg, 'content') and msg.content:
@@ -282,23 +361,16 @@ class LLMLogger(BaseCallbackHandler):
                     'content': tool_content
                 })
         
-        # 记录ReAct步骤
-        if react_log:
-            self._react_steps[run_id].extend(react_log)
-        
-        # 格式化messages用于显示
-        prompt = "\n".join([str(msg) for msg in messages])
-        
         # 控制台显示（如果启用）
         if self.console_output:
-            print(f"\n🤖 ChatModel调用 #{self.call_count} - {timestamp}")
+            print(f"\n🤖 ChatModel调用 #{call_count} - {timestamp}")
             print(f"📦 模型: {model_name}")
-            print(f"📤 Messages数量: {len(messages)}")
+            print(f"📤 Messages数量: {len(flat_messages)}")
             sys.stdout.flush()
         
         # 文件保存
         self._write_to_file("\n" + "="*80)
-        self._write_to_file(f"🤖 ChatModel调用 #{self.call_count} - {timestamp}")
+        self._write_to_file(f"🤖 ChatModel调用 #{call_count} - {timestamp}")
         self._write_to_file("="*80)
         self._write_to_file(f"\n📦 使用的模型: {model_name}")
         if "llm" in kwargs:
@@ -338,32 +410,35 @@ class LLMLogger(BaseCallbackHandler):
                         step['content']
                     ))
         
-        # 记录原始messages（用于调试）
+        # 记录新增的messages（之前的轮次已记录过）
         self._write_to_file("\n📤 发送给ChatModel的Messages:")
-        self._write_to_file(f"数量: {len(messages)}")
-        self._write_to_file(f"总长度: {len(prompt)} 字符")
+        if start:
+            self._write_to_file(f"数量: {len(flat_messages)}（前 {start} 条已在之前的调用中记录，以下为新增的 {len(new_messages)} 条）")
+        else:
+            self._write_to_file(f"数量: {len(flat_messages)}")
         self._write_to_file("-"*80)
         
         # 格式化messages，每个message一行，自动换行
-        for i, msg in enumerate(messages):
-            msg_type = type(msg).__name__
+        for i, msg in enumerate(new_messages, start):
+            content = msg.content if hasattr(msg, 'content') else str(msg)
             if isinstance(msg, SystemMessage):
-                content = msg.content if hasattr(msg, 'content') else str(msg)
-                self._write_to_file(f"\n[{i+1}] SystemMessage:")
-                for line in content.split('\n'):
+                prompt_hash, first_seen = self._system_prompt_hash(content)
+                self._write_to_file(f"\n[{i+1}] SystemMessage (hash={prompt_hash}):")
+                if not first_seen:
+                    self._write_to_file("    (与本请求之前记录的系统提示词相同，省略)")
+                    continue
+                for line in str(content).split('\n'):
                     if line.strip():
                         self._write_to_file(f"    {line}")
             elif isinstance(msg, HumanMessage):
-                content = msg.content if hasattr(msg, 'content') else str(msg)
                 self._write_to_file(f"\n[{i+1}] HumanMessage:")
-                for line in content.split('\n'):
+                for line in str(content).split('\n'):
                     if line.strip():
                         self._write_to_file(f"    {line}")
             elif isinstance(msg, AIMessage):
-                content = msg.content if hasattr(msg, 'content') else str(msg)
                 self._write_to_file(f"\n[{i+1}] AIMessage:")
                 if content:
-                    for line in content.split('\n'):
+                    for line in str(content).split('\n'):
                         if line.strip():
                             self._write_to_file(f"    {line}")
                 # 记录工具调用
@@ -372,26 +447,93 @@ class LLMLogger(BaseCallbackHandler):
                     for tc in msg.tool_calls:
                         self._write_to_file(f"      - {tc.get('name', 'unknown')}({tc.get('args', {})})")
             elif isinstance(msg, ToolMessage):
-                content = msg.content if hasattr(msg, 'content') else str(msg)
                 tool_name = msg.name if hasattr(msg, 'name') else 'unknown'
                 self._write_to_file(f"\n[{i+1}] ToolMessage ({tool_name}):")
-                for line in content.split('\n'):
+                for line in str(content).split('\n'):
                     if line.strip():
                         self._write_to_file(f"    {line}")
         
         self._write_to_file("-"*80)
     
+    @staticmethod
+    def _message_fingerprint(message: Any) -> Any:
+        """消息的标识（优先使用消息id，否则用类型和内容哈希）"""
+        message_id = getattr(message, "id", None)
+        if message_id:
+            return message_id
+        return (type(message).__name__, hash(str(getattr(message, "content", message))))
+    
+    def _conversation_key(self, messages: List, kwargs: Dict[str, Any]) -> Any:
+        """会话标识：优先使用metadata中的thread_id，否则用第一条非系统消息（用户输入）"""
+        thread_id = (kwargs.get("metadata") or {}).get("thread_id")
+        if thread_id is not None:
+            return ("thread", thread_id)
+        for message in messages:
+            if not isinstance(message, SystemMessage):
+                return ("first", self._message_fingerprint(message))
+        return ("empty",)
+    
+    def _message_delta(self, messages: List, kwargs: Dict[str, Any]) -> int:
+        """
+        返回本次调用中第一条未记录过的消息下标，并更新会话的已记录位置
+        
+        只比较已记录位置处的最后一条消息，历史被改写（如裁剪、摘要）时从头记录。
+        """
+        if not messages:
+            return 0
+        key = self._conversation_key(messages, kwargs)
+        with self._state_lock:
+            logged = self._logged_messages.get(key)
+            start = 0
+            if logged is not None:
+                count, boundary = logged
+                if 0 < count <= len(messages) and self._message_fingerprint(messages[count - 1]) == boundary:
+                    start = count
+            self._logged_messages[key] = (len(messages), self._message_fingerprint(messages[-1]))
+        return start
+    
+    def _system_prompt_hash(self, content: Any) -> Tuple[str, bool]:
+        """返回系统提示词的内容哈希，以及是否是本请求中第一次出现"""
+        prompt_hash = hashlib.sha1(str(content).encode("utf-8")).hexdigest()[:12]
+        with self._state_lock:
+            first_seen = prompt_hash not in self._system_prompts
+            self._system_prompts.add(prompt_hash)
+        return prompt_hash, first_seen
+    
+    def _message_entry(self, message: Any) -> Dict[str, Any]:
+        """结构化日志中的消息（系统提示词只在第一次出现时记录内容，之后只记录哈希）"""
+        if isinstance(message, SystemMessage):
+            prompt_hash, first_seen = self._system_prompt_hash(message.content)
+            entry = {"role": "system", "content_hash": prompt_hash}
+            if first_seen:
+                entry["content"] = truncate(message.content, self.max_content_chars)
+            return entry
+        return message_to_dict(message, self.max_content_chars)
+    
+    @_single_record
     def on_chat_model_end(self, response, **kwargs: Any) -> None:
         """ChatModel调用结束时触发（新API）"""
+        elapsed = self._elapsed(kwargs)
+        self._release_run(kwargs)
+        if self.jsonl_output:
+            self._emit_llm_end(response, kwargs, elapsed)
+        if not self.text_output:
+            return
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         run_id = kwargs.get("run_id", None)
         
+        if not self._full:
+            self._write_to_file(f"📥 LLM响应 - {timestamp} | 耗时: {elapsed}ms")
+            self._log_cache_usage(response)
+            return
+        
         # 调试：记录回调被触发
-        self._write_to_file(f"\n[DEBUG] on_chat_model_end 被触发 - {timestamp}")
-        self._write_to_file(f"[DEBUG] run_id: {run_id}")
-        self._write_to_file(f"[DEBUG] response类型: {type(response)}")
-        if hasattr(response, '__dict__'):
-            self._write_to_file(f"[DEBUG] response属性: {list(response.__dict__.keys())[:10]}")
+        if self._debug:
+            self._write_to_file(f"\n[DEBUG] on_chat_model_end 被触发 - {timestamp}")
+            self._write_to_file(f"[DEBUG] run_id: {run_id}")
+            self._write_to_file(f"[DEBUG] response类型: {type(response)}")
+            if hasattr(response, '__dict__'):
+                self._write_to_file(f"[DEBUG] response属性: {list(response.__dict__.keys())[:10]}")
         
         # 提取响应文本
         text = None
@@ -400,10 +542,12 @@ class LLMLogger(BaseCallbackHandler):
         # 方法1: 检查是否是AIMessage类型（LangChain新API）
         if hasattr(response, 'content'):
             text = response.content
-            self._write_to_file(f"[DEBUG] 从response.content提取文本: {len(str(text))} 字符")
+            if self._debug:
+                self._write_to_file(f"[DEBUG] 从response.content提取文本: {len(str(text))} 字符")
         elif hasattr(response, 'text'):
             text = response.text
-            self._write_to_file(f"[DEBUG] 从response.text提取文本: {len(str(text))} 字符")
+            if self._debug:
+                self._write_to_file(f"[DEBUG] 从response.text提取文本: {len(str(text))} 字符")
         
         # 方法2: 检查是否有generations属性
         if not text and hasattr(response, 'generations') and response.generations:
@@ -452,6 +596,50 @@ class LLMLogger(BaseCallbackHandler):
         
         # 记录响应
         self._log_response(timestamp, text, response, response_str, run_id)
+        self._log_cache_usage(response)
+    
+    def _emit_llm_end(self, response: Any, kwargs: Dict[str, Any], elapsed: Any) -> None:
+        """写入llm_end事件（Token用量和缓存命中；完整记录时附带内容和工具参数）"""
+        fields: Dict[str, Any] = {"duration_ms": elapsed}
+        generations = getattr(response, 'generations', None) or [[]]
+        generation = generations[0][0] if generations[0] else None
+        if generation is not None:
+            message = getattr(generation, 'message', None)
+            if message is not None:
+                entry = message_to_dict(message, self.max_content_chars)
+                tool_calls = entry.get("tool_calls")
+                if self._full:
+                    fields["content"] = entry["content"]
+                    fields["tool_calls"] = tool_calls
+                elif tool_calls:
+                    fields["tool_calls"] = [{"name": call["name"]} for call in tool_calls]
+                fields["output_tokens"] = (getattr(message, "usage_metadata", None) or {}).get("output_tokens")
+                usage = prompt_cache_usage(message)
+                if usage is not None:
+                    fields["model"] = usage["model"]
+                    fields["input_tokens"] = usage["input_tokens"]
+                    fields["cached_tokens"] = usage["cached_tokens"]
+                    fields["prefill_ms"] = usage["prefill_ms"]
+            elif self._full:
+                fields["content"] = truncate(getattr(generation, 'text', None), self.max_content_chars)
+        self._emit("llm_end", kwargs, **fields)
+    
+    def _log_cache_usage(self, response: Any) -> None:
+        """记录本次调用的输入Token和提示词缓存命中情况"""
+        for gen_list in getattr(response, 'generations', None) or []:
+            for gen in gen_list:
+                usage = prompt_cache_usage(getattr(gen, 'message', None))
+                if usage is None:
+                    continue
+                parts = [f"模型: {usage['model']}"]
+                if usage['input_tokens'] is not None:
+                    parts.append(f"输入Token: {usage['input_tokens']}")
+                if usage['cached_tokens'] is not None:
+                    ratio = usage['cached_tokens'] / usage['input_tokens'] if usage['input_tokens'] else 0
+                    parts.append(f"命中缓存: {usage['cached_tokens']} ({ratio:.0%})")
+                if usage['prefill_ms'] is not None:
+                    parts.append(f"预填充耗时: {usage['prefill_ms']:.1f}ms")
+                self._write_to_file(f"[提示词缓存] {', '.join(parts)}\n")
     
     def _log_response(self, timestamp: str, text: str, response: Any, response_str: str = None, run_id: str = None) -> None:
         """记录响应的通用方法，包括ReAct格式解析"""
@@ -534,32 +722,80 @@ class LLMLogger(BaseCallbackHandler):
         """LLM调用出错时触发（兼容旧API）"""
         self.on_chat_model_error(error, **kwargs)
     
+    @_single_record
     def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
         """工具开始执行时触发"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         tool_name = serialized.get("name", "unknown") if isinstance(serialized, dict) else "unknown"
         
+        self._start_run(kwargs)
+        if self.jsonl_output:
+            if self._full:
+                self._emit(
+                    "tool_start", kwargs,
+                    tool=tool_name,
+                    input=truncate(input_str, self.max_content_chars),
+                    args=kwargs.get("inputs"),
+                )
+            else:
+                self._emit("tool_start", kwargs, tool=tool_name)
+        if not self.text_output:
+            return
+        if not self._full:
+            self._write_to_file(f"\n[工具执行] {tool_name} - {timestamp}")
+            return
         self._write_to_file(f"\n[工具执行] {tool_name} - {timestamp}")
         self._write_to_file(f"输入: {input_str}")
     
+    @_single_record
     def on_tool_end(self, output: str, **kwargs: Any) -> None:
         """工具执行结束时触发"""
+        elapsed = self._elapsed(kwargs)
+        if self.jsonl_output:
+            fields = {"duration_ms": elapsed}
+            if self._full:
+                fields["output"] = truncate(getattr(output, "content", output), self.max_content_chars)
+            self._emit("tool_end", kwargs, **fields)
+        if not self.text_output:
+            return
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if not self._full:
+            self._write_to_file(f"[工具执行结束] - {timestamp} | 耗时: {elapsed}ms\n")
+            return
         self._write_to_file(f"输出: {output}")
         self._write_to_file(f"[工具执行结束] - {timestamp}\n")
     
+    @_single_record
     def on_tool_error(self, error: Exception, **kwargs: Any) -> None:
-        """工具执行出错时触发"""
+        """工具执行出错时触发（之前只记录了元数据的回调会补记完整内容）"""
+        self._escalate(f"工具执行出错: {type(error).__name__}")
+        if self.jsonl_output:
+            self._emit(
+                "tool_error", kwargs,
+                duration_ms=self._elapsed(kwargs),
+                error_type=type(error).__name__,
+                error=truncate(error, self.max_content_chars),
+            )
+        if not self.text_output:
+            return
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         self._write_to_file(f"\n[工具执行错误] - {timestamp}")
         self._write_to_file(f"错误: {str(error)}\n")
     
+    @_single_record
     def on_agent_action(self, action, **kwargs: Any) -> None:
         """Agent执行行动时触发"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         tool_name = action.tool if hasattr(action, 'tool') else action.get('tool', 'unknown')
         tool_input = action.tool_input if hasattr(action, 'tool_input') else action.get('tool_input', '')
         
+        if self.jsonl_output:
+            self._emit("agent_action", kwargs, tool=tool_name, args=tool_input if self._full else None)
+        if not self.text_output:
+            return
+        if not self._full:
+            self._write_to_file(f"🔧 行动: {tool_name}")
+            return
         self._write_to_file(self._format_react_step(
             "🔧 行动 (Action)",
             "",
@@ -567,23 +803,46 @@ class LLMLogger(BaseCallbackHandler):
             tool_args=tool_input
         ))
     
+    @_single_record
     def on_agent_finish(self, finish, **kwargs: Any) -> None:
         """Agent完成时触发"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         output = finish.return_values if hasattr(finish, 'return_values') else finish.get('return_values', {})
         output_text = output.get('output', '') if isinstance(output, dict) else str(output)
         
+        if self.jsonl_output:
+            if self._full:
+                self._emit("agent_finish", kwargs, output=truncate(output_text, self.max_content_chars))
+            else:
+                self._emit("agent_finish", kwargs, output_chars=len(output_text))
+        if not self.text_output:
+            return
+        if not self._full:
+            self._write_to_file(f"✅ 完成 - 输出 {len(output_text)} 字符")
+            return
         if output_text:
             self._write_to_file(self._format_react_step(
                 "✅ 最终答案 (Final Answer)",
                 output_text
             ))
     
+    @_single_record
     def on_chat_model_error(self, error: Exception, **kwargs: Any) -> None:
-        """ChatModel调用出错时触发"""
+        """ChatModel调用出错时触发（之前只记录了元数据的回调会补记完整内容）"""
+        self._escalate(f"LLM调用出错: {type(error).__name__}")
+        self._release_run(kwargs)
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         error_msg = str(error)
         
+        if self.jsonl_output:
+            self._emit(
+                "llm_error", kwargs,
+                duration_ms=self._elapsed(kwargs),
+                error_type=type(error).__name__,
+                error=truncate(error_msg, self.max_content_chars),
+            )
+        if not self.text_output:
+            return
         # 控制台显示（如果启用）：简要错误信息
         if self.console_output:
             print(f"\n❌ LLM调用 #{self.call_count} 出错 - {timestamp}")
@@ -0,0 +1,254 @@
+"""
+日志渲染器 - 把结构化交互日志（JSONL，支持轮转后的.gz文件）渲染为易读文本
+
+    python -m core.log_renderer logs/llm_interactions.jsonl
+    python -m core.log_renderer logs/llm_interactions.jsonl.20260101-000000.gz --run <run_id>
+    python -m core.log_renderer logs/llm_interactions.jsonl --event llm_end --event tool_end
+"""
+import argparse
+import gzip
+import json
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+
+def format_react_step(step_type: str, content: str, tool_name: str = None, tool_args: Any = None) -> str:
+    """格式化ReAct步骤为易读格式，自动处理换行"""
+    # 计算标题长度
+    title_length = len(step_type)
+    border_length = 78
+    
+    formatted = f"\n┌─ {step_type} " + "─" * (border_length - title_length - 4) + "┐\n"
+    
+    if step_type == "💭 思考 (Thought)":
+        # 格式化思考内容，自动换行（每行最多76个字符）
+        if content:
+            lines = content.split('\n')
+            for line in lines:
+                if line.strip():
+                    # 如果行太长，自动换行
+                    max_width = 76
+                    if len(line) > max_width:
+                        words = line.split()
+                        current_line = ""
+                        for word in words:
+                            if len(current_line) + len(word) + 1 > max_width:
+                                if current_line:
+                                    formatted += f"│ {current_line.strip()}\n"
+                                current_line = word + " "
+                            else:
+                                current_line += word + " "
+                        if current_line:
+                            formatted += f"│ {current_line.strip()}\n"
+                    else:
+                        formatted += f"│ {line.strip()}\n"
+        else:
+            formatted += "│ (无内容)\n"
+    
+    elif step_type == "🔧 行动 (Action)":
+        formatted += f"│ 工具名称: {tool_name}\n"
+        if tool_args:
+            # 格式化工具参数
+            args_str = str(tool_args)
+            if isinstance(tool_args, dict):
+                args_str = ", ".join([f"{k}={v}" for k, v in tool_args.items()])
+            
+            # 自动换行
+            max_width = 76
+            if len(args_str) > max_width:
+                words = args_str.split()
+                current_line = "│ 工具参数: "
+                for word in words:
+                    if len(current_line) + len(word) + 1 > max_width:
+                        formatted += current_line + "\n"
+                        current_line = "│            " + word + " "
+                    else:
+                        current_line += word + " "
+                if current_line.strip() != "│":
+                    formatted += current_line + "\n"
+            else:
+                formatted += f"│ 工具参数: {args_str}\n"
+        else:
+            formatted += "│ 工具参数: (无参数)\n"
+    
+    elif step_type == "👀 观察 (Observation)":
+        # 格式化观察内容，自动换行
+        if content:
+            lines = content.split('\n')
+            for line in lines:
+                if line.strip():
+                    max_width = 76
+                    if len(line) > max_width:
+                        words = line.split()
+                        current_line = ""
+                        for word in words:
+                            if len(current_line) + len(word) + 1 > max_width:
+                                if current_line:
+                                    formatted += f"│ {current_line.strip()}\n"
+                                current_line = word + " "
+                            else:
+                                current_line += word + " "
+                        if current_line:
+                            formatted += f"│ {current_line.strip()}\n"
+                    else:
+                        formatted += f"│ {line.strip()}\n"
+        else:
+            formatted += "│ (无内容)\n"
+    
+    elif step_type == "✅ 最终答案 (Final Answer)":
+        # 格式化最终答案，自动换行
+        if content:
+            lines = content.split('\n')
+            for line in lines:
+                if line.strip():
+                    max_width = 76
+                    if len(line) > max_width:
+                        words = line.split()
+                        current_line = ""
+                        for word in words:
+                            if len(current_line) + len(word) + 1 > max_width:
+                                if current_line:
+                                    formatted += f"│ {current_line.strip()}\n"
+                                current_line = word + " "
+                            else:
+                                current_line += word + " "
+                        if current_line:
+                            formatted += f"│ {current_line.strip()}\n"
+                    else:
+                        formatted += f"│ {line.strip()}\n"
+        else:
+            formatted += "│ (无内容)\n"
+    
+    formatted += "└" + "─" * border_length + "┘\n"
+    return formatted
+
+
+def _indent(text: Any, prefix: str = "    ") -> List[str]:
+    return [f"{prefix}{line}" for line in str(text or "").split("\n") if line.strip()]
+
+
+def render_event(event: Dict[str, Any]) -> str:
+    """把一个事件渲染为易读文本（格式与文本日志一致）"""
+    kind = event.get("event")
+    ts = event.get("ts", "")
+    run_id = event.get("run_id") or ""
+    lines: List[str] = []
+    
+    if kind == "llm_start":
+        lines += ["", "=" * 80, f"🤖 ChatModel调用 {run_id} - {ts}", "=" * 80]
+        lines.append(f"📦 使用的模型: {event.get('model', 'unknown')}")
+        offset = event.get("message_offset", 0)
+        count = event.get("message_count", 0)
+        if offset:
+            lines.append(f"📤 Messages数量: {count}（前 {offset} 条已在之前的调用中记录）")
+        else:
+            lines.append(f"📤 Messages数量: {count}")
+        lines.append("-" * 80)
+        for i, message in enumerate(event.get("messages") or [], offset):
+            role = message.get("role")
+            if role == "tool":
+                lines.append(format_react_step("👀 观察 (Observation)", message.get("content") or ""))
+                continue
+            if "content_hash" in message:
+                lines.append(f"\n[{i + 1}] {role} (hash={message['content_hash']}):")
+                if "content" not in message:
+                    lines.append("    (与之前记录的系统提示词相同，省略)")
+                    continue
+            else:
+                lines.append(f"\n[{i + 1}] {role}:")
+            lines += _indent(message.get("content"))
+            for call in message.get("tool_calls") or []:
+                lines.append(format_react_step("🔧 行动 (Action)", "", tool_name=call.get("name"), tool_args=call.get("args")))
+        lines.append("-" * 80)
+    elif kind == "llm_end":
+        details = [f"耗时: {event.get('duration_ms')}ms"]
+        if event.get("input_tokens") is not None:
+            details.append(f"输入Token: {event['input_tokens']}")
+        if event.get("output_tokens") is not None:
+            details.append(f"输出Token: {event['output_tokens']}")
+        if event.get("cached_tokens") is not None:
+            details.append(f"命中缓存: {event['cached_tokens']}")
+        lines += ["", f"📥 LLM返回的响应 {run_id} - {ts}", ", ".join(details), "-" * 80]
+        lines += _indent(event.get("content"), "")
+        for call in event.get("tool_calls") or []:
+            lines.append(format_react_step("🔧 行动 (Action)", "", tool_name=call.get("name"), tool_args=call.get("args")))
+        lines.append("=" * 80)
+    elif kind in ("llm_error", "tool_error"):
+        title = "❌ LLM调用出错" if kind == "llm_error" else "[工具执行错误]"
+        lines += ["", f"{title} {run_id} - {ts}", f"{event.get('error_type')}: {event.get('error')}"]
+    elif kind == "tool_start":
+        lines += ["", f"[工具执行] {event.get('tool')} - {ts}", f"输入: {event.get('input')}"]
+    elif kind == "tool_end":
+        lines += [f"输出: {event.get('output')}", f"[工具执行结束] - {ts} ({event.get('duration_ms')}ms)"]
+    elif kind == "agent_action":
+        lines.append(format_react_step("🔧 行动 (Action)", "", tool_name=event.get("tool"), tool_args=event.get("args")))
+    elif kind == "agent_finish":
+        lines.append(format_react_step("✅ 最终答案 (Final Answer)", event.get("output") or ""))
+    elif kind == "reflection":
+        lines += ["", "=" * 80, f"🔄 反思机制执行记录 - {ts}", "=" * 80]
+        lines.append(f"迭代次数: {event.get('iterations', 0)}")
+        lines += ["", "原始输出:", str(event.get("original_output") or "")]
+        lines += ["", "反思评估:", str(event.get("reflection") or "")]
+        lines += ["", "最终输出:", str(event.get("output") or ""), "=" * 80]
+    else:
+        lines.append(json.dumps(event, ensure_ascii=False))
+    return "\n".join(lines)
+
+
+def iter_events(path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取JSONL日志（.gz文件自动解压），跳过无法解析的行"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def render(paths: Iterable[str], out: TextIO, run_id: Optional[str] = None, events: Optional[List[str]] = None) -> int:
+    """
+    渲染一个或多个日志文件
+    
+    Args:
+        paths: JSONL日志文件（按给定顺序读取）
+        out: 输出流
+        run_id: 只输出run_id或parent_run_id等于该值的事件
+        events: 只输出这些类型的事件
+    
+    Returns:
+        输出的事件数
+    """
+    count = 0
+    for path in paths:
+        for event in iter_events(path):
+            if run_id and run_id not in (event.get("run_id"), event.get("parent_run_id")):
+                continue
+            if events and event.get("event") not in events:
+                continue
+            out.write(render_event(event) + "\n")
+            count += 1
+    return count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="把结构化交互日志渲染为易读文本")
+    parser.add_argument("paths", nargs="+", help="JSONL日志文件（支持.gz）")
+    parser.add_argument("--run", default=None, help="只显示指定run_id（或其子调用）的事件")
+    parser.add_argument("--event", action="append", default=None, help="只显示指定类型的事件（可重复）")
+    parser.add_argument("--output", default=None, help="输出文件（默认标准输出）")
+    args = parser.parse_args()
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            render(args.paths, out, args.run, args.event)
+    else:
+        render(args.paths, sys.stdout, args.run, args.event)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
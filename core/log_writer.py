@@ -0,0 +1,250 @@
+"""
+后台日志写入器 - 所有日志文件共用一个写线程
+
+请求线程只把整条记录放入队列就返回，由写线程追加到带缓冲的文件句柄中：
+- 每条记录（一次回调产生的所有行）一次写入，并发请求的记录不会交错
+- 缓冲数据达到flush_bytes或最早的未刷新记录超过flush_interval秒时刷新到磁盘
+- 队列有上限：overflow为"block"时最多等待block_timeout秒，仍然满则丢弃；为"drop"时直接丢弃
+- 文件超过rotate_max_bytes或打开超过rotate_interval秒时轮转为"<文件名>.<时间戳>"并用gzip压缩，
+  只保留最近rotate_backups个
+"""
+import atexit
+import gzip
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+from core.config_snapshot import config_store
+
+_STOP = object()
+
+
+class LogWriter:
+    """后台日志写入器"""
+    
+    def __init__(self, writer_config: Dict[str, Any] = None):
+        """
+        初始化写入器（写线程在第一次写入时启动）
+        
+        Args:
+            writer_config: 写入器配置，默认读取当前配置快照的"log_writer"配置节
+        """
+        self._config = writer_config
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._files: Dict[str, Dict[str, Any]] = {}  # 路径 -> {"handle", "size", "opened_at"}
+        self._stats = {"records": 0, "bytes": 0, "flushes": 0, "rotations": 0, "dropped": 0, "errors": 0}
+        self._atexit_registered = False
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("log_writer")
+    
+    def _ensure_started(self) -> queue.Queue:
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._queue = queue.Queue(maxsize=self._get_config().get("max_queue_size", 10000))
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+                    if not self._atexit_registered:
+                        atexit.register(self.close)
+                        self._atexit_registered = True
+        return self._queue
+    
+    def write(self, path: str, text: str) -> bool:
+        """
+        提交一条日志记录（text应包含结尾换行）
+        
+        Returns:
+            是否已放入队列（队列满被丢弃时返回False）
+        """
+        log_queue = self._ensure_started()
+        writer_config = self._get_config()
+        try:
+            if writer_config.get("overflow", "block") == "drop":
+                log_queue.put_nowait((path, text))
+            else:
+                log_queue.put((path, text), timeout=writer_config.get("block_timeout", 1.0))
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return False
+        return True
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待已提交的记录全部写入并刷新到磁盘（用于测试、基准测试和退出前）"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+    
+    def close(self, timeout: float = 5.0) -> None:
+        """写完队列中的记录后停止写线程并关闭文件"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+    
+    def _run(self) -> None:
+        log_queue = self._queue
+        pending_bytes = 0
+        pending_since = 0.0
+        while True:
+            writer_config = self._get_config()
+            flush_interval = writer_config.get("flush_interval", 0.5)
+            timeout = None
+            if pending_bytes:
+                timeout = max(0.0, flush_interval - (time.monotonic() - pending_since))
+            try:
+                item = log_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            
+            if item is _STOP:
+                self._flush_files()
+                self._close_files()
+                return
+            if isinstance(item, threading.Event):
+                self._flush_files()
+                pending_bytes = 0
+                item.set()
+                continue
+            if item is not None:
+                path, text = item
+                if not pending_bytes:
+                    pending_since = time.monotonic()
+                pending_bytes += self._write_record(path, text)
+            
+            if pending_bytes and (
+                pending_bytes >= writer_config.get("flush_bytes", 65536)
+                or time.monotonic() - pending_since >= flush_interval
+            ):
+                self._flush_files()
+                pending_bytes = 0
+    
+    def _write_record(self, path: str, text: str) -> int:
+        """追加一条记录（必要时先轮转文件），返回写入的字节数"""
+        data = text.encode("utf-8")
+        try:
+            entry = self._files.get(path) or self._open(path)
+            if self._should_rotate(entry, len(data)):
+                self._rotate(path, entry)
+                entry = self._open(path)
+            entry["handle"].write(data)
+            entry["size"] += len(data)
+        except OSError as e:
+            self._stats["errors"] += 1
+            self._files.pop(path, None)
+            print(f"⚠️ 写入日志文件失败: {e}")
+            return 0
+        self._stats["records"] += 1
+        self._stats["bytes"] += len(data)
+        return len(data)
+    
+    def _open(self, path: str) -> Dict[str, Any]:
+        log_dir = os.path.dirname(path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        handle = open(path, "ab", buffering=1 << 16)
+        entry = self._files[path] = {
+            "handle": handle,
+            "size": os.fstat(handle.fileno()).st_size,
+            # 按时间轮转从本进程第一次写入该文件开始计时
+            "opened_at": time.time(),
+        }
+        return entry
+    
+    def _should_rotate(self, entry: Dict[str, Any], incoming: int) -> bool:
+        if not entry["size"]:
+            return False
+        writer_config = self._get_config()
+        max_bytes = writer_config.get("rotate_max_bytes", 0)
+        if max_bytes and entry["size"] + incoming > max_bytes:
+            return True
+        interval = writer_config.get("rotate_interval", 0)
+        return bool(interval) and time.time() - entry["opened_at"] >= interval
+    
+    def _rotate(self, path: str, entry: Dict[str, Any]) -> None:
+        """把当前文件改名为带时间戳的备份（可选gzip压缩），并清理超出数量的旧备份"""
+        entry["handle"].close()
+        self._files.pop(path, None)
+        
+        base = f"{path}.{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        target, suffix = base, 0
+        while os.path.exists(target) or os.path.exists(target + ".gz"):
+            suffix += 1
+            target = f"{base}-{suffix}"
+        os.replace(path, target)
+        
+        writer_config = self._get_config()
+        if writer_config.get("rotate_compress", True):
+            try:
+                with open(target, "rb") as src, gzip.open(target + ".gz.tmp", "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                os.replace(target + ".gz.tmp", target + ".gz")
+                os.remove(target)
+            except OSError as e:
+                # 压缩失败时保留未压缩的备份
+                self._stats["errors"] += 1
+                print(f"⚠️ 压缩日志文件失败: {e}")
+        self._stats["rotations"] += 1
+        self._prune_backups(path, writer_config.get("rotate_backups", 10))
+    
+    @staticmethod
+    def _prune_backups(path: str, keep: int) -> None:
+        if not keep:
+            return
+        log_dir = os.path.dirname(path) or "."
+        pattern = re.compile(re.escape(os.path.basename(path)) + r"\.\d{8}-\d{6}(-\d+)?(\.gz)?$")
+        backups = [
+            os.path.join(log_dir, name) for name in os.listdir(log_dir) if pattern.match(name)
+        ]
+        backups.sort(key=os.path.getmtime, reverse=True)
+        for old in backups[keep:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    
+    def _flush_files(self) -> None:
+        for path, entry in list(self._files.items()):
+            try:
+                entry["handle"].flush()
+            except OSError as e:
+                self._stats["errors"] += 1
+                self._files.pop(path, None)
+                print(f"⚠️ 刷新日志文件失败: {e}")
+        self._stats["flushes"] += 1
+    
+    def _close_files(self) -> None:
+        for entry in self._files.values():
+            try:
+                entry["handle"].close()
+            except OSError:
+                pass
+        self._files.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取写入统计（queued为队列中等待写入的记录数）"""
+        return {
+            **self._stats,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "files": list(self._files.copy()),
+        }
+
+
+log_writer = LogWriter()
@@ -0,0 +1,286 @@
+"""
+运行指标 - 进程内的Prometheus风格指标注册表，通过 /metrics 以文本格式暴露
+
+- Agent请求数和耗时：由AgentService在每次调用结束时记录
+- LLM调用耗时、Token数，工具调用耗时和错误：由MetricsCallbackHandler从LangChain回调中记录
+- 缓存命中率等已有统计：通过register_collector在抓取时读取，不重复计数
+"""
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 默认耗时分桶（秒），覆盖本地小模型到云端长输出
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 采集函数返回的样本：(指标名, 类型, 说明, [(标签, 值)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """带标签的指标基类（标签值按labelnames顺序组成key）"""
+    
+    type_name = ""
+    
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, Any] = {}
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _labels(self, key: Tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_series(self._labels(key), value))
+        return lines
+    
+    def _render_series(self, labels: Dict[str, str], value: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    
+    type_name = "counter"
+    
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """分桶直方图（桶为累计计数，另有_sum和_count）"""
+    
+    type_name = "histogram"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+    
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+    
+    def render(self) -> List[str]:
+        # 复制每个序列的计数，渲染时不持有锁
+        with self._lock:
+            items = sorted(
+                (key, {"counts": list(series["counts"]), "sum": series["sum"], "count": series["count"]})
+                for key, series in self._values.items()
+            )
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for key, series in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                bucket_labels = {**labels, "le": _format_value(bound)}
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(round(series['sum'], 6))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        """注册计数器（同名指标已存在时返回已有的）"""
+        return self._register(Counter(name, help_text, labelnames))
+    
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """注册直方图（同名指标已存在时返回已有的）"""
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+    
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        """注册抓取时调用的采集函数（用于暴露其他模块已有的统计，如缓存命中率）"""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+    
+    def render(self) -> str:
+        """渲染为Prometheus文本格式（text/plain; version=0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                # 单个采集函数出错不影响其他指标
+                lines.append(f"# 采集失败 {getattr(collector, '__qualname__', collector)}: {_escape(e)}")
+                continue
+            for name, type_name, help_text, values in samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+    
+    def reset(self) -> None:
+        """清空所有指标的值（注册的指标和采集函数保留）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+metrics = MetricsRegistry()
+
+agent_requests = metrics.counter(
+    "agent_requests_total", "Agent请求数", ("agent", "model", "mode", "status")
+)
+agent_request_duration = metrics.histogram(
+    "agent_request_duration_seconds", "Agent请求耗时（秒，批量调用不计入）", ("agent", "model", "mode")
+)
+llm_calls = metrics.counter("llm_calls_total", "LLM调用数", ("model", "status"))
+llm_call_duration = metrics.histogram("llm_call_duration_seconds", "LLM调用耗时（秒）", ("model",))
+llm_prompt_tokens = metrics.counter("llm_prompt_tokens_total", "LLM输入Token数", ("model",))
+llm_completion_tokens = metrics.counter("llm_completion_tokens_total", "LLM输出Token数", ("model",))
+tool_calls = metrics.counter("tool_calls_total", "工具调用数", ("tool", "status"))
+tool_call_duration = metrics.histogram(
+    "tool_call_duration_seconds", "工具调用耗时（秒）", ("tool",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+reflection_iterations = metrics.histogram(
+    "reflection_iterations", "每次反思增强的迭代次数", ("agent",), buckets=(0, 1, 2, 3, 5, 10)
+)
+
+
+def _model_name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+    """从回调参数中取模型名称（不可序列化的模型serialized中没有kwargs，再从invocation_params中取）"""
+    model_kwargs = (serialized or {}).get("kwargs") or {}
+    params = kwargs.get("invocation_params") or {}
+    return str(
+        model_kwargs.get("model") or model_kwargs.get("model_name")
+        or params.get("model") or params.get("model_name") or "unknown"
+    )
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    从LangChain回调中记录LLM和工具指标
+    
+    按run_id记录开始时间，可在多个请求间共享（AgentService使用同一个实例）。
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._llm_runs: Dict[Any, Tuple[float, str]] = {}
+        self._tool_runs: Dict[Any, Tuple[float, str]] = {}
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, **kwargs: Any) -> None:
+        with self._lock:
+            self._llm_runs[kwargs.get("run_id")] = (time.perf_counter(), _model_name(serialized, kwargs))
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        with self._lock:
+            self._llm_runs[kwargs.get("run_id")] = (time.perf_counter(), _model_name(serialized, kwargs))
+    
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        with self._lock:
+            started, model = self._llm_runs.pop(kwargs.get("run_id"), (None, "unknown"))
+        if started is not None:
+            llm_call_duration.observe(time.perf_counter() - started, model=model)
+        llm_calls.inc(model=model, status="success")
+        input_tokens = output_tokens = 0
+        for generations in getattr(response, "generations", None) or []:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0) or 0
+                output_tokens += usage.get("output_tokens", 0) or 0
+        if input_tokens:
+            llm_prompt_tokens.inc(input_tokens, model=model)
+        if output_tokens:
+            llm_completion_tokens.inc(output_tokens, model=model)
+    
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        with self._lock:
+            started, model = self._llm_runs.pop(kwargs.get("run_id"), (None, "unknown"))
+        if started is not None:
+            llm_call_duration.observe(time.perf_counter() - started, model=model)
+        llm_calls.inc(model=model, status="error")
+    
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        tool_name = (serialized or {}).get("name", "unknown") if isinstance(serialized, dict) else "unknown"
+        with self._lock:
+            self._tool_runs[kwargs.get("run_id")] = (time.perf_counter(), tool_name)
+    
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self._finish_tool(kwargs.get("run_id"), "success")
+    
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._finish_tool(kwargs.get("run_id"), "error")
+    
+    def _finish_tool(self, run_id: Any, status: str) -> None:
+        with self._lock:
+            started, tool_name = self._tool_runs.pop(run_id, (None, "unknown"))
+        if started is not None:
+            tool_call_duration.observe(time.perf_counter() - started, tool=tool_name)
+        tool_calls.inc(tool=tool_name, status=status)
+
+
+metrics_callback = MetricsCallbackHandler()
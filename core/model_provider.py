@@ -2,12 +2,17 @@
 模型提供者抽象基类 - 定义统一接口
 """
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Union
 from langchain_core.language_models import BaseChatModel, BaseLLM
+from langchain_core.tools import BaseTool
 
 class ModelProvider(ABC):
     """模型提供者抽象基类"""
     
+    # 调度器默认限制（max_concurrency / requests_per_minute / tokens_per_minute，0表示不限制），
+    # 可被配置中的scheduler.providers覆盖
+    default_limits: Dict[str, Any] = {}
+    
     @abstractmethod
     def get_llm(self, config: Dict[str, Any]) -> Union[BaseChatModel, BaseLLM]:
         """获取LangChain模型实例（ChatModel或LLM）"""
@@ -15,6 +20,31 @@ class ModelProvider(ABC):
     
     @abstractmethod
     def validate_config(self, config: Dict[str, Any]) -> bool:
-        """验证配置是否有效"""
+        """验证配置是否有效（在请求路径上调用，不应发起网络请求）"""
+        pass
+    
+    def warm_up(self, config: Dict[str, Any]) -> None:
+        """
+        预热模型服务（服务启动和切换模型后调用，在后台线程中执行）
+        
+        默认不做任何事；需要加载模型的提供者（如Ollama）可覆盖。
+        """
         pass
+    
+    def wrap_tools(self, tools: List[BaseTool], config: Dict[str, Any]) -> List[BaseTool]:
+        """
+        包装Agent使用的工具（创建Agent时调用）
+        
+        默认原样返回；不执行真实工具的提供者（如回放录像的replay）可覆盖。
+        """
+        return tools
+    
+    def probe(self, config: Dict[str, Any], timeout: float = 2) -> None:
+        """
+        探测模型服务是否可用（由core.provider_health的后台线程调用）
+        
+        服务不可用时抛出异常；默认只做配置校验，需要探测远程服务的提供者可覆盖。
+        """
+        if not self.validate_config(config):
+            raise ValueError("配置无效")
 
@@ -0,0 +1,110 @@
+"""
+提示词前缀缓存统计 - 记录每次模型调用中命中Provider缓存的输入Token
+
+各Provider的前缀缓存都按"从头开始逐字节相同"匹配：系统提示词和工具定义放在最前面且保持不变，
+重复调用只需为后面变化的部分做预填充（prefill）。
+- DeepSeek：自动上下文缓存，响应的usage中返回prompt_cache_hit_tokens/prompt_cache_miss_tokens
+- Gemini：隐式缓存（也可配置cached_content使用显式缓存），usage_metadata中返回cache_read
+- Ollama：keep_alive期间模型常驻，复用上次请求的KV缓存，只返回prompt_eval_duration（预填充耗时）
+"""
+import threading
+from typing import Any, Dict, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+def prompt_cache_usage(message: Any) -> Optional[Dict[str, Any]]:
+    """
+    从模型返回的消息中提取输入Token和缓存命中情况
+    
+    Returns:
+        {"model", "input_tokens", "cached_tokens", "prefill_ms"}，
+        Provider未返回的项为None；没有任何用量信息时返回None
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    metadata = getattr(message, "response_metadata", None) or {}
+    token_usage = metadata.get("token_usage") or {}
+    
+    input_tokens = usage.get("input_tokens", token_usage.get("prompt_tokens"))
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read")
+    if "prompt_cache_hit_tokens" in token_usage:
+        # DeepSeek官方API的缓存字段不在OpenAI标准的prompt_tokens_details中
+        cached_tokens = token_usage["prompt_cache_hit_tokens"]
+        input_tokens = cached_tokens + token_usage.get("prompt_cache_miss_tokens", 0)
+    prefill_ms = None
+    if metadata.get("prompt_eval_duration") is not None:
+        prefill_ms = metadata["prompt_eval_duration"] / 1e6
+    
+    if input_tokens is None and prefill_ms is None:
+        return None
+    return {
+        "model": metadata.get("model_name") or metadata.get("model") or "unknown",
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "prefill_ms": prefill_ms,
+    }
+
+
+class PromptCacheStats:
+    """按模型汇总的提示词缓存统计（hit_ratio只统计返回了缓存字段的调用）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+    
+    def record(self, usage: Dict[str, Any]) -> None:
+        """记录一次调用的用量（prompt_cache_usage的返回值）"""
+        with self._lock:
+            entry = self._models.setdefault(usage["model"], {
+                "calls": 0,
+                "input_tokens": 0,
+                "reported_calls": 0,
+                "reported_input_tokens": 0,
+                "cached_tokens": 0,
+                "prefill_calls": 0,
+                "prefill_ms": 0.0,
+            })
+            entry["calls"] += 1
+            entry["input_tokens"] += usage["input_tokens"] or 0
+            if usage["cached_tokens"] is not None:
+                entry["reported_calls"] += 1
+                entry["reported_input_tokens"] += usage["input_tokens"] or 0
+                entry["cached_tokens"] += usage["cached_tokens"]
+            if usage["prefill_ms"] is not None:
+                entry["prefill_calls"] += 1
+                entry["prefill_ms"] += usage["prefill_ms"]
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取各模型的缓存统计"""
+        with self._lock:
+            models = {name: dict(entry) for name, entry in self._models.items()}
+        result = {}
+        for name, entry in models.items():
+            reported = entry["reported_input_tokens"]
+            result[name] = {
+                "calls": entry["calls"],
+                "input_tokens": entry["input_tokens"],
+                "cached_tokens": entry["cached_tokens"],
+                "uncached_tokens": reported - entry["cached_tokens"],
+                "hit_ratio": round(entry["cached_tokens"] / reported, 4) if reported else None,
+                "avg_prefill_ms": round(entry["prefill_ms"] / entry["prefill_calls"], 1)
+                if entry["prefill_calls"] else None,
+            }
+        return result
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+class PromptCacheTracker(BaseCallbackHandler):
+    """在每次模型调用结束时把缓存用量记入prompt_cache_stats（无状态，可在请求间共享）"""
+    
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        for generations in getattr(response, "generations", None) or []:
+            for generation in generations:
+                usage = prompt_cache_usage(getattr(generation, "message", None))
+                if usage is not None:
+                    prompt_cache_stats.record(usage)
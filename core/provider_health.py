@@ -0,0 +1,314 @@
+"""
+Provider健康监控 - 后台探测模型服务状态，连续失败后熔断
+
+请求路径（AgentFactory.create_agent、OllamaProvider.validate_config、AgentService.get_agent）
+只读取缓存的健康状态，不再每次同步探测；服务不可用时请求立即失败或切换到备用模型。
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+from core.config_snapshot import config_store
+from core.provider_scheduler import SchedulerTimeoutError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# 视为服务故障的异常类型名关键字（各SDK的连接/超时/服务端错误类型不同，按名称匹配）
+_FAILURE_TYPE_KEYWORDS = ("Connection", "Timeout", "InternalServerError", "ServiceUnavailable", "ServerError")
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """
+    判断异常是否表示模型服务故障（连接失败、超时、5xx）
+    
+    API Key无效、余额不足、请求频率过高等属于配置或配额问题，不计入熔断。
+    本地调度器排队超时（服务繁忙但正常）和熔断本身抛出的错误也不计入，否则过载时会把健康的服务熔断。
+    """
+    if isinstance(error, (SchedulerTimeoutError, ProviderUnavailableError)):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(keyword in type(error).__name__ for keyword in _FAILURE_TYPE_KEYWORDS):
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status_code, int) and status_code >= 500
+
+
+class ProviderUnavailableError(Exception):
+    """Provider熔断中（服务不可用）"""
+    
+    def __init__(self, model_type: str, retry_after: float, last_error: str = None):
+        self.model_type = model_type
+        self.retry_after = retry_after
+        self.last_error = last_error
+        message = f"{model_type} 服务不可用（已熔断，约{int(retry_after)}秒后重试）"
+        if last_error:
+            message += f": {last_error}"
+        super().__init__(message)
+
+
+@dataclass
+class ProviderHealth:
+    """单个Provider的健康状态"""
+    model_type: str
+    state: str = CLOSED
+    healthy: Optional[bool] = None  # None表示尚未探测
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    last_checked: Optional[float] = None
+    last_success: Optional[float] = None
+    opened_at: Optional[float] = None
+    trial_started_at: Optional[float] = None  # 半开状态下放行的试探请求开始时间
+    latency_ms: Optional[float] = None
+    probes: int = 0
+    failures: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "healthy": self.healthy,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_checked": self.last_checked,
+            "last_success": self.last_success,
+            "opened_at": self.opened_at,
+            "trial_in_flight": self.trial_started_at is not None,
+            "latency_ms": self.latency_ms,
+            "probes": self.probes,
+            "failures": self.failures,
+        }
+
+
+class ProviderHealthMonitor:
+    """
+    Provider健康监控
+    
+    - 首次使用某个Provider时开始监控，后台线程每probe_interval秒探测一次
+    - 探测或实际请求连续失败failure_threshold次后熔断（open），请求立即失败
+    - 熔断open_timeout秒后进入半开（half_open），只放行一个试探请求（其余请求立即失败），
+      试探请求或探测成功则恢复，失败则重新熔断；试探请求超过open_timeout秒未结束时放行下一个
+    - 尚未探测过的Provider视为可用，避免启动时阻塞
+    """
+    
+    def __init__(self, prober: Callable[[str], None] = None, health_config: Dict[str, Any] = None):
+        """
+        初始化健康监控
+        
+        Args:
+            prober: 探测函数 prober(model_type)，服务不可用时抛出异常；默认调用Provider的probe方法
+            health_config: 健康监控配置，默认读取当前配置快照的"provider_health"配置节
+        """
+        self._prober = prober
+        self._config = health_config
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("provider_health")
+    
+    def is_enabled(self) -> bool:
+        return self._get_config().get("enable", False)
+    
+    def watch(self, model_type: str) -> None:
+        """开始监控Provider（首次调用时启动后台线程并立即探测）"""
+        if not self.is_enabled():
+            return
+        with self._lock:
+            if model_type in self._health:
+                return
+            self._health[model_type] = ProviderHealth(model_type)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="provider-health", daemon=True)
+                self._thread.start()
+        self._wake.set()
+    
+    def reset(self, model_type: str) -> None:
+        """清除Provider的健康状态并立即重新探测（如配置修改后）"""
+        with self._lock:
+            if model_type not in self._health:
+                return
+            self._health[model_type] = ProviderHealth(model_type)
+        self._wake.set()
+    
+    def is_available(self, model_type: str) -> bool:
+        """Provider是否未熔断（只读取状态，不占用半开状态的试探请求；请求路径使用check）"""
+        if not self.is_enabled():
+            return True
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is None:
+                return True
+            self._maybe_half_open_locked(health)
+            return health.state != OPEN
+    
+    def check(self, model_type: str, admit_trial: bool = True) -> None:
+        """
+        检查Provider是否可用
+        
+        Args:
+            admit_trial: 半开状态下是否占用试探请求（同一请求中已经检查过时传False）
+        
+        Raises:
+            ProviderUnavailableError: Provider熔断中，或半开状态下已有试探请求在进行
+        """
+        if not self.is_enabled():
+            return
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is None:
+                return
+            self._maybe_half_open_locked(health)
+            now = time.time()
+            open_timeout = self._get_config().get("open_timeout", 30)
+            if health.state == HALF_OPEN and admit_trial:
+                if health.trial_started_at is None or now - health.trial_started_at >= open_timeout:
+                    health.trial_started_at = now
+                    return
+                retry_after = max(0.0, health.trial_started_at + open_timeout - now)
+                raise ProviderUnavailableError(model_type, retry_after, health.last_error)
+            if health.state == OPEN:
+                retry_after = max(0.0, health.opened_at + open_timeout - now)
+                raise ProviderUnavailableError(model_type, retry_after, health.last_error)
+    
+    def get_fallback(self, model_type: str) -> Optional[str]:
+        """获取熔断时的备用模型类型（备用模型同样不可用时返回None，半开时占用其试探请求）"""
+        fallback = self._get_config().get("fallback", {}).get(model_type)
+        if not fallback or fallback == model_type:
+            return None
+        try:
+            self.check(fallback)
+        except ProviderUnavailableError:
+            return None
+        return fallback
+    
+    def record_success(self, model_type: str, latency_ms: float = None) -> None:
+        """记录一次成功（探测或实际请求）"""
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is None:
+                return
+            now = time.time()
+            health.healthy = True
+            health.consecutive_failures = 0
+            health.last_checked = now
+            health.last_success = now
+            if latency_ms is not None:
+                health.latency_ms = round(latency_ms, 1)
+            if health.state != CLOSED:
+                print(f"✅ {model_type} 服务已恢复，关闭熔断")
+            health.state = CLOSED
+            health.opened_at = None
+            health.trial_started_at = None
+    
+    def record_failure(self, model_type: str, error: Any) -> None:
+        """记录一次失败（探测或实际请求），连续失败达到阈值或半开状态下失败时熔断"""
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is None:
+                return
+            now = time.time()
+            health.healthy = False
+            health.consecutive_failures += 1
+            health.failures += 1
+            health.last_error = str(error)[:200]
+            health.last_checked = now
+            health.trial_started_at = None
+            threshold = self._get_config().get("failure_threshold", 3)
+            if health.state == HALF_OPEN or (health.state == CLOSED and health.consecutive_failures >= threshold):
+                print(f"⚠️ {model_type} 服务连续失败{health.consecutive_failures}次，已熔断: {health.last_error}")
+                health.state = OPEN
+                health.opened_at = now
+    
+    def record_error(self, model_type: str, error: Any) -> None:
+        """记录一次不属于服务故障的错误（如配置错误），只更新last_error，不计入熔断"""
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is None:
+                return
+            health.last_error = str(error)[:200]
+            health.last_checked = time.time()
+            health.trial_started_at = None
+    
+    def release_trial(self, model_type: str) -> None:
+        """试探请求结束但无法判断服务状态时（如命中缓存、非服务故障的错误）释放，放行下一个试探请求"""
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is not None:
+                health.trial_started_at = None
+    
+    def _maybe_half_open_locked(self, health: ProviderHealth) -> None:
+        """熔断超过open_timeout后进入半开状态（调用方需持有锁）"""
+        if health.state != OPEN:
+            return
+        open_timeout = self._get_config().get("open_timeout", 30)
+        if time.time() - health.opened_at >= open_timeout:
+            health.state = HALF_OPEN
+    
+    def probe(self, model_type: str) -> bool:
+        """立即探测一次Provider并更新状态，返回是否健康"""
+        with self._lock:
+            health = self._health.get(model_type)
+            if health is None:
+                return True
+            health.probes += 1
+        start = time.perf_counter()
+        try:
+            self._get_prober()(model_type)
+        except Exception as e:
+            if is_provider_failure(e):
+                self.record_failure(model_type, e)
+            else:
+                # API Key缺失、401/403等配置问题只记录错误信息，不计入熔断，请求时仍返回真实的鉴权错误
+                self.record_error(model_type, e)
+            return False
+        self.record_success(model_type, (time.perf_counter() - start) * 1000)
+        return True
+    
+    def _get_prober(self) -> Callable[[str], None]:
+        if self._prober is None:
+            from core.agent_factory import AgentFactory
+            
+            def prober(model_type: str) -> None:
+                provider = AgentFactory.get_provider(model_type)
+                provider.probe(
+                    config_store.current().section(model_type),
+                    timeout=self._get_config().get("probe_timeout", 2)
+                )
+            
+            self._prober = prober
+        return self._prober
+    
+    def _run(self) -> None:
+        """后台探测循环"""
+        while True:
+            self._wake.wait(timeout=self._get_config().get("probe_interval", 15))
+            self._wake.clear()
+            if not self.is_enabled():
+                continue
+            with self._lock:
+                model_types = list(self._health.keys())
+                for health in self._health.values():
+                    self._maybe_half_open_locked(health)
+            for model_type in model_types:
+                if self.is_available(model_type):
+                    self.probe(model_type)
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取所有被监控Provider的健康状态"""
+        with self._lock:
+            for health in self._health.values():
+                self._maybe_half_open_locked(health)
+            return {
+                "enabled": self.is_enabled(),
+                "providers": {name: health.to_dict() for name, health in self._health.items()},
+            }
+
+
+provider_health = ProviderHealthMonitor()
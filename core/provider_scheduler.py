@@ -0,0 +1,451 @@
+"""
+Provider调度器 - 在Agent的LLM与模型提供者之间限制并发数和请求/Token速率
+
+超出容量的调用在本地排队（按Agent轮转，避免某个Agent的批量请求饿死其他Agent），
+而不是全部打到模型服务上再以429/超时的形式失败重试。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from core.delegating_chat_model import DelegatingChatModel, add_chunk_usage, usage_from_result
+from core.config_snapshot import config_store
+
+
+class SchedulerTimeoutError(Exception):
+    """排队等待超过queue_timeout"""
+    pass
+
+
+# 获得执行许可后调用的回调（请求对冲据此从获得许可开始计时，本地排队时间不计入）
+slot_acquired: contextvars.ContextVar = contextvars.ContextVar("slot_acquired", default=None)
+
+
+def _notify_acquired() -> None:
+    callback = slot_acquired.get()
+    if callback is not None:
+        callback()
+
+
+class TokenBucket:
+    """令牌桶（按分钟配额匀速补充，容量为一分钟的配额）"""
+    
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """获取amount个令牌还需等待的秒数（0表示可以立即获取）"""
+        self._refill(now)
+        # 单次请求超过桶容量时按容量计算，否则永远无法获取
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float) -> None:
+        """扣除令牌（允许为负，实际用量超出预估时由后续请求补偿）"""
+        self.tokens -= amount
+    
+    def refund(self, amount: float) -> None:
+        """退回令牌"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+    
+    def drain(self) -> None:
+        """清空令牌（服务端已返回限流时，暂停发送直到令牌补充）"""
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Ticket:
+    """一次排队中的调用"""
+    
+    __slots__ = ("agent_name", "tokens", "enqueued_at", "loop", "waker")
+    
+    def __init__(self, agent_name: str, tokens: int):
+        self.agent_name = agent_name
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.waker: Optional[asyncio.Future] = None
+
+
+class ProviderScheduler:
+    """
+    单个Provider的调度器
+    
+    - max_concurrency: 同时进行中的调用数上限
+    - requests_per_minute / tokens_per_minute: 令牌桶限速（Token数在调用前预估，调用后按实际用量修正）
+    - 排队公平性: 每个Agent一个FIFO队列，各Agent队首轮流获得执行许可
+    
+    所有限制取0表示不限制。
+    """
+    
+    def __init__(self, provider: str, limits: Dict[str, Any]):
+        self.provider = provider
+        self.max_concurrency = limits.get("max_concurrency", 0) or 0
+        self.requests_per_minute = limits.get("requests_per_minute", 0) or 0
+        self.tokens_per_minute = limits.get("tokens_per_minute", 0) or 0
+        self._rpm = TokenBucket(self.requests_per_minute) if self.requests_per_minute else None
+        self._tpm = TokenBucket(self.tokens_per_minute) if self.tokens_per_minute else None
+        
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # 按Agent分组的等待队列，字典顺序即轮转顺序
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._in_flight = 0
+        
+        self._granted = 0
+        self._timeouts = 0
+        self._rate_limited = 0
+        self._tokens_used = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._recent_waits: deque = deque(maxlen=500)
+    
+    def acquire(self, agent_name: str, tokens: int, timeout: float = None) -> _Ticket:
+        """
+        获取执行许可（阻塞直到轮到该调用且容量允许）
+        
+        Raises:
+            SchedulerTimeoutError: 等待超过timeout秒
+        """
+        ticket = _Ticket(agent_name, tokens)
+        deadline = ticket.enqueued_at + timeout if timeout else None
+        with self._cond:
+            self._enqueue_locked(ticket)
+            while True:
+                granted, wait_hint = self._try_grant_locked(ticket)
+                if granted:
+                    return ticket
+                remaining = self._remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    self._abandon_locked(ticket)
+                    raise self._timeout_error(timeout)
+                self._cond.wait(timeout=_min_timeout(wait_hint, remaining))
+    
+    async def aacquire(self, agent_name: str, tokens: int, timeout: float = None) -> _Ticket:
+        """acquire()的异步版本，等待期间不占用线程"""
+        ticket = _Ticket(agent_name, tokens)
+        ticket.loop = asyncio.get_running_loop()
+        deadline = ticket.enqueued_at + timeout if timeout else None
+        with self._lock:
+            self._enqueue_locked(ticket)
+        try:
+            while True:
+                with self._lock:
+                    granted, wait_hint = self._try_grant_locked(ticket)
+                    if granted:
+                        return ticket
+                    remaining = self._remaining(deadline)
+                    if remaining is not None and remaining <= 0:
+                        self._abandon_locked(ticket)
+                        raise self._timeout_error(timeout)
+                    ticket.waker = ticket.loop.create_future()
+                    waker = ticket.waker
+                try:
+                    await asyncio.wait_for(waker, timeout=_min_timeout(wait_hint, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                self._abandon_locked(ticket)
+            raise
+    
+    def release(self, ticket: _Ticket, actual_tokens: int = None, rate_limited: bool = False) -> None:
+        """
+        释放执行许可
+        
+        Args:
+            ticket: acquire返回的许可
+            actual_tokens: 实际Token用量（为None时保留预估值）
+            rate_limited: 调用是否被服务端限流（是则清空请求令牌桶，暂停后续发送）
+        """
+        with self._cond:
+            self._in_flight -= 1
+            used = ticket.tokens
+            if actual_tokens:
+                used = actual_tokens
+                if self._tpm is not None:
+                    delta = actual_tokens - ticket.tokens
+                    if delta > 0:
+                        self._tpm.consume(delta)
+                    else:
+                        self._tpm.refund(-delta)
+            self._tokens_used += used
+            if rate_limited:
+                self._rate_limited += 1
+                if self._rpm is not None:
+                    self._rpm.drain()
+            self._notify_locked()
+    
+    def _enqueue_locked(self, ticket: _Ticket) -> None:
+        queue = self._queues.get(ticket.agent_name)
+        if queue is None:
+            queue = self._queues[ticket.agent_name] = deque()
+        queue.append(ticket)
+    
+    def _try_grant_locked(self, ticket: _Ticket):
+        """
+        尝试为ticket发放执行许可（调用方需持有锁）
+        
+        Returns:
+            (是否获得许可, 建议等待秒数)，等待秒数为None表示等待状态变化通知
+        """
+        # 轮转顺序中第一个Agent的队首才有资格执行
+        agent_name, queue = next(iter(self._queues.items()))
+        if queue[0] is not ticket:
+            return False, None
+        if self.max_concurrency and self._in_flight >= self.max_concurrency:
+            return False, None
+        
+        now = time.monotonic()
+        wait = 0.0
+        if self._rpm is not None:
+            wait = max(wait, self._rpm.wait_time(1, now))
+        if self._tpm is not None:
+            wait = max(wait, self._tpm.wait_time(ticket.tokens, now))
+        if wait > 0:
+            return False, wait
+        
+        if self._rpm is not None:
+            self._rpm.consume(1)
+        if self._tpm is not None:
+            self._tpm.consume(ticket.tokens)
+        
+        queue.popleft()
+        del self._queues[agent_name]
+        if queue:
+            # 该Agent还有排队请求，移到轮转队尾
+            self._queues[agent_name] = queue
+        self._in_flight += 1
+        
+        waited = now - ticket.enqueued_at
+        self._granted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        self._recent_waits.append(waited)
+        
+        # 队首已变化，唤醒其他等待者
+        self._notify_locked()
+        return True, None
+    
+    def _abandon_locked(self, ticket: _Ticket) -> None:
+        """将超时或取消的调用移出队列"""
+        queue = self._queues.get(ticket.agent_name)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.agent_name]
+        self._notify_locked()
+    
+    def _notify_locked(self) -> None:
+        """唤醒所有等待者（同步等待者通过Condition，异步等待者通过各自事件循环中的Future）"""
+        self._cond.notify_all()
+        for queue in self._queues.values():
+            for ticket in queue:
+                if ticket.waker is not None:
+                    ticket.loop.call_soon_threadsafe(_wake, ticket.waker)
+                    ticket.waker = None
+    
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+    
+    def _timeout_error(self, timeout: float) -> SchedulerTimeoutError:
+        self._timeouts += 1
+        return SchedulerTimeoutError(f"{self.provider} 调度排队超过 {timeout} 秒，模型服务繁忙")
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取调度统计信息（排队等待时间单位为毫秒）"""
+        with self._lock:
+            waits = sorted(self._recent_waits)
+            p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+            return {
+                "max_concurrency": self.max_concurrency,
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "in_flight": self._in_flight,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "queued_by_agent": {name: len(queue) for name, queue in self._queues.items()},
+                "granted": self._granted,
+                "timeouts": self._timeouts,
+                "rate_limited": self._rate_limited,
+                "tokens_used": self._tokens_used,
+                "avg_wait_ms": round(self._total_wait / self._granted * 1000, 1) if self._granted else 0.0,
+                "p95_wait_ms": round(p95 * 1000, 1),
+                "max_wait_ms": round(self._max_wait * 1000, 1),
+            }
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _min_timeout(*values: Optional[float]) -> Optional[float]:
+    candidates = [v for v in values if v is not None]
+    return max(min(candidates), 0.0) if candidates else None
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """粗略预估输入Token数（中文约1字1Token、英文约4字符1Token，取折中按2字符计）"""
+    chars = sum(len(str(message.content)) for message in messages)
+    return max(1, chars // 2)
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """判断异常是否为服务端限流"""
+    error_str = str(e)
+    return "429" in error_str or "rate limit" in error_str.lower()
+
+
+class ProviderSchedulerRegistry:
+    """
+    按Provider管理调度器
+    
+    限制值优先使用配置"scheduler.providers"中的配置，
+    未配置的项使用Provider类声明的default_limits。
+    """
+    
+    def __init__(self, scheduler_config: Dict[str, Any] = None):
+        self._config = scheduler_config
+        self._schedulers: Dict[str, ProviderScheduler] = {}
+        self._lock = threading.Lock()
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("scheduler")
+    
+    def is_enabled(self) -> bool:
+        return self._get_config().get("enable", False)
+    
+    def get_queue_timeout(self) -> Optional[float]:
+        return self._get_config().get("queue_timeout") or None
+    
+    def get(self, provider: str, default_limits: Dict[str, Any] = None) -> ProviderScheduler:
+        """获取Provider的调度器（同一Provider的所有Agent共享）"""
+        with self._lock:
+            scheduler = self._schedulers.get(provider)
+            if scheduler is None:
+                limits = {
+                    **(default_limits or {}),
+                    **self._get_config().get("providers", {}).get(provider, {}),
+                }
+                scheduler = self._schedulers[provider] = ProviderScheduler(provider, limits)
+            return scheduler
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取所有Provider的调度统计信息"""
+        with self._lock:
+            schedulers = dict(self._schedulers)
+        return {
+            "enabled": self.is_enabled(),
+            "providers": {name: scheduler.stats() for name, scheduler in schedulers.items()},
+        }
+
+
+provider_scheduler = ProviderSchedulerRegistry()
+
+
+class ScheduledChatModel(DelegatingChatModel):
+    """经过Provider调度器的ChatModel，每次生成前获取执行许可，结束后按实际Token用量释放"""
+    
+    scheduler: Any
+    agent_name: str = "default"
+    queue_timeout: Optional[float] = None
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        ticket = self.scheduler.acquire(self.agent_name, estimate_tokens(messages), self.queue_timeout)
+        _notify_acquired()
+        usage = None
+        rate_limited = False
+        try:
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            usage = usage_from_result(result)
+            return result
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            self.scheduler.release(ticket, usage["total_tokens"] if usage else None, rate_limited)
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        ticket = await self.scheduler.aacquire(self.agent_name, estimate_tokens(messages), self.queue_timeout)
+        _notify_acquired()
+        usage = None
+        rate_limited = False
+        try:
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            usage = usage_from_result(result)
+            return result
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            self.scheduler.release(ticket, usage["total_tokens"] if usage else None, rate_limited)
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        ticket = self.scheduler.acquire(self.agent_name, estimate_tokens(messages), self.queue_timeout)
+        usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        rate_limited = False
+        try:
+            for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                add_chunk_usage(usage, chunk)
+                yield chunk
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            self.scheduler.release(ticket, usage["total_tokens"] or None, rate_limited)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        ticket = await self.scheduler.aacquire(self.agent_name, estimate_tokens(messages), self.queue_timeout)
+        usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        rate_limited = False
+        try:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                add_chunk_usage(usage, chunk)
+                yield chunk
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            raise
+        finally:
+            self.scheduler.release(ticket, usage["total_tokens"] or None, rate_limited)
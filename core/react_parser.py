@@ -0,0 +1,223 @@
+"""
+ReAct输出解析器 - 从模型输出中识别思考、行动、观察和最终答案
+
+同一个解析器既能一次性解析完整输出（parse_react / extract_final_answer），
+也能在流式输出时逐块喂入（ReActStreamParser），每个段落一结束就产出事件：
+
+    parser = ReActStreamParser()
+    for chunk in tokens:
+        for event in parser.feed(chunk):
+            ...
+    events = parser.close()
+
+段落以"标记 + 冒号"开始（思考/Thought、行动/Action、行动输入/Action Input、
+观察/Observation、最终答案/Final Answer，不区分大小写，中英文冒号均可），
+到下一行出现的标记处结束；最终答案段落遇到空行也结束（只取第一段）。
+所有正则预先编译，流式解析时每个字符只扫描常数次，总开销与输出长度成线性关系。
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 标记名 -> 段落类型（较长的标记排在前面，保证"行动输入"不会被识别为"行动"）
+_MARKERS = {
+    "思考": "thought",
+    "thought": "thought",
+    "行动输入": "action_input",
+    "action input": "action_input",
+    "行动": "action",
+    "action": "action",
+    "观察": "observation",
+    "observation": "observation",
+    "最终答案": "final_answer",
+    "final answer": "final_answer",
+}
+_MARKER_NAMES = "|".join(
+    re.escape(name).replace(r"\ ", " ") for name in sorted(_MARKERS, key=len, reverse=True)
+)
+
+# 段落之外：标记可以出现在任意位置（如"好的。最终答案: ..."），但不能是英文单词的一部分（如"Reaction:"）。
+# 在转成小写的文本上用区分大小写的正则查找：不带IGNORECASE和后顾断言时re能按首字符快速跳过，快一个数量级
+_MARKER_ANYWHERE = re.compile(rf"(?P<name>{_MARKER_NAMES})[ \t]*[：:][ \t]*")
+_MARKER_ANYWHERE_IGNORECASE = re.compile(rf"(?P<name>{_MARKER_NAMES})[ \t]*[：:][ \t]*", re.IGNORECASE)
+_ASCII_LETTERS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+# 段落之内：只有行首的标记才结束当前段落
+_MARKER_AT_LINE_START = re.compile(rf"\n[ \t]*(?P<name>{_MARKER_NAMES})[ \t]*[：:][ \t]*", re.IGNORECASE)
+# 最终答案段落：遇到空行或行首的标记结束
+_FINAL_ANSWER_END = re.compile(rf"\n[ \t]*\n|\n[ \t]*(?P<name>{_MARKER_NAMES})[ \t]*[：:][ \t]*", re.IGNORECASE)
+
+# 新块到达时向前回看的字符数（标记可能被拆在两个块之间）
+_LOOKBACK = max(len(name) for name in _MARKERS) + 8
+
+_REACT_KEYWORDS = ("思考:", "行动:", "观察:", "Thought:", "Action:", "Observation:")
+
+
+class ReActStreamParser:
+    """
+    增量ReAct解析器
+    
+    feed()返回本次新完成的事件，事件格式: {"type": 段落类型, "content": 段落内容}，
+    另外在最终答案段落中还会产出:
+    - {"type": "final_answer_start"}：刚识别到"最终答案:"标记
+    - {"type": "final_answer_delta", "content": ...}：最终答案的增量文本（不会包含结束标记）
+    最终答案段落结束后 final_answer_done 为True，调用方可以据此提前停止生成。
+    """
+    
+    def __init__(self):
+        self._buffer = ""  # 尚未处理完的文本（段落之内从段落内容开始，段落之外只保留尾部）
+        self._section: Optional[str] = None  # 当前段落类型（None表示在段落之外）
+        self._start = 0  # 当前段落内容在_buffer中的起始位置
+        self._scan_from = 0  # 下次查找标记的起点（之前的部分已确认没有标记）
+        self._emitted = 0  # 最终答案已通过delta产出到的位置
+        self._answer_started = False  # 是否已产出过非空的最终答案delta
+        self.final_answer: Optional[str] = None
+        self.final_answer_done = False
+    
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """喂入一段新文本，返回其中新完成的事件"""
+        events: List[Dict[str, Any]] = []
+        if text:
+            self._buffer += text
+            self._advance(events)
+            self._compact()
+        return events
+    
+    def close(self) -> List[Dict[str, Any]]:
+        """输出结束，结束当前段落并返回剩余事件"""
+        events: List[Dict[str, Any]] = []
+        if self._section is not None:
+            self._finish_section(len(self._buffer), len(self._buffer), events)
+        self._buffer = ""
+        self._start = self._scan_from = self._emitted = 0
+        return events
+    
+    def _advance(self, events: List[Dict[str, Any]]) -> None:
+        buffer = self._buffer
+        while True:
+            if self._section is None:
+                match = _search_marker_anywhere(buffer, self._scan_from)
+                if match is None:
+                    # 只有尾部可能是还没到齐的标记（多留一个字符供判断单词边界）
+                    self._scan_from = max(self._scan_from, len(buffer) - _LOOKBACK)
+                    return
+                name, content_start = match
+                self._start_section(_MARKERS[name], content_start, events)
+                continue
+            
+            pattern = _FINAL_ANSWER_END if self._section == "final_answer" else _MARKER_AT_LINE_START
+            match = pattern.search(buffer, self._scan_from)
+            if match is None:
+                # 标记和空行都以换行开头：最后一行可能还是标记的开头时从该行重新查找，否则之前的部分都不用再看
+                newline = buffer.rfind("\n", self._scan_from)
+                if newline >= 0 and _could_be_marker(buffer[newline + 1:]):
+                    self._scan_from = newline
+                else:
+                    self._scan_from = len(buffer)
+                if self._section == "final_answer":
+                    self._emit_delta(events)
+                return
+            name = match.group("name")
+            # 以标记结束的段落直接开始下一段，以空行结束的最终答案回到段落之外
+            self._finish_section(match.start(), match.end(), events)
+            if name is not None:
+                self._start_section(_MARKERS[name.lower()], match.end(), events)
+    
+    def _compact(self) -> None:
+        """丢弃已经处理完的文本，位置随之平移"""
+        keep = self._start if self._section is not None else max(0, self._scan_from - 1)
+        if keep:
+            self._buffer = self._buffer[keep:]
+            self._start -= keep
+            self._scan_from -= keep
+            self._emitted = max(0, self._emitted - keep)
+    
+    def _start_section(self, section: str, content_start: int, events: List[Dict[str, Any]]) -> None:
+        self._section = section
+        self._start = self._scan_from = self._emitted = content_start
+        self._answer_started = False
+        if section == "final_answer":
+            events.append({"type": "final_answer_start"})
+    
+    def _finish_section(self, end: int, resume: int, events: List[Dict[str, Any]]) -> None:
+        content = self._buffer[self._start:end].strip()
+        if self._section == "final_answer":
+            self._emit_delta(events, end)
+            if not self.final_answer_done:
+                self.final_answer = content
+                self.final_answer_done = True
+        if content:
+            events.append({"type": self._section, "content": content})
+        self._section = None
+        self._start = self._scan_from = resume
+    
+    def _emit_delta(self, events: List[Dict[str, Any]], end: Optional[int] = None) -> None:
+        """产出最终答案中已经确定的部分（段落未结束时，可能是结束标记开头的最后一行先不产出）"""
+        closing = end is not None
+        if not closing:
+            end = len(self._buffer)
+            newline = self._buffer.rfind("\n", self._emitted)
+            if newline >= 0 and _could_be_marker(self._buffer[newline + 1:]):
+                end = newline
+        if end <= self._emitted:
+            return
+        delta = self._buffer[self._emitted:end]
+        self._emitted = end
+        if not self._answer_started:
+            delta = delta.lstrip()
+        if closing:
+            delta = delta.rstrip()
+        if delta:
+            self._answer_started = True
+            events.append({"type": "final_answer_delta", "content": delta})
+
+
+def _search_marker_anywhere(text: str, pos: int) -> Optional[Tuple[str, int]]:
+    """查找不在英文单词中间的标记，返回 (小写标记名, 段落内容起始位置)"""
+    lowered = text[pos:].lower()
+    pattern = _MARKER_ANYWHERE
+    if len(lowered) != len(text) - pos:
+        # 极少数字符转小写后长度会变，位置无法对应，退回IGNORECASE
+        lowered, pattern = text[pos:], _MARKER_ANYWHERE_IGNORECASE
+    start = 0
+    while True:
+        match = pattern.search(lowered, start)
+        if match is None:
+            return None
+        if match.start() + pos == 0 or text[match.start() + pos - 1] not in _ASCII_LETTERS:
+            return match.group("name").lower(), match.end() + pos
+        start = match.start() + 1
+
+
+def _could_be_marker(line: str) -> bool:
+    """行首文本是否可能是（尚未完整到达的）标记或空行"""
+    text = line.lstrip(" \t").lower()
+    if not text.strip():
+        return True
+    for name in _MARKERS:
+        if name.startswith(text) or (text.startswith(name) and not text[len(name):].strip(" \t")):
+            return True
+    return False
+
+
+def parse_react(text: str) -> List[Dict[str, Any]]:
+    """一次性解析完整输出，返回按出现顺序排列的段落事件（不含最终答案的增量事件）"""
+    parser = ReActStreamParser()
+    events = parser.feed(text or "") + parser.close()
+    return [event for event in events if event["type"] not in ("final_answer_start", "final_answer_delta")]
+
+
+def extract_final_answer(text: str) -> str:
+    """
+    从ReAct格式输出中提取最终答案
+    
+    找不到"最终答案:"时：输出很短且不含ReAct关键词则视为直接回答，否则返回原始文本（至少能看到完整输出）。
+    """
+    if not text:
+        return text
+    parser = ReActStreamParser()
+    parser.feed(text)
+    parser.close()
+    if parser.final_answer:
+        return parser.final_answer
+    if len(text) < 200 and not any(keyword in text for keyword in _REACT_KEYWORDS):
+        return text.strip()
+    return text
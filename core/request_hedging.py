@@ -0,0 +1,381 @@
+"""
+请求对冲 - 降低模型调用的尾延迟
+
+一次调用超过该Provider近期延迟的指定分位数仍未返回时，再发出一个相同的请求
+（发往同一Provider或配置的备用Provider），采用先完成的结果并取消另一个。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from core.delegating_chat_model import DelegatingChatModel
+from core.provider_scheduler import ScheduledChatModel, slot_acquired
+from core.config_snapshot import config_store
+
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+
+class HedgePolicy:
+    """
+    单个Provider的对冲策略和统计
+    
+    对冲延迟取最近window次主请求延迟的percentile分位数，限制在[min_delay, max_delay]之间；
+    样本数不足min_samples时使用initial_delay。
+    """
+    
+    def __init__(self, provider: str, policy_config: Dict[str, Any]):
+        self.provider = provider
+        self.secondary: Optional[str] = policy_config.get("secondary")
+        self.percentile = policy_config.get("percentile", 95)
+        self.min_delay = policy_config.get("min_delay", 1.0)
+        self.max_delay = policy_config.get("max_delay", 10.0)
+        self.initial_delay = policy_config.get("initial_delay", 5.0)
+        self.min_samples = policy_config.get("min_samples", 20)
+        
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=policy_config.get("window", 200))
+        self._calls = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._errors = 0
+        self._cancelled = 0
+        self._abandoned = 0
+    
+    def delay(self) -> float:
+        """当前的对冲延迟（秒）"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                delay = self.initial_delay
+            else:
+                latencies = sorted(self._latencies)
+                index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+                delay = latencies[index]
+        return min(self.max_delay, max(self.min_delay, delay))
+    
+    def record_latency(self, seconds: float) -> None:
+        """记录一次主请求的耗时（主请求落败时为截至取消时的耗时，是实际延迟的下限）"""
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def record_call(self, hedged: bool, winner: Optional[str], loser_cancelled: bool = None) -> None:
+        """
+        记录一次调用的结果
+        
+        Args:
+            hedged: 是否发出了对冲请求
+            winner: 采用结果的请求（PRIMARY/HEDGE），全部失败时为None
+            loser_cancelled: 落败请求是否已取消（False表示同步调用中仍在后台线程运行，结果被丢弃）
+        """
+        with self._lock:
+            self._calls += 1
+            if hedged:
+                self._hedged += 1
+            if winner == HEDGE:
+                self._hedge_wins += 1
+            if winner is None:
+                self._errors += 1
+            if loser_cancelled is True:
+                self._cancelled += 1
+            elif loser_cancelled is False:
+                self._abandoned += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取对冲统计（hedge_rate为发出对冲的比例，win_rate为对冲请求胜出的比例）"""
+        delay = self.delay()
+        with self._lock:
+            latencies = sorted(self._latencies)
+            p50 = latencies[len(latencies) // 2] if latencies else 0.0
+            return {
+                "secondary": self.secondary,
+                "percentile": self.percentile,
+                "delay_ms": round(delay * 1000, 1),
+                "p50_latency_ms": round(p50 * 1000, 1),
+                "samples": len(latencies),
+                "calls": self._calls,
+                "hedged": self._hedged,
+                "hedge_rate": round(self._hedged / self._calls, 4) if self._calls else 0.0,
+                "hedge_wins": self._hedge_wins,
+                "win_rate": round(self._hedge_wins / self._hedged, 4) if self._hedged else 0.0,
+                "errors": self._errors,
+                "cancelled": self._cancelled,
+                "abandoned": self._abandoned,
+            }
+
+
+class RequestHedgingRegistry:
+    """
+    按Provider管理对冲策略
+    
+    对冲需要显式开启（"hedging.enable"），且只对"hedging.providers"中列出的Provider生效。
+    """
+    
+    def __init__(self, hedging_config: Dict[str, Any] = None):
+        self._config = hedging_config
+        self._policies: Dict[str, HedgePolicy] = {}
+        self._lock = threading.Lock()
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("hedging")
+    
+    def is_enabled(self) -> bool:
+        return self._get_config().get("enable", False)
+    
+    def get_policy(self, provider: str) -> Optional[HedgePolicy]:
+        """获取Provider的对冲策略（未开启或未配置该Provider时返回None）"""
+        hedging_config = self._get_config()
+        if not hedging_config.get("enable", False):
+            return None
+        provider_config = hedging_config.get("providers", {}).get(provider)
+        if provider_config is None:
+            return None
+        with self._lock:
+            policy = self._policies.get(provider)
+            if policy is None:
+                defaults = {key: value for key, value in hedging_config.items() if key not in ("enable", "providers")}
+                policy = self._policies[provider] = HedgePolicy(provider, {**defaults, **provider_config})
+            return policy
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取所有Provider的对冲统计"""
+        with self._lock:
+            policies = dict(self._policies)
+        return {
+            "enabled": self.is_enabled(),
+            "providers": {name: policy.stats() for name, policy in policies.items()},
+        }
+
+
+request_hedging = RequestHedgingRegistry()
+
+
+def _start_thread(fn, *args, **kwargs) -> Future:
+    """在守护线程中执行fn（继承当前上下文变量），返回Future"""
+    future: Future = Future()
+    context = contextvars.copy_context()
+    
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(fn, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, name="hedged-request", daemon=True).start()
+    return future
+
+
+def _single_slot(model) -> bool:
+    """模型是否经过max_concurrency为1的调度器（如本地Ollama）"""
+    scheduler = getattr(model, "scheduler", None)
+    return scheduler is not None and scheduler.max_concurrency == 1
+
+
+class _PrimaryTiming:
+    """
+    主请求的计时和延迟样本（每次调用最多记录一次）
+    
+    主请求经过调度器时，从获得执行许可开始计时：本地排队时间既不计入对冲延迟，也不计入延迟样本，
+    否则排队时触发的对冲会排进同一个队列，只会加重拥塞。
+    主请求落败被取消（或同步调用中被丢弃）时，记录截至此时的耗时作为下限样本，
+    否则慢请求的样本会系统性缺失，分位数（对冲延迟）被低估。
+    """
+    
+    def __init__(self, policy: HedgePolicy, model: BaseChatModel, acquired):
+        self.policy = policy
+        # acquired为threading.Event或asyncio.Event，获得执行许可或主请求结束时置位
+        self.acquired = acquired
+        self.start: Optional[float] = None
+        self._recorded = False
+        self._lock = threading.Lock()
+        if not isinstance(model, ScheduledChatModel):
+            self.mark_acquired()
+    
+    def mark_acquired(self) -> None:
+        self.start = time.monotonic()
+        self.acquired.set()
+    
+    def remaining(self, delay: float) -> float:
+        """距离发出对冲请求的剩余时间（未获得执行许可就已结束时为0）"""
+        if self.start is None:
+            return 0.0
+        return max(0.0, delay - (time.monotonic() - self.start))
+    
+    def record(self) -> None:
+        with self._lock:
+            if self._recorded or self.start is None:
+                return
+            self._recorded = True
+        self.policy.record_latency(time.monotonic() - self.start)
+
+
+class HedgedChatModel(DelegatingChatModel):
+    """
+    带请求对冲的ChatModel
+    
+    只对冲一次性生成（_generate/_agenerate）；流式调用直接转发，
+    避免两个请求都已开始输出token后重复推送。
+    同步调用无法中断已发出的HTTP请求，落败的请求在后台线程中结束，结果被丢弃；
+    因此主/备模型的调度器max_concurrency为1时，同步调用不做对冲（异步调用可以取消落败的请求，不受影响）。
+    """
+    
+    policy: Any
+    secondary: Optional[BaseChatModel] = None
+    
+    def bind_tools(self, tools, **kwargs: Any):
+        """主、备模型分别转换工具格式（备用Provider的格式可能不同）"""
+        bound_kwargs = dict(getattr(self.inner.bind_tools(tools, **kwargs), "kwargs", {}))
+        if self.secondary is not None:
+            bound_kwargs["secondary_kwargs"] = dict(getattr(self.secondary.bind_tools(tools, **kwargs), "kwargs", {}))
+        return self.bind(**bound_kwargs)
+    
+    def _hedge_target(self, kwargs: Dict[str, Any]):
+        """返回对冲请求使用的模型和参数"""
+        secondary_kwargs = kwargs.pop("secondary_kwargs", None)
+        if self.secondary is None:
+            return self.inner, kwargs
+        return self.secondary, secondary_kwargs if secondary_kwargs is not None else kwargs
+    
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        hedge_model, hedge_kwargs = self._hedge_target(kwargs)
+        timing = _PrimaryTiming(self.policy, self.inner, threading.Event())
+        
+        def call_primary():
+            token = slot_acquired.set(timing.mark_acquired)
+            try:
+                result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            finally:
+                slot_acquired.reset(token)
+                timing.acquired.set()
+            timing.record()
+            return result
+        
+        if _single_slot(self.inner) or _single_slot(hedge_model):
+            # 同步调用中落败的请求无法取消，会一直占用调度器的唯一并发槽，对冲只会加倍负载
+            result = call_primary()
+            self.policy.record_call(False, PRIMARY)
+            return result
+        
+        primary = _start_thread(call_primary)
+        # 主请求在调度器中排队的时间不计入对冲延迟
+        timing.acquired.wait()
+        done, _ = wait([primary], timeout=timing.remaining(self.policy.delay()))
+        if done:
+            self._record_single(primary)
+            return primary.result()
+        
+        hedge = _start_thread(hedge_model._generate, messages, stop=stop, run_manager=run_manager, **hedge_kwargs)
+        attempts = {primary: PRIMARY, hedge: HEDGE}
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if primary in pending:
+                        timing.record()
+                    loser_cancelled = all(other.cancel() for other in pending) if pending else None
+                    self.policy.record_call(True, attempts[future], loser_cancelled)
+                    return future.result()
+                error = error or future.exception()
+        self.policy.record_call(True, None)
+        raise error
+    
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        hedge_model, hedge_kwargs = self._hedge_target(kwargs)
+        timing = _PrimaryTiming(self.policy, self.inner, asyncio.Event())
+        
+        async def call_primary():
+            token = slot_acquired.set(timing.mark_acquired)
+            try:
+                result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            finally:
+                slot_acquired.reset(token)
+                timing.acquired.set()
+            timing.record()
+            return result
+        
+        primary = asyncio.ensure_future(call_primary())
+        try:
+            # 主请求在调度器中排队的时间不计入对冲延迟
+            await timing.acquired.wait()
+            done, _ = await asyncio.wait({primary}, timeout=timing.remaining(self.policy.delay()))
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            self._record_single(primary)
+            return primary.result()
+        
+        hedge = asyncio.ensure_future(
+            hedge_model._agenerate(messages, stop=stop, run_manager=run_manager, **hedge_kwargs)
+        )
+        attempts = {primary: PRIMARY, hedge: HEDGE}
+        pending = set(attempts)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if primary in pending:
+                            timing.record()
+                        for other in pending:
+                            other.cancel()
+                        self.policy.record_call(True, attempts[task], True if pending else None)
+                        return task.result()
+                    error = error or task.exception()
+        except asyncio.CancelledError:
+            # 调用方取消时，两个请求都取消
+            for task in attempts:
+                task.cancel()
+            raise
+        self.policy.record_call(True, None)
+        raise error
+    
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        kwargs.pop("secondary_kwargs", None)
+        yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+    
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        kwargs.pop("secondary_kwargs", None)
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            yield chunk
+    
+    def _record_single(self, primary) -> None:
+        """记录未触发对冲的调用"""
+        self.policy.record_call(False, PRIMARY if primary.exception() is None else None)
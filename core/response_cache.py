@@ -0,0 +1,234 @@
+"""
+Agent响应缓存 - 内存LRU + SQLite磁盘两级缓存，避免重复问题重复支付LLM延迟和费用
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from core.config_snapshot import config_store
+
+
+class ResponseCache:
+    """
+    响应缓存
+    
+    - 内存层：OrderedDict实现的LRU，命中时无I/O
+    - 磁盘层：SQLite，进程重启后仍然有效，内存未命中时回源并提升到内存层
+    - 每条记录带过期时间，支持按Agent设置TTL、按Agent清空
+    """
+    
+    def __init__(self, cache_config: Dict[str, Any] = None):
+        """
+        初始化响应缓存
+        
+        Args:
+            cache_config: 缓存配置，默认读取当前配置快照的"response_cache"配置节
+        """
+        self._config = cache_config
+        self._memory: "OrderedDict[str, Tuple[str, Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+        # 按Agent统计: {agent_name: {"hits": n, "memory_hits": n, "disk_hits": n, "misses": n, "stores": n}}
+        self._stats: Dict[str, Dict[str, int]] = {}
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("response_cache")
+    
+    def is_enabled(self) -> bool:
+        return self._get_config().get("enable", False)
+    
+    @staticmethod
+    def make_key(
+        agent_name: str,
+        model_type: str,
+        model_config: Dict[str, Any],
+        agent_version: str,
+        user_input: str,
+        extra: Dict[str, Any] = None
+    ) -> str:
+        """
+        计算缓存key
+        
+        只取影响输出的模型参数（model、temperature、base_url），API Key等不参与计算。
+        """
+        payload = {
+            "agent": agent_name,
+            "provider": model_type,
+            "model": model_config.get("model"),
+            "temperature": model_config.get("temperature"),
+            "base_url": model_config.get("base_url"),
+            "agent_version": agent_version,
+            "input": user_input,
+            "extra": extra or {},
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _get_conn(self) -> Optional[sqlite3.Connection]:
+        """懒加载SQLite连接（未配置db_path时只使用内存层）"""
+        if self._conn is None:
+            db_path = self._get_config().get("db_path")
+            if not db_path:
+                return None
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " agent_name TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_agent ON responses (agent_name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    def _agent_stats(self, agent_name: str) -> Dict[str, int]:
+        if agent_name not in self._stats:
+            self._stats[agent_name] = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        return self._stats[agent_name]
+    
+    def get(self, key: str, agent_name: str) -> Optional[Dict[str, Any]]:
+        """读取缓存（先内存后磁盘），未命中或已过期返回None"""
+        now = time.time()
+        with self._lock:
+            stats = self._agent_stats(agent_name)
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._memory.move_to_end(key)
+                    stats["hits"] += 1
+                    stats["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+            
+            conn = self._get_conn()
+            if conn is not None:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        value = json.loads(row[0])
+                        self._put_memory_locked(key, agent_name, value, row[1])
+                        stats["hits"] += 1
+                        stats["disk_hits"] += 1
+                        return value
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+            
+            stats["misses"] += 1
+            return None
+    
+    def set(self, key: str, agent_name: str, value: Dict[str, Any], ttl: float = None) -> None:
+        """写入缓存（同时写入内存层和磁盘层）"""
+        ttl = ttl if ttl is not None else self._get_config().get("ttl", 3600)
+        if ttl <= 0:
+            return
+        now = time.time()
+        expires_at = now + ttl
+        with self._lock:
+            self._put_memory_locked(key, agent_name, value, expires_at)
+            self._agent_stats(agent_name)["stores"] += 1
+            
+            conn = self._get_conn()
+            if conn is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, agent_name, value, created_at, expires_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, agent_name, json.dumps(value, ensure_ascii=False), now, expires_at)
+                )
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= 100:
+                    # 定期清理已过期的磁盘记录
+                    conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                    self._writes_since_prune = 0
+                conn.commit()
+    
+    def _put_memory_locked(self, key: str, agent_name: str, value: Dict[str, Any], expires_at: float) -> None:
+        """写入内存层并按LRU淘汰（调用方需持有锁）"""
+        self._memory[key] = (agent_name, value, expires_at)
+        self._memory.move_to_end(key)
+        max_entries = self._get_config().get("max_memory_entries", 256)
+        while len(self._memory) > max_entries:
+            self._memory.popitem(last=False)
+    
+    def flush(self, agent_name: str = None) -> int:
+        """
+        清空缓存
+        
+        Args:
+            agent_name: 只清空指定Agent的缓存，为None时清空全部
+        
+        Returns:
+            清除的记录数（内存层与磁盘层去重后的近似值）
+        """
+        with self._lock:
+            if agent_name is None:
+                keys = list(self._memory.keys())
+            else:
+                keys = [k for k, entry in self._memory.items() if entry[0] == agent_name]
+            for key in keys:
+                del self._memory[key]
+            removed = len(keys)
+            
+            conn = self._get_conn()
+            if conn is not None:
+                if agent_name is None:
+                    cursor = conn.execute("DELETE FROM responses")
+                else:
+                    cursor = conn.execute("DELETE FROM responses WHERE agent_name = ?", (agent_name,))
+                conn.commit()
+                removed = max(removed, cursor.rowcount)
+            
+            if agent_name is None:
+                self._stats.clear()
+            else:
+                self._stats.pop(agent_name, None)
+            return removed
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（按Agent的命中率、内存/磁盘条目数）"""
+        with self._lock:
+            agents = {}
+            total_hits = total_misses = 0
+            for agent_name, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                agents[agent_name] = {
+                    **stats,
+                    "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+                }
+                total_hits += stats["hits"]
+                total_misses += stats["misses"]
+            
+            disk_entries = 0
+            conn = self._get_conn()
+            if conn is not None:
+                disk_entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            
+            total = total_hits + total_misses
+            return {
+                "enabled": self.is_enabled(),
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "hits": total_hits,
+                "misses": total_misses,
+                "hit_rate": round(total_hits / total, 4) if total else 0.0,
+                "agents": agents,
+            }
+
+
+response_cache = ResponseCache()
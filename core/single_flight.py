@@ -0,0 +1,124 @@
+"""
+请求合并（Single-Flight） - 相同的并发请求只执行一次，共享执行结果
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+# leader被取消时作为结果交给等待者，通知其重新执行
+_RETRY = object()
+
+
+class _Call:
+    """一次进行中的执行"""
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Single-Flight请求合并
+    
+    同一个key在执行期间到达的其他请求不会重复执行，而是等待首个请求（leader）
+    完成后直接共享其结果或异常。执行结束后key立即释放，不做结果缓存。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[str, "asyncio.Future"] = {}
+        self._executions = 0
+        self._coalesced = 0
+    
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        执行fn，相同key的并发调用共享同一次执行
+        
+        Returns:
+            (结果, 是否为共享结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._executions += 1
+                leader = True
+        
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+    
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        do()的异步版本，相同key的并发协程共享同一次执行
+        
+        leader被取消（如ASGI客户端断开）时不把取消传给其他请求，
+        等待者被唤醒后重新竞争，其中一个成为新的leader重新执行fn。
+        """
+        while True:
+            with self._lock:
+                future = self._async_calls.get(key)
+                if future is not None:
+                    self._coalesced += 1
+                    leader = False
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    self._async_calls[key] = future
+                    self._executions += 1
+                    leader = True
+            
+            if not leader:
+                # shield: 某个等待者被取消时不影响leader和其他等待者
+                result = await asyncio.shield(future)
+                if result is _RETRY:
+                    with self._lock:
+                        self._coalesced -= 1
+                    continue
+                return result, True
+            
+            try:
+                result = await fn()
+                future.set_result(result)
+                return result, False
+            except asyncio.CancelledError:
+                future.set_result(_RETRY)
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # 没有等待者时避免"exception was never retrieved"警告
+                future.exception()
+                raise
+            finally:
+                with self._lock:
+                    del self._async_calls[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        with self._lock:
+            total = self._executions + self._coalesced
+            return {
+                "executions": self._executions,
+                "coalesced_requests": self._coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls),
+                "coalesce_ratio": round(self._coalesced / total, 4) if total else 0.0,
+            }
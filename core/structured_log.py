@@ -0,0 +1,79 @@
+"""
+结构化交互日志 - 每个事件一行JSON（JSONL），由后台写入器追加到logging.jsonl_file
+
+每个事件都包含ts、event、run_id、parent_run_id，以及事件自己的字段：
+- llm_start：model、message_count、message_offset、messages（只含本会话中新增的消息；系统提示词只在第一次出现时记录内容，之后只有content_hash）
+- llm_end：model、duration_ms、input_tokens、output_tokens、cached_tokens、content、tool_calls
+- llm_error / tool_error：duration_ms、error_type、error
+- tool_start / tool_end：tool、input、duration_ms、output
+- agent_action / agent_finish / reflection
+
+内容按max_content_chars截断（记录原始长度）。可用 python -m core.log_renderer 渲染为易读文本。
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from core.log_writer import log_writer
+
+_ROLES = {
+    "SystemMessage": "system",
+    "HumanMessage": "human",
+    "AIMessage": "ai",
+    "AIMessageChunk": "ai",
+    "ToolMessage": "tool",
+}
+
+
+def truncate(value: Any, limit: int) -> Any:
+    """截断过长的文本（limit为0时不截断），非字符串转为字符串"""
+    if value is None:
+        return None
+    text = value if isinstance(value, str) else str(value)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...(共{len(text)}字符)"
+    return text
+
+
+def flatten_messages(messages: List) -> List:
+    """on_chat_model_start收到的是按批次分组的消息列表（List[List[BaseMessage]]），展开为一维"""
+    if messages and isinstance(messages[0], (list, tuple)):
+        return [message for batch in messages for message in batch]
+    return list(messages or [])
+
+
+def message_to_dict(message: Any, limit: int) -> Dict[str, Any]:
+    """把LangChain消息转换为可序列化的字典"""
+    entry = {
+        "role": _ROLES.get(type(message).__name__, type(message).__name__),
+        "content": truncate(getattr(message, "content", message), limit),
+    }
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        entry["tool_calls"] = [
+            {"name": call.get("name"), "args": call.get("args")} for call in tool_calls
+        ]
+    name = getattr(message, "name", None)
+    if name:
+        entry["name"] = name
+    return entry
+
+
+def build_event(event: str, run_id: Any = None, parent_run_id: Any = None, **fields) -> Dict[str, Any]:
+    """构造一个事件（值为None的字段不输出）"""
+    record = {
+        "ts": datetime.now().isoformat(timespec="milliseconds"),
+        "event": event,
+        "run_id": str(run_id) if run_id is not None else None,
+        "parent_run_id": str(parent_run_id) if parent_run_id is not None else None,
+    }
+    record.update((key, value) for key, value in fields.items() if value is not None)
+    return record
+
+
+def write_event(path: str, event: Dict[str, Any]) -> bool:
+    """把事件序列化为一行JSON交给后台写入器"""
+    return log_writer.write(path, json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+
+def duration_ms(started: Optional[float], ended: float) -> Optional[float]:
+    return round((ended - started) * 1000, 1) if started is not None else None
@@ -0,0 +1,549 @@
+"""
+运行记录存储 - 把每次Agent执行的摘要写入本地SQLite，供 /api/traces 查询
+
+- TraceCallbackHandler从LangChain回调中汇总一次执行（根run）的耗时、LLM/工具调用次数、Token数和错误，
+  根run结束时交给trace_store
+- 写入由后台线程批量完成（一个事务写入多条），请求线程只把记录放入队列
+- 按run_id、Agent、模型、开始时间、耗时、Token数和错误类型建立索引，可查询最慢的执行、出错的执行和按Agent的汇总
+- 定期清理超过retention_days的记录和超出max_runs的最旧记录，并回收数据库文件空间
+"""
+import asyncio
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+from core.config_snapshot import config_store
+
+_STOP = object()
+
+_COLUMNS = (
+    "run_id", "agent", "model", "model_type", "status", "started_at", "duration_ms",
+    "llm_calls", "tool_calls", "input_tokens", "output_tokens", "total_tokens", "error_class", "error",
+)
+
+# 列表查询支持的排序方式
+_ORDER_BY = {
+    "time": "started_at DESC",
+    "duration": "duration_ms DESC",
+    "tokens": "total_tokens DESC",
+}
+
+# 执行被提前结束（客户端断开、流式提前停止）时的异常，不算作出错
+_CANCEL_ERRORS = (GeneratorExit, asyncio.CancelledError)
+
+
+class TraceStore:
+    """基于SQLite的运行记录存储"""
+    
+    def __init__(self, store_config: Dict[str, Any] = None):
+        """
+        初始化存储（数据库在第一次使用时打开，写线程在第一次写入时启动）
+        
+        Args:
+            store_config: 存储配置，默认读取当前配置快照的"trace_store"配置节
+        """
+        self._config = store_config
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._last_compact = time.monotonic()
+        self._stats = {"recorded": 0, "dropped": 0, "errors": 0, "compactions": 0, "deleted": 0}
+        self._atexit_registered = False
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("trace_store")
+    
+    def is_enabled(self) -> bool:
+        store_config = self._get_config()
+        return store_config.get("enable", True) and bool(store_config.get("db_path"))
+    
+    def _get_conn(self) -> sqlite3.Connection:
+        """懒加载SQLite连接（调用方需持有锁）"""
+        if self._conn is None:
+            db_path = self._get_config().get("db_path")
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            # 必须在建表之前设置，之后删除的页可以用incremental_vacuum归还给文件系统
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " agent TEXT,"
+                " model TEXT,"
+                " model_type TEXT,"
+                " status TEXT NOT NULL,"
+                " started_at REAL NOT NULL,"
+                " duration_ms REAL NOT NULL,"
+                " llm_calls INTEGER NOT NULL DEFAULT 0,"
+                " tool_calls INTEGER NOT NULL DEFAULT 0,"
+                " input_tokens INTEGER NOT NULL DEFAULT 0,"
+                " output_tokens INTEGER NOT NULL DEFAULT 0,"
+                " total_tokens INTEGER NOT NULL DEFAULT 0,"
+                " error_class TEXT,"
+                " error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_started ON runs (started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_agent ON runs (agent, started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_model ON runs (model, started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_duration ON runs (duration_ms)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_tokens ON runs (total_tokens)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_error ON runs (status, error_class, started_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    def _ensure_started(self) -> queue.Queue:
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._queue = queue.Queue(maxsize=self._get_config().get("max_queue_size", 10000))
+                    self._thread = threading.Thread(target=self._run, name="trace-store", daemon=True)
+                    self._thread.start()
+                    if not self._atexit_registered:
+                        atexit.register(self.close)
+                        self._atexit_registered = True
+        return self._queue
+    
+    def record(self, run: Dict[str, Any]) -> bool:
+        """
+        提交一条执行记录（字段见_COLUMNS，缺少的字段按空值/0写入）
+        
+        Returns:
+            是否已放入队列（未启用或队列满被丢弃时返回False）
+        """
+        if not self.is_enabled():
+            return False
+        try:
+            self._ensure_started().put_nowait(run)
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return False
+        return True
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待已提交的记录全部写入（用于测试、基准测试和退出前）"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+    
+    def close(self, timeout: float = 5.0) -> None:
+        """写完队列中的记录后停止写线程"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+    
+    def _run(self) -> None:
+        run_queue = self._queue
+        while True:
+            try:
+                # 没有新记录时也按compact_interval清理过期记录
+                item = run_queue.get(timeout=self._get_config().get("compact_interval", 300) or None)
+            except queue.Empty:
+                self._maybe_compact()
+                continue
+            batch: List[Dict[str, Any]] = []
+            waiters: List[threading.Event] = []
+            stop = False
+            # 取出队列中已有的记录，一个事务写入
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self._get_config().get("batch_size", 200):
+                    break
+                try:
+                    item = run_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+            self._maybe_compact()
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+    
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        rows = [
+            tuple(run.get(column, 0 if column.endswith(("_calls", "_tokens")) else None) for column in _COLUMNS)
+            for run in batch
+        ]
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO runs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    rows
+                )
+                conn.commit()
+            self._stats["recorded"] += len(rows)
+        except sqlite3.Error as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ 写入运行记录失败: {e}")
+    
+    def _maybe_compact(self) -> None:
+        interval = self._get_config().get("compact_interval", 300)
+        if interval and time.monotonic() - self._last_compact >= interval:
+            self.compact()
+    
+    def compact(self) -> Dict[str, int]:
+        """
+        清理并压缩存储
+        
+        删除早于retention_days的记录和超出max_runs的最旧记录，归还空闲页并截断WAL文件。
+        
+        Returns:
+            {"expired": 过期删除数, "overflow": 超量删除数}
+        """
+        store_config = self._get_config()
+        self._last_compact = time.monotonic()
+        result = {"expired": 0, "overflow": 0}
+        if not self.is_enabled():
+            return result
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                retention_days = store_config.get("retention_days", 7)
+                if retention_days:
+                    cursor = conn.execute(
+                        "DELETE FROM runs WHERE started_at < ?", (time.time() - retention_days * 86400,)
+                    )
+                    result["expired"] = cursor.rowcount
+                max_runs = store_config.get("max_runs", 100000)
+                if max_runs:
+                    # 按开始时间保留最新的max_runs条（OFFSET定位到第max_runs+1新的记录）
+                    row = conn.execute(
+                        "SELECT started_at FROM runs ORDER BY started_at DESC LIMIT 1 OFFSET ?", (max_runs,)
+                    ).fetchone()
+                    if row is not None:
+                        cursor = conn.execute("DELETE FROM runs WHERE started_at <= ?", (row[0],))
+                        result["overflow"] = cursor.rowcount
+                conn.commit()
+                if result["expired"] or result["overflow"]:
+                    conn.execute("PRAGMA incremental_vacuum")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ 压缩运行记录失败: {e}")
+            return result
+        self._stats["compactions"] += 1
+        self._stats["deleted"] += result["expired"] + result["overflow"]
+        return result
+    
+    @staticmethod
+    def _where(filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """把查询条件转换为WHERE子句（值为None的条件忽略）"""
+        clauses, params = [], []
+        for column in ("agent", "model", "status", "error_class"):
+            if filters.get(column) is not None:
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("since") is not None:
+            clauses.append("started_at >= ?")
+            params.append(float(filters["since"]))
+        if filters.get("until") is not None:
+            clauses.append("started_at < ?")
+            params.append(float(filters["until"]))
+        if filters.get("min_duration_ms") is not None:
+            clauses.append("duration_ms >= ?")
+            params.append(float(filters["min_duration_ms"]))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+    
+    def query(self, sort: str = "time", limit: int = 50, offset: int = 0, **filters) -> Dict[str, Any]:
+        """
+        分页查询执行记录
+        
+        Args:
+            sort: 排序方式："time"最新优先，"duration"最慢优先，"tokens"Token最多优先
+            limit: 每页条数（不超过配置的max_page_size）
+            offset: 跳过的条数
+            **filters: agent、model、status、error_class、since/until（Unix时间戳）、min_duration_ms
+        
+        Returns:
+            {"runs": [...], "total": 符合条件的总数, "limit", "offset", "next_offset": 下一页的offset（没有下一页时为None）}
+        """
+        if sort not in _ORDER_BY:
+            raise ValueError(f"不支持的排序方式: {sort}，可选: {', '.join(_ORDER_BY)}")
+        limit = max(1, min(int(limit), self._get_config().get("max_page_size", 500)))
+        offset = max(0, int(offset))
+        where, params = self._where(filters)
+        if not self.is_enabled():
+            return {"runs": [], "total": 0, "limit": limit, "offset": offset, "next_offset": None}
+        with self._lock:
+            conn = self._get_conn()
+            total = conn.execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM runs{where} ORDER BY {_ORDER_BY[sort]} LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return {
+            "runs": [dict(zip(_COLUMNS, row)) for row in rows],
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if offset + limit < total else None,
+        }
+    
+    def slowest(self, limit: int = 50, offset: int = 0, **filters) -> Dict[str, Any]:
+        """耗时最长的执行"""
+        return self.query("duration", limit, offset, **filters)
+    
+    def errors(self, limit: int = 50, offset: int = 0, **filters) -> Dict[str, Any]:
+        """出错的执行（最新优先）"""
+        return self.query("time", limit, offset, **{**filters, "status": "error"})
+    
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        if not self.is_enabled():
+            return None
+        with self._lock:
+            row = self._get_conn().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row is not None else None
+    
+    def aggregates(self, limit: int = 50, offset: int = 0, **filters) -> Dict[str, Any]:
+        """
+        按Agent汇总（执行数、出错数、平均/P95/最大耗时、Token总数），按执行数从多到少分页
+        
+        P95按每个Agent在耗时索引上定位，不需要把所有记录读到内存。
+        """
+        limit = max(1, min(int(limit), self._get_config().get("max_page_size", 500)))
+        offset = max(0, int(offset))
+        where, params = self._where(filters)
+        if not self.is_enabled():
+            return {"agents": [], "total": 0, "limit": limit, "offset": offset, "next_offset": None}
+        with self._lock:
+            conn = self._get_conn()
+            # COUNT(DISTINCT agent)不计NULL，而GROUP BY agent会返回NULL分组，按分组数计算
+            total = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM runs{where} GROUP BY agent)", params).fetchone()[0]
+            rows = conn.execute(
+                "SELECT agent, COUNT(*), SUM(status = 'error'), AVG(duration_ms), MAX(duration_ms),"
+                " SUM(input_tokens), SUM(output_tokens), SUM(llm_calls), SUM(tool_calls), MAX(started_at)"
+                f" FROM runs{where} GROUP BY agent ORDER BY COUNT(*) DESC, agent LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+            agents = []
+            # agent可能为NULL（没有Agent信息的执行），用IS比较
+            other_where, other_params = self._where({**filters, "agent": None})
+            agent_where = f"{other_where} AND agent IS ?" if other_where else " WHERE agent IS ?"
+            for agent, count, errors, avg_ms, max_ms, input_tokens, output_tokens, llm_calls, tool_calls, last_run in rows:
+                p95 = conn.execute(
+                    f"SELECT duration_ms FROM runs{agent_where} ORDER BY duration_ms LIMIT 1 OFFSET ?",
+                    other_params + [agent, min(count - 1, int(count * 0.95))]
+                ).fetchone()
+                agents.append({
+                    "agent": agent,
+                    "runs": count,
+                    "errors": errors or 0,
+                    "error_rate": round((errors or 0) / count, 4) if count else 0.0,
+                    "avg_duration_ms": round(avg_ms or 0, 1),
+                    "p95_duration_ms": p95[0] if p95 else None,
+                    "max_duration_ms": max_ms,
+                    "input_tokens": input_tokens or 0,
+                    "output_tokens": output_tokens or 0,
+                    "llm_calls": llm_calls or 0,
+                    "tool_calls": tool_calls or 0,
+                    "last_run_at": last_run,
+                })
+        return {
+            "agents": agents,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if offset + limit < total else None,
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        store_config = self._get_config()
+        result = {
+            "enabled": self.is_enabled(),
+            "db_path": store_config.get("db_path"),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            **self._stats,
+        }
+        if result["enabled"]:
+            try:
+                with self._lock:
+                    result["runs"] = self._get_conn().execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+                result["db_bytes"] = os.path.getsize(store_config["db_path"])
+            except (sqlite3.Error, OSError):
+                pass
+        return result
+
+
+trace_store = TraceStore()
+
+
+def _model_name(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> Optional[str]:
+    """从回调参数中取模型名称"""
+    model_kwargs = (serialized or {}).get("kwargs") or {}
+    params = kwargs.get("invocation_params") or {}
+    return model_kwargs.get("model") or model_kwargs.get("model_name") or params.get("model") or params.get("model_name")
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    汇总每次执行（没有父run的链）的摘要，执行结束时写入trace_store
+    
+    子run通过parent_run_id找到所属的根run，按run_id区分，可在请求间共享（AgentService使用同一个实例）。
+    Agent名称和Provider取自执行config中的metadata（BaseAgent写入的agent_name、model_type）。
+    """
+    
+    def __init__(self, store: TraceStore = None):
+        super().__init__()
+        self._store = store or trace_store
+        self._lock = threading.Lock()
+        self._runs: Dict[Any, Dict[str, Any]] = {}  # 根run_id -> 执行摘要
+        self._roots: Dict[Any, Any] = {}  # run_id -> 根run_id
+    
+    def _record_for(self, run_id: Any, parent_run_id: Any) -> Optional[Dict[str, Any]]:
+        """登记子run并返回其所属执行的摘要（不属于任何正在记录的执行时返回None，调用方需持有锁）"""
+        root = self._roots.get(parent_run_id)
+        if root is None:
+            return None
+        self._roots[run_id] = root
+        return self._runs.get(root)
+    
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Any, **kwargs: Any) -> None:
+        run_id, parent_run_id = kwargs.get("run_id"), kwargs.get("parent_run_id")
+        metadata = kwargs.get("metadata") or {}
+        with self._lock:
+            if parent_run_id is None:
+                if not self._store.is_enabled():
+                    return
+                self._roots[run_id] = run_id
+                record = self._runs[run_id] = {
+                    "run_id": str(run_id),
+                    "started_at": time.time(),
+                    "perf_started": time.perf_counter(),
+                    "llm_calls": 0,
+                    "tool_calls": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                }
+            else:
+                record = self._record_for(run_id, parent_run_id)
+            # 外层（如反思图）没有Agent信息时，取第一个带metadata的子run
+            if record is not None and record.get("agent") is None and metadata.get("agent_name"):
+                record["agent"] = metadata.get("agent_name")
+                record["model_type"] = metadata.get("model_type")
+    
+    def _on_model_start(self, serialized: Dict[str, Any], kwargs: Dict[str, Any]) -> None:
+        with self._lock:
+            record = self._record_for(kwargs.get("run_id"), kwargs.get("parent_run_id"))
+            if record is not None:
+                record["llm_calls"] += 1
+                if record.get("model") is None:
+                    record["model"] = _model_name(serialized, kwargs)
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, **kwargs: Any) -> None:
+        self._on_model_start(serialized, kwargs)
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._on_model_start(serialized, kwargs)
+    
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        input_tokens = output_tokens = 0
+        model = None
+        for generations in getattr(response, "generations", None) or []:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0) or 0
+                output_tokens += usage.get("output_tokens", 0) or 0
+                model = model or (getattr(message, "response_metadata", None) or {}).get("model_name")
+        with self._lock:
+            record = self._runs.get(self._roots.pop(kwargs.get("run_id"), None))
+            if record is not None:
+                record["input_tokens"] += input_tokens
+                record["output_tokens"] += output_tokens
+                if model and record.get("model") is None:
+                    record["model"] = model
+    
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._child_error(kwargs.get("run_id"), error)
+    
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        with self._lock:
+            record = self._record_for(kwargs.get("run_id"), kwargs.get("parent_run_id"))
+            if record is not None:
+                record["tool_calls"] += 1
+    
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        with self._lock:
+            self._roots.pop(kwargs.get("run_id"), None)
+    
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._child_error(kwargs.get("run_id"), error)
+    
+    def on_chain_end(self, outputs: Any, **kwargs: Any) -> None:
+        run_id = kwargs.get("run_id")
+        if kwargs.get("parent_run_id") is None:
+            self._finish(run_id)
+        else:
+            with self._lock:
+                self._roots.pop(run_id, None)
+    
+    def on_chain_error(self, error: BaseException, **kwargs: Any) -> None:
+        run_id = kwargs.get("run_id")
+        if kwargs.get("parent_run_id") is None:
+            self._finish(run_id, error)
+        else:
+            self._child_error(run_id, error)
+    
+    def _child_error(self, run_id: Any, error: BaseException) -> None:
+        """记录执行中第一个错误（被重试或回退掩盖的错误也保留，便于排查）"""
+        with self._lock:
+            record = self._runs.get(self._roots.pop(run_id, None))
+            if record is not None and record.get("error_class") is None and not isinstance(error, _CANCEL_ERRORS):
+                record["error_class"] = type(error).__name__
+                record["error"] = str(error)[:1000]
+    
+    def _finish(self, run_id: Any, error: BaseException = None) -> None:
+        with self._lock:
+            record = self._runs.pop(run_id, None)
+            self._roots.pop(run_id, None)
+            if record is None:
+                return
+            # 清理没有收到结束回调的子run（如被取消的工具调用）
+            for child in [child for child, root in self._roots.items() if root == run_id]:
+                del self._roots[child]
+        record["duration_ms"] = round((time.perf_counter() - record.pop("perf_started")) * 1000, 1)
+        if error is None:
+            record["status"] = "success"
+        elif isinstance(error, _CANCEL_ERRORS):
+            record["status"] = "cancelled"
+        else:
+            record["status"] = "error"
+            record["error_class"] = type(error).__name__
+            record["error"] = str(error)[:1000]
+        record["total_tokens"] = record["input_tokens"] + record["output_tokens"]
+        self._store.record(record)
+
+
+trace_callback = TraceCallbackHandler()
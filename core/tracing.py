@@ -0,0 +1,346 @@
+"""
+请求链路追踪 - 记录一次请求内各阶段的嵌套耗时（span）
+
+- 显式span：AgentService（创建Agent、编译执行器、响应缓存）、StrategyManager、ReflectionGraph的各节点
+- 回调span：每次LLM调用和工具调用，由TracingCallbackHandler记录
+- 计时使用单调时钟（time.perf_counter_ns），导出时换算为Unix纳秒时间戳
+- 请求结束后以OTLP JSON格式（每行一个ExportTraceServiceRequest）交给后台日志写入器追加到本地文件，
+  并可生成Server-Timing响应头
+
+当前span保存在contextvars中，线程池（asyncio.to_thread、对冲线程）和LangChain回调都会继承；
+没有进行中的追踪时，span()和回调不做任何记录。
+"""
+import contextvars
+import functools
+import json
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from core.config_snapshot import config_store
+from core.log_writer import log_writer
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一个计时区间"""
+    
+    __slots__ = ("trace", "name", "span_id", "parent", "start_ns", "end_ns", "attributes", "error")
+    
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"] = None, attributes: Dict[str, Any] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.error: Optional[str] = None
+    
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+    
+    def end(self, error: BaseException = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.perf_counter_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace._add(self)
+    
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.perf_counter_ns()
+        return (end_ns - self.start_ns) / 1e6
+    
+    @property
+    def depth(self) -> int:
+        depth, parent = 0, self.parent
+        while parent is not None:
+            depth, parent = depth + 1, parent.parent
+        return depth
+
+
+class Trace:
+    """一次请求的所有span（根span结束时导出）"""
+    
+    def __init__(self, name: str, attributes: Dict[str, Any] = None):
+        self.trace_id = secrets.token_hex(16)
+        # 单调时钟与墙上时钟的对应关系，用于导出Unix时间戳
+        self._wall_anchor_ns = time.time_ns()
+        self._mono_anchor_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._spans: List[Span] = []
+        self.root = Span(self, name, None, attributes)
+    
+    def _add(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+    
+    def spans(self) -> List[Span]:
+        """已结束的span（按开始时间排序）"""
+        with self._lock:
+            return sorted(self._spans, key=lambda span: span.start_ns)
+    
+    def _unix_ns(self, mono_ns: int) -> int:
+        return self._wall_anchor_ns + (mono_ns - self._mono_anchor_ns)
+    
+    def timings(self) -> Dict[str, Any]:
+        """各span相对请求开始的时间（用于接口响应中的timings）"""
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(self.root.duration_ms, 1),
+            "spans": [
+                {
+                    "name": span.name,
+                    "start_ms": round((span.start_ns - self.root.start_ns) / 1e6, 1),
+                    "duration_ms": round(span.duration_ms, 1),
+                    "depth": span.depth,
+                    **({"error": span.error} if span.error else {}),
+                }
+                for span in self.spans() if span is not self.root
+            ],
+        }
+    
+    def server_timing(self) -> str:
+        """
+        生成Server-Timing响应头：按span名称汇总耗时，另加total
+        
+        例如：agent_factory.create_agent;dur=35.2, llm;desc="llm x2";dur=812.4, total;dur=860.1
+        """
+        totals: Dict[str, List[float]] = {}
+        for span in self.spans():
+            if span is self.root:
+                continue
+            totals.setdefault(span.name, []).append(span.duration_ms)
+        entries = []
+        for name, durations in totals.items():
+            metric = re.sub(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]", "_", name)
+            desc = f';desc="{metric} x{len(durations)}"' if len(durations) > 1 else ""
+            entries.append(f"{metric}{desc};dur={sum(durations):.1f}")
+        entries.append(f"total;dur={self.root.duration_ms:.1f}")
+        return ", ".join(entries)
+    
+    def to_otlp(self, service_name: str) -> Dict[str, Any]:
+        """转换为OTLP JSON（ExportTraceServiceRequest）"""
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "core.tracing"},
+                    "spans": [self._otlp_span(span) for span in self.spans()],
+                }],
+            }]
+        }
+    
+    def _otlp_span(self, span: Span) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self._unix_ns(span.start_ns)),
+            "endTimeUnixNano": str(self._unix_ns(span.end_ns)),
+            "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items() if value is not None],
+            # STATUS_CODE_OK = 1, STATUS_CODE_ERROR = 2
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent is not None:
+            data["parentSpanId"] = span.parent.span_id
+        return data
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    """
+    追踪器
+    
+    start_trace()开始一次追踪（已有进行中的追踪时作为子span），span()在当前追踪中记录子区间。
+    """
+    
+    def __init__(self, tracing_config: Dict[str, Any] = None):
+        """
+        初始化追踪器
+        
+        Args:
+            tracing_config: 追踪配置，默认读取当前配置快照的"tracing"配置节
+        """
+        self._config = tracing_config
+        self._exported = 0
+        self._export_errors = 0
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("tracing")
+    
+    def is_enabled(self) -> bool:
+        return self._get_config().get("enable", True)
+    
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+    
+    def current_trace(self) -> Optional[Trace]:
+        span = _current_span.get()
+        return span.trace if span is not None else None
+    
+    @contextmanager
+    def start_trace(self, name: str, **attributes) -> Iterator[Optional[Trace]]:
+        """
+        开始一次追踪，结束时导出
+        
+        已有进行中的追踪时（如接口层已开始追踪），只作为其中的子span；追踪未启用时返回None。
+        """
+        if _current_span.get() is not None:
+            with self.span(name, **attributes):
+                yield self.current_trace()
+            return
+        if not self.is_enabled():
+            yield None
+            return
+        
+        trace = Trace(name, attributes)
+        token = _current_span.set(trace.root)
+        error = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            trace.root.end(error)
+            self._export(trace)
+    
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """在当前追踪中记录一个子span（没有进行中的追踪时不记录，返回None）"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace, name, parent, attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end(error)
+    
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """把同步函数的每次调用记录为一个span"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    def awrap(self, name: str, func: Callable) -> Callable:
+        """把异步函数的每次调用记录为一个span"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with self.span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    
+    def _export(self, trace: Trace) -> None:
+        """以OTLP JSON格式交给后台日志写入器追加到导出文件（export_path为空时不导出），请求线程不做文件I/O"""
+        tracing_config = self._get_config()
+        export_path = tracing_config.get("export_path")
+        if not export_path:
+            return
+        line = json.dumps(
+            trace.to_otlp(tracing_config.get("service_name", "langchain-agent")),
+            ensure_ascii=False, separators=(",", ":")
+        )
+        if log_writer.write(export_path, line + "\n"):
+            self._exported += 1
+        else:
+            # 写入队列已满，本次追踪被丢弃
+            self._export_errors += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        tracing_config = self._get_config()
+        return {
+            "enabled": tracing_config.get("enable", True),
+            "export_path": tracing_config.get("export_path"),
+            "exported": self._exported,
+            "export_errors": self._export_errors,
+        }
+
+
+tracer = Tracer()
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """把LLM调用和工具调用记录为当前追踪中的span（按run_id对应开始和结束，可在请求间共享）"""
+    
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._spans: Dict[Any, Span] = {}
+    
+    def _start(self, run_id: Any, name: str, **attributes) -> None:
+        parent = _current_span.get()
+        if parent is None:
+            return
+        with self._lock:
+            self._spans[run_id] = Span(parent.trace, name, parent, attributes)
+    
+    def _end(self, run_id: Any, error: BaseException = None, **attributes) -> None:
+        with self._lock:
+            span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        span.attributes.update(attributes)
+        span.end(error)
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, **kwargs: Any) -> None:
+        model_kwargs = (serialized or {}).get("kwargs") or {}
+        self._start(kwargs.get("run_id"), "llm", model=model_kwargs.get("model") or model_kwargs.get("model_name"))
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        model_kwargs = (serialized or {}).get("kwargs") or {}
+        self._start(kwargs.get("run_id"), "llm", model=model_kwargs.get("model") or model_kwargs.get("model_name"))
+    
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        input_tokens = output_tokens = 0
+        for generations in getattr(response, "generations", None) or []:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0) or 0
+                output_tokens += usage.get("output_tokens", 0) or 0
+        self._end(kwargs.get("run_id"), input_tokens=input_tokens, output_tokens=output_tokens)
+    
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._end(kwargs.get("run_id"), error)
+    
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        tool_name = (serialized or {}).get("name", "unknown") if isinstance(serialized, dict) else "unknown"
+        self._start(kwargs.get("run_id"), f"tool.{tool_name}")
+    
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self._end(kwargs.get("run_id"))
+    
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._end(kwargs.get("run_id"), error)
+
+
+tracing_callback = TracingCallbackHandler()
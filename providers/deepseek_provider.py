@@ -4,12 +4,15 @@ DeepSeek模型提供者实现
 """
 from langchain_openai import ChatOpenAI
 from core.model_provider import ModelProvider
+from core.http_pools import http_pools
 from typing import Any, Dict
 import os
 
 class DeepSeekProvider(ModelProvider):
     """DeepSeek模型提供者（支持官方API和硅基流动）"""
     
+    default_limits = {"max_concurrency": 8, "requests_per_minute": 60}
+    
     def get_llm(self, config: Dict[str, Any]) -> ChatOpenAI:
         """
         创建DeepSeek LLM实例
@@ -59,6 +62,8 @@ class DeepSeekProvider(ModelProvider):
         # - API密钥不要提交到代码仓库
         # - 硅基流动支持中文，无需VPN（国内可用）
         # ====================================
+        # 所有实例共享同一个连接池，重建Agent时复用已建立的keep-alive连接
+        pool = http_pools.get("deepseek", config.get("http_pool", {}))
         return ChatOpenAI(
             model=model,
             api_key=api_key,
@@ -66,10 +71,26 @@ class DeepSeekProvider(ModelProvider):
             temperature=config.get("temperature", 0.7),
             timeout=30,  # 30秒超时
             max_retries=2,  # 最多重试2次
+            http_client=pool.client(),
+            http_async_client=pool.async_client(),
+            stream_usage=True,  # 流式调用也返回用量（含上下文缓存命中的Token数）
         )
     
     def validate_config(self, config: Dict[str, Any]) -> bool:
         """验证DeepSeek配置"""
         api_key = config.get("api_key") or os.getenv("DEEPSEEK_API_KEY") or os.getenv("SILICONFLOW_API_KEY")
         return bool(api_key)
-
+    
+    def probe(self, config: Dict[str, Any], timeout: float = 2) -> None:
+        """探测DeepSeek服务（请求/models，不消耗Token）"""
+        import requests
+        api_key = config.get("api_key") or os.getenv("DEEPSEEK_API_KEY") or os.getenv("SILICONFLOW_API_KEY")
+        if not api_key:
+            raise ValueError("API Key未设置")
+        base_url = config.get("base_url", "https://api.siliconflow.cn/v1")
+        response = requests.get(
+            f"{base_url.rstrip('/')}/models",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=timeout
+        )
+        response.raise_for_status()
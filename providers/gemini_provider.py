@@ -3,12 +3,16 @@ Google Gemini模型提供者实现
 """
 from langchain_google_genai import ChatGoogleGenerativeAI
 from core.model_provider import ModelProvider
+from core.http_pools import http_pools
 from typing import Any, Dict
 import os
 
 class GeminiProvider(ModelProvider):
     """Google Gemini模型提供者"""
     
+    # 免费额度的请求频率限制较低
+    default_limits = {"max_concurrency": 4, "requests_per_minute": 15}
+    
     def get_llm(self, config: Dict[str, Any]) -> ChatGoogleGenerativeAI:
         """
         创建Gemini LLM实例
@@ -49,16 +53,36 @@ class GeminiProvider(ModelProvider):
         # - 需要稳定的网络连接
         # - API密钥不要提交到代码仓库
         # ====================================
+        # client_args同时用于SDK的同步和异步httpx客户端，共享transport两者都支持
+        pool = http_pools.get("gemini", config.get("http_pool", {}))
+        llm_kwargs = {}
+        if config.get("cached_content"):
+            # 显式缓存：预先创建的缓存内容名称（如"cachedContents/xxx"），其中的内容不再随请求发送
+            llm_kwargs["cached_content"] = config["cached_content"]
         return ChatGoogleGenerativeAI(
             model=config.get("model", "gemini-pro"),
             google_api_key=api_key,
             temperature=config.get("temperature", 0.7),
             timeout=30,  # 30秒超时
             max_retries=2,  # 最多重试2次
+            client_args={"transport": pool.transport},
+            **llm_kwargs,
         )
     
     def validate_config(self, config: Dict[str, Any]) -> bool:
         """验证Gemini配置"""
         api_key = config.get("api_key") or os.getenv("GOOGLE_API_KEY")
         return bool(api_key)
-
+    
+    def probe(self, config: Dict[str, Any], timeout: float = 2) -> None:
+        """探测Gemini服务（请求模型列表，不消耗Token）"""
+        import requests
+        api_key = config.get("api_key") or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY未设置")
+        response = requests.get(
+            "https://generativelanguage.googleapis.com/v1beta/models",
+            params={"key": api_key, "pageSize": 1},
+            timeout=timeout
+        )
+        response.raise_for_status()
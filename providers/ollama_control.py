@@ -0,0 +1,195 @@
+"""
+Ollama控制面客户端 - 模型列表、健康探测等管理类请求共用一个带连接池的HTTP会话
+
+模型列表带短TTL缓存：过期后先返回旧数据，由后台线程刷新，前端轮询不会阻塞工作线程。
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from core.config_snapshot import config_store
+from core.single_flight import SingleFlight
+
+
+class OllamaModelList:
+    """一次模型列表查询的结果"""
+    
+    __slots__ = ("base_url", "models", "etag", "fetched_at")
+    
+    def __init__(self, base_url: str, models: List[str]):
+        self.base_url = base_url
+        self.models = models
+        self.etag = hashlib.sha1(json.dumps(models).encode("utf-8")).hexdigest()[:16]
+        self.fetched_at = time.time()
+    
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+
+class OllamaControlClient:
+    """
+    Ollama控制面客户端
+    
+    - 所有请求共用一个requests.Session（HTTP keep-alive连接池），不再每次新建连接
+    - list_models()缓存models_cache_ttl秒；过期后返回旧结果并在后台刷新，
+      超过max_stale秒或base_url变化时同步刷新（并发的同步刷新只请求一次）
+    """
+    
+    def __init__(self, control_config: Dict[str, Any] = None):
+        """
+        初始化控制面客户端
+        
+        Args:
+            control_config: 控制面配置，默认读取当前配置快照的"ollama_control"配置节
+        """
+        self._config = control_config
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._cache: Optional[OllamaModelList] = None
+        self._fetch_flight = SingleFlight()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._last_error: Optional[str] = None
+        self._stats = {"requests": 0, "errors": 0, "cache_hits": 0, "stale_hits": 0, "refreshes": 0, "warmups": 0}
+        self._last_warmup: Optional[Dict[str, Any]] = None
+    
+    def _get_config(self) -> Dict[str, Any]:
+        if self._config is not None:
+            return self._config
+        return config_store.current().section("ollama_control")
+    
+    def _get_session(self):
+        """创建共享会话（首次使用时才导入requests）"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    
+                    pool_size = self._get_config().get("pool_maxsize", 4)
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+    
+    def request(self, method: str, base_url: str, path: str, timeout: float = None, **kwargs):
+        """
+        发送控制面请求（非2xx状态码抛出requests.HTTPError）
+        
+        Args:
+            method: HTTP方法
+            base_url: Ollama服务地址
+            path: 请求路径，如"/api/tags"
+            timeout: 超时时间（秒），默认使用配置中的timeout
+        """
+        timeout = timeout if timeout is not None else self._get_config().get("timeout", 2)
+        self._stats["requests"] += 1
+        try:
+            response = self._get_session().request(method, f"{base_url.rstrip('/')}{path}", timeout=timeout, **kwargs)
+            response.raise_for_status()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        return response
+    
+    def get(self, base_url: str, path: str, timeout: float = None):
+        return self.request("GET", base_url, path, timeout)
+    
+    def fetch_models(self, base_url: str, timeout: float = None) -> OllamaModelList:
+        """直接请求/api/tags并更新缓存"""
+        response = self.get(base_url, "/api/tags", timeout)
+        models = [model["name"] for model in response.json().get("models", [])]
+        result = OllamaModelList(base_url, models)
+        self._cache = result
+        self._last_error = None
+        self._stats["refreshes"] += 1
+        return result
+    
+    def list_models(self, base_url: str = None) -> OllamaModelList:
+        """
+        获取模型列表（带缓存）
+        
+        Raises:
+            requests.RequestException: 没有可用的缓存且请求失败
+        """
+        base_url = base_url or config_store.current().section("ollama").get("base_url", "http://localhost:11434")
+        control_config = self._get_config()
+        ttl = control_config.get("models_cache_ttl", 10)
+        max_stale = control_config.get("models_max_stale", 300)
+        
+        cached = self._cache
+        if cached is None or cached.base_url != base_url or cached.age >= max_stale:
+            result, _ = self._fetch_flight.do(base_url, lambda: self.fetch_models(base_url))
+            return result
+        if cached.age < ttl:
+            self._stats["cache_hits"] += 1
+        else:
+            self._stats["stale_hits"] += 1
+            self._refresh_in_background(base_url)
+        return cached
+    
+    def _refresh_in_background(self, base_url: str) -> None:
+        """后台刷新模型列表（同一时间只有一个刷新线程）"""
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        
+        def refresh():
+            try:
+                self.fetch_models(base_url)
+            except Exception as e:
+                # 刷新失败时保留旧数据，下次过期后再重试
+                self._last_error = str(e)
+            finally:
+                with self._refresh_lock:
+                    self._refreshing = False
+        
+        threading.Thread(target=refresh, name="ollama-models-refresh", daemon=True).start()
+    
+    def warm_up(self, base_url: str, model: str, keep_alive: Any = None, timeout: float = None) -> Dict[str, Any]:
+        """
+        预加载模型（发送空prompt的/api/generate，Ollama只加载模型不生成），同时设置keep_alive
+        
+        Returns:
+            {"model", "load_ms", "total_ms"}，load_ms为0表示模型已在内存中
+        """
+        payload = {"model": model, "prompt": "", "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        timeout = timeout if timeout is not None else self._get_config().get("warmup_timeout", 120)
+        start = time.perf_counter()
+        response = self.request("POST", base_url, "/api/generate", timeout=timeout, json=payload)
+        data = response.json()
+        result = {
+            "model": model,
+            "load_ms": round(data.get("load_duration", 0) / 1e6, 1),
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+            "at": time.time(),
+        }
+        self._stats["warmups"] += 1
+        self._last_warmup = result
+        return result
+    
+    def invalidate(self) -> None:
+        """清除模型列表缓存（如拉取或删除模型后）"""
+        self._cache = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取控制面请求和模型列表缓存统计"""
+        cached = self._cache
+        return {
+            **self._stats,
+            "pooled": self._session is not None,
+            "models_cached": len(cached.models) if cached else 0,
+            "models_age_seconds": round(cached.age, 1) if cached else None,
+            "last_error": self._last_error,
+            "last_warmup": self._last_warmup,
+        }
+
+
+ollama_control = OllamaControlClient()
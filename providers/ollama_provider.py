@@ -3,11 +3,23 @@ Ollama模型提供者实现
 """
 from langchain_ollama import ChatOllama
 from core.model_provider import ModelProvider
+from core.provider_health import provider_health
+from core.http_pools import http_pools
+from providers.ollama_control import ollama_control
+from core.config_snapshot import config_store
 from typing import Any, Dict
+import threading
+import time
 
 class OllamaProvider(ModelProvider):
     """Ollama模型提供者"""
     
+    # 本地Ollama通常只有一个推理进程，并发请求只会排队并拖慢每个请求
+    default_limits = {"max_concurrency": 1}
+    
+    def __init__(self):
+        self._ping_thread = None
+    
     def get_llm(self, config: Dict[str, Any]) -> ChatOllama:
         """
         创建Ollama LLM实例
@@ -34,19 +46,65 @@ class OllamaProvider(ModelProvider):
         # 
         # 优势：完全免费、本地运行、数据隐私好、无需网络（模型下载后）
         # ====================================
+        # ollama客户端只接受httpx参数，传入共享transport使所有实例复用同一个连接池
+        pool = http_pools.get("ollama", config.get("http_pool", {}))
         return ChatOllama(
             model=config.get("model", "qwen2.5:1.5b"),
             base_url=config.get("base_url", "http://localhost:11434"),
             temperature=config.get("temperature", 0.7),
+            keep_alive=self.get_keep_alive(config),
+            client_kwargs={"transport": pool.transport},
         )
     
-    def validate_config(self, config: Dict[str, Any]) -> bool:
-        """验证Ollama配置"""
+    def get_keep_alive(self, config: Dict[str, Any]) -> Any:
+        """获取当前模型的keep_alive（model_keep_alive中的配置优先）"""
+        model = config.get("model", "qwen2.5:1.5b")
+        return config.get("model_keep_alive", {}).get(model, config.get("keep_alive"))
+    
+    def warm_up(self, config: Dict[str, Any]) -> None:
+        """预加载配置的模型，并按需启动定期保活"""
+        if config.get("keep_alive_ping_interval"):
+            self._start_keep_alive_pings()
+        if not config.get("warmup", True):
+            return
+        model = config.get("model", "qwen2.5:1.5b")
         try:
-            import requests
-            base_url = config.get("base_url", "http://localhost:11434")
-            response = requests.get(f"{base_url}/api/tags", timeout=2)
-            return response.status_code == 200
-        except:
-            return False
-
+            result = ollama_control.warm_up(
+                config.get("base_url", "http://localhost:11434"), model, self.get_keep_alive(config)
+            )
+            print(f"🔥 Ollama模型 {model} 已预加载（加载 {result['load_ms']} ms）")
+        except Exception as e:
+            print(f"⚠️ Ollama模型 {model} 预加载失败: {e}")
+    
+    def _start_keep_alive_pings(self) -> None:
+        """启动保活线程：当前模型类型为Ollama时，定期发送保活请求，防止模型被卸载"""
+        if self._ping_thread is not None:
+            return
+        
+        def run():
+            while True:
+                interval = config_store.current().section("ollama").get("keep_alive_ping_interval", 0)
+                time.sleep(interval or 60)
+                snapshot = config_store.current()
+                config = snapshot.section("ollama")
+                if not config.get("keep_alive_ping_interval") or snapshot.model_type != "ollama":
+                    continue
+                try:
+                    ollama_control.warm_up(
+                        config.get("base_url", "http://localhost:11434"),
+                        config.get("model", "qwen2.5:1.5b"),
+                        self.get_keep_alive(config)
+                    )
+                except Exception as e:
+                    print(f"⚠️ Ollama保活请求失败: {e}")
+        
+        self._ping_thread = threading.Thread(target=run, name="ollama-keep-alive", daemon=True)
+        self._ping_thread.start()
+    
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证Ollama配置（读取后台健康探测的缓存结果，熔断时返回False）"""
+        return provider_health.is_available("ollama")
+    
+    def probe(self, config: Dict[str, Any], timeout: float = 2) -> None:
+        """探测Ollama服务（通过共享连接池请求/api/tags，同时刷新模型列表缓存）"""
+        ollama_control.fetch_models(config.get("base_url", "http://localhost:11434"), timeout=timeout)
@@ -0,0 +1,55 @@
+"""
+回放模型提供者实现
+按请求哈希返回录像（core.cassette）中录制的模型响应和工具输出，不访问任何模型服务，
+供基准测试和回归测试离线运行
+"""
+import os
+from typing import Any, Dict, List
+from langchain_core.tools import BaseTool
+from core.cassette import CassetteTool, ReplayChatModel, cassette_store
+from core.model_provider import ModelProvider
+
+
+class ReplayProvider(ModelProvider):
+    """回放模型提供者（录像由 cassette.mode = "record" 录制）"""
+    
+    # 不访问任何服务，调度器不做限制
+    default_limits = {}
+    
+    def get_llm(self, config: Dict[str, Any]) -> ReplayChatModel:
+        """
+        创建回放ChatModel
+        
+        Args:
+            config: 包含cassette、model、latency、fixed_latency_ms、stream_chunk_chars的字典
+        
+        Returns:
+            ReplayChatModel实例，请求在录像中找不到时抛出CassetteMissError
+        """
+        return ReplayChatModel(
+            cassette=cassette_store.get(config["cassette"]),
+            model_name=config.get("model", "replay"),
+            latency=config.get("latency", "recorded"),
+            fixed_latency_ms=config.get("fixed_latency_ms", 0),
+            stream_chunk_chars=config.get("stream_chunk_chars", 4),
+        )
+    
+    def wrap_tools(self, tools: List[BaseTool], config: Dict[str, Any]) -> List[BaseTool]:
+        """工具调用同样回放录制的输出（tools为"live"时执行真实工具）"""
+        mode = config.get("tools", "replay")
+        if mode == "live":
+            return tools
+        cassette = cassette_store.get(config["cassette"])
+        return [
+            CassetteTool.wrap(
+                tool, cassette, mode,
+                latency=config.get("latency", "recorded"),
+                fixed_latency_ms=config.get("fixed_latency_ms", 0),
+            )
+            for tool in tools
+        ]
+    
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证回放配置（录像文件存在）"""
+        path = config.get("cassette")
+        return bool(path) and os.path.exists(path)